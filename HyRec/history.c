@@ -70,6 +70,7 @@ void rec_set_derived_params(REC_COSMOPARAMS *param){
     }
      
     param->nzrt = (long) floor(2+log((1.+ZSTART)/(1.+z))/DLNA) - param->izH0; 
+    param->nring = param->nzrt;  /* whole history unless a shorter ring buffer is requested */
 }
 
 
@@ -175,22 +176,29 @@ double hyrec_tm_(double* a){
 
 double *nurho;
 double lnlamstart, dlnlam;
-//injection
-double *Xion, *Xexc, *Xheat;
-double lnz1start, dlnz1;
-//injection
 
 void init_mnu() {
   /* Read table of massive neutrino energy density */
   
   FILE *f;
   unsigned i;
+  int version;
   double lam;
+  char line[1024];
   char *buffer = (char *) malloc (1024);
   
-  strcpy(buffer, HYRECPATH);
-  strcat(buffer, MNU_FILE);
+  hyrec_file(buffer, MNU_FILE);
   f = fopen(buffer, "r");
+  if (f == NULL) {
+    fprintf(stderr, "Error: could not open %s; generate it with \"python background.py nurho\"\n", buffer);
+    exit(1);
+  }
+
+  /* The first line reads "# nurho version <n>: ..." */
+  if (fgets(line, 1024, f) == NULL || sscanf(line, "# nurho version %d", &version) != 1 || version != MNU_VERSION) {
+    fprintf(stderr, "Error: %s is not a version %d table; regenerate it with \"python background.py nurho\"\n", buffer, MNU_VERSION);
+    exit(1);
+  }
   free(buffer);
   
   nurho = create_1D_array(NMNU);
@@ -216,67 +224,70 @@ double rho_mnu(double lnlam) {
 }
 
 //injection
-void init_injection(double INJion[63], double INJexc[63], double INJheat[63]) {
-
-  unsigned i;
+void init_injection(REC_COSMOPARAMS *param, double *z1, double *INJion, double *INJexc, double *INJheat, long n) {
+  /* z1 = 1+z are the n >= 4 redshifts of the injection arrays, uniformly spaced in log in either order.
+     The arrays are copied into param and stored in order of increasing z1; previous ones are released. */
+
+  long i, j;
+  int reverse;
+
+  reverse = z1[n-1] < z1[0];
+  param->inj_lnz1start = log(reverse ? z1[n-1] : z1[0]);
+  param->inj_dlnz1 = fabs(log(z1[n-1]/z1[0]))/(n-1);
+
+  free_injection(param);
+  param->inj_nz1 = n;
+  param->inj_ion = create_1D_array(n);
+  param->inj_exc = create_1D_array(n);
+  param->inj_heat = create_1D_array(n);
+
+  for (i = 0; i < n; i++) {
+    j = reverse ? n-1-i : i;
+    param->inj_ion[i] = INJion[j];
+    param->inj_exc[i] = INJexc[j];
+    param->inj_heat[i] = INJheat[j];
+  }
 
-  lnz1start = log(Z1MIN);
-  dlnz1 = log(Z1MAX/Z1MIN)/(NZ1-1);
+}
 
-  Xion = create_1D_array(NZ1);
-  Xexc = create_1D_array(NZ1);
-  Xheat = create_1D_array(NZ1);
+void free_injection(REC_COSMOPARAMS *param) {
 
-  for (i = 0; i < NZ1; i++) {
-    Xion[i] = INJion[i];
-    Xexc[i] = INJexc[i];
-    Xheat[i] = INJheat[i];
+  if (param->inj_nz1 > 0) {
+    free(param->inj_ion);
+    free(param->inj_exc);
+    free(param->inj_heat);
   }
+  param->inj_nz1 = 0;
 
 }
-//injection
 
-//injection
-double rec_Xion(REC_COSMOPARAMS *param, double z) {
-  
+double rec_injection(REC_COSMOPARAMS *param, double *X, double z) {
+
   double lnz1;
+  if (param->inj_nz1 == 0) return 0.;
   lnz1 = log(z+1.);
-  if(lnz1 < lnz1start) { // not sure what how we can deal with this regime...
-    return Xion[0];
-  } else if (lnz1 > lnz1start+dlnz1*(NZ1-1)) {
-    return Xion[NZ1-1];
+  if(lnz1 < param->inj_lnz1start) { // not sure what how we can deal with this regime...
+    return X[0];
+  } else if (lnz1 > param->inj_lnz1start+param->inj_dlnz1*(param->inj_nz1-1)) {
+    return X[param->inj_nz1-1];
   } else {
-    return rec_interp1d(lnz1start, dlnz1, Xion, NZ1, lnz1);
+    return rec_interp1d(param->inj_lnz1start, param->inj_dlnz1, X, param->inj_nz1, lnz1);
   };
-  
+
+}
+//injection
+
+//injection
+double rec_Xion(REC_COSMOPARAMS *param, double z) {
+  return rec_injection(param, param->inj_ion, z);
 }
 
 double rec_Xexc(REC_COSMOPARAMS *param, double z) {
-  
-  double lnz1;
-  lnz1 = log(z+1.);
-  if(lnz1 < lnz1start) { // not sure what how we can deal with this regime...
-    return Xexc[0];
-  } else if (lnz1 > lnz1start+dlnz1*(NZ1-1)) {
-    return Xexc[NZ1-1];
-  } else {
-    return rec_interp1d(lnz1start, dlnz1, Xexc, NZ1, lnz1);
-  };
-  
+  return rec_injection(param, param->inj_exc, z);
 }
 
 double rec_Xheat(REC_COSMOPARAMS *param, double z) {
-  
-  double lnz1;
-  lnz1 = log(z+1.);
-  if(lnz1 < lnz1start) { // not sure what how we can deal with this regime...
-    return Xheat[0];
-  } else if (lnz1 > lnz1start+dlnz1*(NZ1-1)) {
-    return Xheat[NZ1-1];
-  } else {
-    return rec_interp1d(lnz1start, dlnz1, Xheat, NZ1, lnz1);
-  };
-  
+  return rec_injection(param, param->inj_heat, z);
 }
 //injection
 
@@ -320,6 +331,49 @@ double rec_HubbleConstant(REC_COSMOPARAMS *param, double z) {
 }
 #endif
 
+/*************************************************************************************
+Hubble rate tabulated on the integration grid z[iz] = (1+ZSTART)*exp(-iz*DLNA)-1, 
+iz = 0 ... nz-1, once per cosmology. H are the values in sec^-1 if given (e.g. computed 
+consistently with the background in python), otherwise rec_HubbleConstant is tabulated. 
+*************************************************************************************/
+
+void init_hubble(REC_COSMOPARAMS *param, double *H, long n) {
+
+  long iz;
+
+  free_hubble(param);
+  param->Hext  = H != NULL;
+  param->nHtab = param->Hext ? n : param->nz;
+  param->Htab  = create_1D_array(param->nHtab);
+  for (iz = 0; iz < param->nHtab; iz++) {
+    param->Htab[iz] = param->Hext ? H[iz] : rec_HubbleConstant(param, (1.+ZSTART)*exp(-DLNA*iz) - 1.);
+  }
+}
+
+void free_hubble(REC_COSMOPARAMS *param) {
+
+  if (param->nHtab > 0) free(param->Htab);
+  param->nHtab = 0;
+  param->Hext  = 0;
+
+}
+
+/* Hubble rate at z = z[iz] from the table, interpolated in log(1+z) if iz < 0 (off the grid).
+   Computed directly if there is no table or z is outside of it. */
+double rec_Hubble(REC_COSMOPARAMS *param, long iz, double z) {
+
+  double lna;
+
+  if (iz >= 0 && iz < param->nHtab) return param->Htab[iz];
+  if (param->nHtab >= 4) {
+    lna = -log(1.+z);
+    if (lna >= -log(1.+ZSTART) && lna <= -log(1.+ZSTART)+DLNA*(param->nHtab-1)) {
+      return rec_interp1d(-log(1.+ZSTART), DLNA, param->Htab, param->nHtab, lna);
+    }
+  }
+  return rec_HubbleConstant(param, z);
+}
+
 
 
 /************************************************************************************************* 
@@ -358,6 +412,9 @@ void rec_get_cosmoparam(FILE *fin, FILE *fout, REC_COSMOPARAMS *param) {
     /* if (fout!=NULL && PROMPT==1) fprintf(fout, "Enter ratio of electron mass at last scattering to today's value, me(rec)/me(now): "); */
     /* fscanf(fin, "%lg", &(param->meR));  */
 
+	param->inj_nz1 = 0;  /* no injection */
+	param->nHtab = 0;    /* H(z) tabulated by rec_build_history */
+	param->zmin = param->fast_tol = 0.;  /* full history with fixed steps */
 	rec_set_derived_params(param);
 
     if (fout!=NULL && PROMPT==1) fprintf(fout, "\n");
@@ -394,19 +451,19 @@ If xHeII is close enough to Saha equilibrium do a post-Saha expansion.
 May 2012: removed unused z_prev, z_prev2 variables
 ***********************************************************************************************/
 
-void rec_get_xe_next1_He(REC_COSMOPARAMS *param, double z_in, double *xHeII, 
+void rec_get_xe_next1_He(REC_COSMOPARAMS *param, long iz_in, double z_in, double *xHeII, 
                          double *dxHeIIdlna_prev, double *dxHeIIdlna_prev2, int *post_saha) {
 
     double H, xH1s, xH1s_p, xH1s_m, xHeIISaha, dxHeIISaha_dlna, DdxHeIIdlna_Dxe, dxHeIIdlna, z_out, Dxe;   
     
-    H          = rec_HubbleConstant(param, z_in); 
+    H          = rec_Hubble(param, iz_in, z_in); 
     xH1s       = rec_saha_xH1s(*xHeII, param->nH0, param->T0, z_in, param->fsR, param->meR);
     dxHeIIdlna = rec_helium_dxHeIIdlna(xH1s, *xHeII, param->nH0, param->T0, param->fHe, H, z_in, param->fsR, param->meR);         
    
     /* Post-Saha approximation during the early phase of HeII->HeI recombination */
     if (*post_saha == 1) {
         z_out     = (1.+z_in)*exp(-DLNA)-1.;
-        H         = rec_HubbleConstant(param, z_out);  
+        H         = rec_Hubble(param, iz_in+1, z_out);  
         xHeIISaha = rec_saha_xHeII(param->nH0, param->T0, param->fHe, z_out, param->fsR, param->meR);   
  
         dxHeIISaha_dlna  = (1.+z_out)*(rec_saha_xHeII(param->nH0, param->T0, param->fHe, z_out-0.5, param->fsR, param->meR)
@@ -448,7 +505,7 @@ double rec_xH1s_postSaha(REC_COSMOPARAMS *param, unsigned iz_out, double z_out,
    
      xH1sSaha = rec_saha_xH1s(xHeII_out, param->nH0, param->T0, z_out, param->fsR, param->meR);
      xHIISaha = 1.-xH1sSaha; 
-     H        = rec_HubbleConstant(param, z_out); 
+     H        = rec_Hubble(param, iz_out, z_out); 
      T        = kBoltz*param->T0 * (ainv=1.+z_out);  /* Convert to eV for hydrogen rec functions */
      nH       = 1e-6*param->nH0 * ainv*ainv*ainv;    /* Convert to cm^-3 for hydrogen rec functions */
 
@@ -463,12 +520,12 @@ double rec_xH1s_postSaha(REC_COSMOPARAMS *param, unsigned iz_out, double z_out,
                          /* (partial xHII)/(partial xHeII).dxHeII/dlna */
      }
      dxH1sdlna_Saha = -rec_dxHIIdlna(MODEL, xHIISaha + xHeII_out, xHIISaha, nH, H, T, T, rate_table, twog_params, 
-                                     Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_out-param->izH0, z_out, param->fsR, param->meR);
+                                     Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_out-param->izH0, z_out, param->fsR, param->meR, param->nring);
      Dxe            = 0.01*xH1sSaha;
      DdxH1sdlna_DxH1s = (rec_dxHIIdlna(MODEL, xHIISaha+Dxe + xHeII_out, xHIISaha+Dxe, nH, H, T, T, rate_table, twog_params, 
-                                     Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_out-param->izH0, z_out, param->fsR, param->meR)
+                                     Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_out-param->izH0, z_out, param->fsR, param->meR, param->nring)
                        -rec_dxHIIdlna(MODEL, xHIISaha-Dxe + xHeII_out, xHIISaha-Dxe, nH, H, T, T, rate_table, twog_params, 
-                                     Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_out-param->izH0, z_out, param->fsR, param->meR))/2./Dxe; 
+                                     Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_out-param->izH0, z_out, param->fsR, param->meR, param->nring))/2./Dxe; 
 
      xH1s = xH1sSaha + (dxH1sSaha_dlna - dxH1sdlna_Saha)/DdxH1sdlna_DxH1s;
 
@@ -497,7 +554,7 @@ void get_rec_next2_HHe(REC_COSMOPARAMS *param, unsigned iz_in, double z_in, doub
       xe_in    = xHeII_in + (1.-xH1s_in); 
 
       /* Evolve HeII by solving ODE */ 
-      H           = rec_HubbleConstant(param, z_in);      
+      H           = rec_Hubble(param, iz_in, z_in);      
       dxHeIIdlna  = rec_helium_dxHeIIdlna(xH1s_in, xHeII_in, param->nH0, param->T0, param->fHe, H, z_in, param->fsR, param->meR); 
       *xHeII     += DLNA * (1.25 * dxHeIIdlna - 0.25 * (*dxHeIIdlna_prev2));
        
@@ -506,7 +563,7 @@ void get_rec_next2_HHe(REC_COSMOPARAMS *param, unsigned iz_in, double z_in, doub
       TM        = kBoltz*Tm_in; 
       nH        = 1e-6*param->nH0 * ainv*ainv*ainv;
       dxHIIdlna = rec_dxHIIdlna(MODEL, xe_in, (1.-xH1s_in), nH, H, TM, TR, rate_table, twog_params, 
-                                Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_in-param->izH0, z_in, param->fsR, param->meR);
+                                Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz_in-param->izH0, z_in, param->fsR, param->meR, param->nring);
 
       /* If Hydrogen is still close to Saha equilibrium do a post-Saha expansion for Hydrogen */  
       if(*post_saha == 1){
@@ -544,7 +601,7 @@ void rec_get_xe_next1_H(REC_COSMOPARAMS *param, double z_in, double xe_in, doubl
 
     TR = kBoltz*param->T0 * (ainv=1.+z_in);
     nH = 1e-6*param->nH0 * ainv*ainv*ainv;
-    H  = rec_HubbleConstant(param, z_in); 
+    H  = rec_Hubble(param, iz, z_in); 
     //injection
     Yion = rec_Xion(param, z_in);
     Yexc = rec_Xexc(param, z_in);
@@ -555,7 +612,7 @@ void rec_get_xe_next1_H(REC_COSMOPARAMS *param, double z_in, double xe_in, doubl
     model = (iz-param->izH0 < param->nzrt || MODEL != FULL) ? MODEL : EMLA2s2p;   
 
     dxedlna = rec_dxHIIdlna(model, xe_in, xe_in, nH, H, TM, TR, rate_table, twog_params, 
-                            Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz-param->izH0, z_in, param->fsR, param->meR);    
+                            Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz-param->izH0, z_in, param->fsR, param->meR, param->nring);    
     //injection
     C  = 0.5; // not correct; this should be Peebles' C-factor
     dxedlna += Yion + Yexc * (1.-C);
@@ -595,7 +652,7 @@ void rec_get_xe_next2_HTm(int func_select, REC_COSMOPARAMS *param, double z_in,
 
     TR = kBoltz*param->T0 * (ainv=1.+z_in);
     nH = 1e-6*param->nH0 * ainv*ainv*ainv;
-    H  = rec_HubbleConstant(param, z_in); 
+    H  = rec_Hubble(param, iz, z_in); 
     //injection
     Yion = rec_Xion(param, z_in);
     Yexc = rec_Xexc(param, z_in);
@@ -607,7 +664,7 @@ void rec_get_xe_next2_HTm(int func_select, REC_COSMOPARAMS *param, double z_in,
     model = (iz-param->izH0 < param->nzrt || func_select != FULL) ? func_select : EMLA2s2p;   
 
     dxedlna = rec_dxHIIdlna(model, xe_in, xe_in, nH, H, TM, TR, rate_table, twog_params, 
-                            Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz-param->izH0, z_in, param->fsR, param->meR);    
+                            Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, param->zH0, iz-param->izH0, z_in, param->fsR, param->meR, param->nring);    
     //injection
     C  = 0.5; // not correct; this should be Peebles' C-factor
     dxedlna += Yion + Yexc * (1.-C);
@@ -634,31 +691,114 @@ Added May 2012: The radiation field was added as an input so it can be extracted
 
 void rec_build_history(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
                        double *xe_output, double *Tm_output, double **Dfnu_hist, double *Dfminus_Ly_hist[3]) {
-  
+
+   REC_STATE state;
+   int own_hubble;
+
+   /* tabulate H(z) for this history unless the caller already did */
+   own_hubble = param->nHtab == 0;
+   if (own_hubble) init_hubble(param, NULL, 0);
+
+   rec_init_state(param, &state, Dfminus_Ly_hist);
+   rec_evolve_history(param, rate_table, twog_params, xe_output, Tm_output, Dfnu_hist, Dfminus_Ly_hist,
+                      &state, param->nz, PHASE_DONE);
+   rec_free_state(&state);
+   if (own_hubble) free_hubble(param);
+}
+
+/**************************************************************************************************** 
+Resumable integration of the recombination history.
+The state holds everything besides the outputs xe_output[0..iz-1], Tm_output[0..iz-1] and the radiation 
+field (Dfnu_hist if not NULL, and the ring buffer Dfminus_Ly_hist) that is needed to continue, so a copy of the state together with 
+copies of these arrays is a checkpoint from which the integration can be resumed.
+****************************************************************************************************/
+
+void rec_init_state(REC_COSMOPARAMS *param, REC_STATE *state, double *Dfminus_Ly_hist[3]) {
+
    long iz;
-   double z, dxHIIdlna_prev, dxHIIdlna_prev2, dTmdlna_prev, dTmdlna_prev2, dxHeIIdlna_prev, dxHeIIdlna_prev2;
-   double Delta_xe, xHeII, xH1s;
-   double **Dfminus_hist;
-   int post_saha;
+
+   state->Dfminus_hist = create_2D_array(NVIRT, param->nring);
+
+   /* Make sure the input spectrum is initialized at zero */
+   for (iz=0; iz<param->nring; iz++) Dfminus_Ly_hist[0][iz] = Dfminus_Ly_hist[1][iz] = Dfminus_Ly_hist[2][iz] = 0;  
+
+   state->iz = 0;
+   state->z = ZSTART;
+   state->phase = PHASE_HeIII;
+   state->iz_inj = param->nz;
+   state->Delta_xe = param->fHe;   /* Delta_xe = xHeIII here */
+}
+
+void rec_copy_state(REC_COSMOPARAMS *param, REC_STATE *dest, REC_STATE *src) {
+
+   long i, iz;
+
+   *dest = *src;
+   dest->Dfminus_hist = create_2D_array(NVIRT, param->nring);
+   for (i = 0; i < NVIRT; i++) {
+      for (iz = 0; iz < param->nring; iz++) dest->Dfminus_hist[i][iz] = src->Dfminus_hist[i][iz];
+   }
+}
+
+void rec_free_state(REC_STATE *state) {
+   free_2D_array(state->Dfminus_hist, NVIRT);
+}
+
+/* Integrates until the outputs up to iz_stop-1 are computed or phase phase_stop is reached.
+   Outputs below param->zmin are not integrated but set to NaN. */
+void rec_evolve_history(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
+                        double *xe_output, double *Tm_output, double **Dfnu_hist, double *Dfminus_Ly_hist[3],
+                        REC_STATE *s, long iz_stop, int phase_stop) {
+
+   long iz_end;
+
+   if (iz_stop > param->nz) iz_stop = param->nz;
+   iz_end = rec_iz_end(param);
+
+   rec_evolve_phases(param, rate_table, twog_params, xe_output, Tm_output, Dfnu_hist, Dfminus_Ly_hist,
+                     s, iz_stop < iz_end ? iz_stop : iz_end, phase_stop);
+
+   if (s->iz >= iz_end && s->iz < iz_stop) {
+      for (; s->iz < iz_stop; s->iz++) xe_output[s->iz] = Tm_output[s->iz] = NAN;
+      s->z = (1.+ZSTART)*exp(-DLNA*(s->iz-1)) - 1.;
+      if (s->iz >= param->nz) s->phase = PHASE_DONE;
+   }
+}
+
+/* Number of outputs computed: those down to param->zmin and two more, so that interpolation
+   is defined down to zmin; all outputs if zmin <= ZEND */
+long rec_iz_end(REC_COSMOPARAMS *param) {
+
+   long iz_end;
+
+   if (param->zmin <= ZEND) return param->nz;
+   iz_end = (long) floor(log((1.+ZSTART)/(1.+param->zmin))/DLNA) + 3;
+   return iz_end < param->nz ? iz_end : param->nz;
+}
+
+void rec_evolve_phases(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
+                        double *xe_output, double *Tm_output, double **Dfnu_hist, double *Dfminus_Ly_hist[3],
+                        REC_STATE *s, long iz_stop, int phase_stop) {
+  
    //injection
    double Yheat;
    //injection
-  
-   Dfminus_hist = create_2D_array(NVIRT, param->nzrt);
-  
-   /* Make sure the input spectrum is initialized at zero */
-   for (iz=0; iz<param->nzrt; iz++) Dfminus_Ly_hist[0][iz] = Dfminus_Ly_hist[1][iz] = Dfminus_Ly_hist[2][iz] = 0;  
- 
-   z = ZSTART; 
-  
+
+   if (iz_stop > param->nz) iz_stop = param->nz;
+
+   switch (s->phase) {
+
+   case PHASE_HeIII:
+   if (s->phase >= phase_stop) return;
+
    /********* He III -> II Saha phase. Tm = Tr. Stop when xHeIII = 1e-8 *********/
-   Delta_xe = param->fHe;   /* Delta_xe = xHeIII here */
 
-   for(iz=0; iz<param->nz && Delta_xe > 1e-8; iz++) {
-      z = (1.+ZSTART)*exp(-DLNA*iz) - 1.;
-      xe_output[iz] = rec_xesaha_HeII_III(param->nH0, param->T0, param->fHe, z, &Delta_xe, param->fsR, param->meR);
-      Tm_output[iz] = param->T0 * (1.+z); 
+   for(; s->iz<iz_stop && s->Delta_xe > 1e-8; s->iz++) {
+      s->z = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
+      xe_output[s->iz] = rec_xesaha_HeII_III(param->nH0, param->T0, param->fHe, s->z, &s->Delta_xe, param->fsR, param->meR);
+      Tm_output[s->iz] = param->T0 * (1.+s->z); 
    }
+   if (s->iz >= iz_stop) return;
   
    /******** He II -> I recombination. 
              Hydrogen in Saha equilibrium with the free electrons. 
@@ -668,19 +808,24 @@ void rec_build_history(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_
              Start with post-Saha expansion. 
     ********/
 
-   dxHeIIdlna_prev2 = (xe_output[iz-2] - xe_output[iz-4])/2./DLNA;  
-   dxHeIIdlna_prev  = (xe_output[iz-1] - xe_output[iz-3])/2./DLNA;    
+   s->dxHeIIdlna_prev2 = (xe_output[s->iz-2] - xe_output[s->iz-4])/2./DLNA;  
+   s->dxHeIIdlna_prev  = (xe_output[s->iz-1] - xe_output[s->iz-3])/2./DLNA;    
      
-   xHeII     = rec_saha_xHeII(param->nH0, param->T0, param->fHe, z, param->fsR, param->meR);  
-   post_saha = 1;                          /* Start with post-saha expansion */    
-
-   for(; iz < param->izH0+1; iz++) {
-        rec_get_xe_next1_He(param, z, &xHeII, &dxHeIIdlna_prev, &dxHeIIdlna_prev2, &post_saha);
-        z             = (1.+ZSTART)*exp(-DLNA*iz) - 1.;
-        xH1s          = rec_saha_xH1s(xHeII, param->nH0, param->T0, z, param->fsR, param->meR);
-        xe_output[iz] = (1.-xH1s) + xHeII;
-        Tm_output[iz] = rec_Tmss(xe_output[iz], param->T0*(1.+z), rec_HubbleConstant(param, z), param->fHe, param->fsR, param->meR);   
+   s->xHeII     = rec_saha_xHeII(param->nH0, param->T0, param->fHe, s->z, param->fsR, param->meR);  
+   s->post_saha = 1;                          /* Start with post-saha expansion */    
+   s->phase     = PHASE_HeII;
+
+   case PHASE_HeII:
+   if (s->phase >= phase_stop) return;
+
+   for(; s->iz < param->izH0+1 && s->iz < iz_stop; s->iz++) {
+        rec_get_xe_next1_He(param, s->iz-1, s->z, &s->xHeII, &s->dxHeIIdlna_prev, &s->dxHeIIdlna_prev2, &s->post_saha);
+        s->z             = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
+        s->xH1s          = rec_saha_xH1s(s->xHeII, param->nH0, param->T0, s->z, param->fsR, param->meR);
+        xe_output[s->iz] = (1.-s->xH1s) + s->xHeII;
+        Tm_output[s->iz] = rec_Tmss(xe_output[s->iz], param->T0*(1.+s->z), rec_Hubble(param, s->iz, s->z), param->fHe, param->fsR, param->meR);   
     }    
+   if (s->iz >= iz_stop) return;
 
 
     /******** H II -> I and He II -> I simultaneous recombination (rarely needed but just in case)
@@ -689,64 +834,187 @@ void rec_build_history(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_
               Start with post-saha expansion for hydrogen
      ********/
 
-   dxHIIdlna_prev2 = (xe_output[iz-2] - xe_output[iz-4])/2./DLNA - dxHeIIdlna_prev2;
-   dxHIIdlna_prev  = (xe_output[iz-1] - xe_output[iz-3])/2./DLNA - dxHeIIdlna_prev;
-   post_saha       = 1; 
+   s->dxHIIdlna_prev2 = (xe_output[s->iz-2] - xe_output[s->iz-4])/2./DLNA - s->dxHeIIdlna_prev2;
+   s->dxHIIdlna_prev  = (xe_output[s->iz-1] - xe_output[s->iz-3])/2./DLNA - s->dxHeIIdlna_prev;
+   s->post_saha       = 1; 
+   s->phase           = PHASE_HHe;
+
+   case PHASE_HHe:
+   if (s->phase >= phase_stop) return;
 
-   for(; iz<param->nz && xHeII > XHEII_MIN; iz++) {
-      get_rec_next2_HHe(param, iz-1, z, Tm_output[iz-1], &xH1s, &xHeII, rate_table, twog_params, Dfminus_hist, Dfminus_Ly_hist, 
-                        Dfnu_hist, &dxHIIdlna_prev,  &dxHeIIdlna_prev, &dxHIIdlna_prev2, &dxHeIIdlna_prev2, &post_saha);
-      xe_output[iz] = (1.-xH1s) + xHeII;
-      z             = (1.+ZSTART)*exp(-DLNA*iz) - 1.;
-      Tm_output[iz] = rec_Tmss(xe_output[iz], param->T0*(1.+z), rec_HubbleConstant(param, z), param->fHe, param->fsR, param->meR);       
+   for(; s->iz<iz_stop && s->xHeII > XHEII_MIN; s->iz++) {
+      get_rec_next2_HHe(param, s->iz-1, s->z, Tm_output[s->iz-1], &s->xH1s, &s->xHeII, rate_table, twog_params, s->Dfminus_hist, Dfminus_Ly_hist, 
+                        Dfnu_hist, &s->dxHIIdlna_prev,  &s->dxHeIIdlna_prev, &s->dxHIIdlna_prev2, &s->dxHeIIdlna_prev2, &s->post_saha);
+      xe_output[s->iz] = (1.-s->xH1s) + s->xHeII;
+      s->z             = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
+      Tm_output[s->iz] = rec_Tmss(xe_output[s->iz], param->T0*(1.+s->z), rec_Hubble(param, s->iz, s->z), param->fHe, param->fsR, param->meR);       
    }
+   if (s->iz >= iz_stop) return;
+   s->phase  = PHASE_H;
+   s->iz_inj = s->iz;
  
 
      /******** H recombination. Helium assumed entirely neutral.
                Tm fixed to steady-state until its relative difference from Tr is DLNT_MAX 
      ********/
 
-    for (; iz<param->nz && 1.-Tm_output[iz-1]/param->T0/(1.+z) < DLNT_MAX; iz++) {
-        rec_get_xe_next1_H(param, z, xe_output[iz-1], Tm_output[iz-1], xe_output+iz, rate_table, iz-1, twog_params,
-		           Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, &dxHIIdlna_prev, &dxHIIdlna_prev2, &post_saha);
-        z             = (1.+ZSTART)*exp(-DLNA*iz) - 1.;
-        Tm_output[iz] = rec_Tmss(xe_output[iz], param->T0*(1.+z), rec_HubbleConstant(param, z), param->fHe, param->fsR, param->meR);  
+   case PHASE_H:
+   if (s->phase >= phase_stop) return;
+
+    for (; s->iz<iz_stop && 1.-Tm_output[s->iz-1]/param->T0/(1.+s->z) < DLNT_MAX; s->iz++) {
+        rec_get_xe_next1_H(param, s->z, xe_output[s->iz-1], Tm_output[s->iz-1], xe_output+s->iz, rate_table, s->iz-1, twog_params,
+		           s->Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, &s->dxHIIdlna_prev, &s->dxHIIdlna_prev2, &s->post_saha);
+        s->z             = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
+        Tm_output[s->iz] = rec_Tmss(xe_output[s->iz], param->T0*(1.+s->z), rec_Hubble(param, s->iz, s->z), param->fHe, param->fsR, param->meR);  
 	//injection
-	Yheat = rec_Xheat(param, z);
-	Tm_output[iz] = Tm_output[iz] + rec_HubbleConstant(param, z)/(param->fsR*param->fsR/param->meR/param->meR/param->meR*4.91466895548409e-22)/(param->T0*(1.+z))/(param->T0*(1.+z))/(param->T0*(1.+z))/(param->T0*(1.+z))*(1.+xe_output[iz]+param->fHe)/xe_output[iz]*Yheat/kBoltz*2./3/(1.+xe_output[iz]+param->fHe);
+	Yheat = rec_Xheat(param, s->z);
+	Tm_output[s->iz] = Tm_output[s->iz] + rec_Hubble(param, s->iz, s->z)/(param->fsR*param->fsR/param->meR/param->meR/param->meR*4.91466895548409e-22)/(param->T0*(1.+s->z))/(param->T0*(1.+s->z))/(param->T0*(1.+s->z))/(param->T0*(1.+s->z))*(1.+xe_output[s->iz]+param->fHe)/xe_output[s->iz]*Yheat/kBoltz*2./3/(1.+xe_output[s->iz]+param->fHe);
 	//injection
     }
+    if (s->iz >= iz_stop) return;
 
     /******** Evolve xe and Tm simultaneously until the lower bounds of integration tables are reached.
               Note that the radiative transfer calculation is switched off automatically in the functions 
               rec_get_xe_next1_H and rec_get_xe_next2_HTm when it is no longer relevant.   
     ********/   
 
-    dTmdlna_prev2 = (Tm_output[iz-2] - Tm_output[iz-4])/2./DLNA;
-    dTmdlna_prev  = (Tm_output[iz-1] - Tm_output[iz-3])/2./DLNA;
+    s->dTmdlna_prev2 = (Tm_output[s->iz-2] - Tm_output[s->iz-4])/2./DLNA;
+    s->dTmdlna_prev  = (Tm_output[s->iz-1] - Tm_output[s->iz-3])/2./DLNA;
+    s->phase         = PHASE_HTm;
+
+   case PHASE_HTm:
+   if (s->phase >= phase_stop) return;
 
-    for(; iz<param->nz && kBoltz*param->T0*(1.+z)/param->fsR/param->fsR/param->meR > TR_MIN 
-                       && Tm_output[iz-1]/param->T0/(1.+z) > TM_TR_MIN; iz++) {
-         rec_get_xe_next2_HTm(MODEL, param, z, xe_output[iz-1], Tm_output[iz-1], xe_output+iz, Tm_output+iz,
-                              rate_table, iz-1, twog_params, Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, 
-                              &dxHIIdlna_prev, &dTmdlna_prev, &dxHIIdlna_prev2, &dTmdlna_prev2);
-         z = (1.+ZSTART)*exp(-DLNA*iz) - 1.;
+    for(; s->iz<iz_stop && kBoltz*param->T0*(1.+s->z)/param->fsR/param->fsR/param->meR > TR_MIN 
+                        && Tm_output[s->iz-1]/param->T0/(1.+s->z) > TM_TR_MIN; s->iz++) {
+         if (param->fast_tol > 0 && (s->iz-1-param->izH0 >= param->nzrt || MODEL != FULL)) break;
+         rec_get_xe_next2_HTm(MODEL, param, s->z, xe_output[s->iz-1], Tm_output[s->iz-1], xe_output+s->iz, Tm_output+s->iz,
+                              rate_table, s->iz-1, twog_params, s->Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist, 
+                              &s->dxHIIdlna_prev, &s->dTmdlna_prev, &s->dxHIIdlna_prev2, &s->dTmdlna_prev2);
+         s->z = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
     }
+    /* Adaptive steps once radiative transfer is switched off */
+    if (param->fast_tol > 0) rec_fast_HTm(MODEL, PHASE_HTm, param, rate_table, xe_output, Tm_output, s, iz_stop);
+    if (s->iz >= iz_stop) return;
+    s->phase = PHASE_PEEBLES;
 
     /***** For low redshifts (z < 20 or so) use Peeble's model (Tm is evolved with xe). 
             The precise model does not metter much here as 
             1) the free electron fraction is basically zero (~1e-4) in any case and 
             2) the universe is going to be reionized around that epoch                
      *****/
+
+   case PHASE_PEEBLES:
+   if (s->phase >= phase_stop) return;
          
-    for(; iz<param->nz; iz++) { 
-        rec_get_xe_next2_HTm(PEEBLES, param, z, xe_output[iz-1], Tm_output[iz-1], xe_output+iz, Tm_output+iz,
-                              rate_table, iz-1, twog_params, Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist,
-                              &dxHIIdlna_prev, &dTmdlna_prev, &dxHIIdlna_prev2, &dTmdlna_prev2);
-        z = (1.+ZSTART)*exp(-DLNA*iz) - 1.;
+    if (param->fast_tol > 0) rec_fast_HTm(PEEBLES, PHASE_PEEBLES, param, rate_table, xe_output, Tm_output, s, iz_stop);
+    for(; s->iz<iz_stop; s->iz++) { 
+        rec_get_xe_next2_HTm(PEEBLES, param, s->z, xe_output[s->iz-1], Tm_output[s->iz-1], xe_output+s->iz, Tm_output+s->iz,
+                              rate_table, s->iz-1, twog_params, s->Dfminus_hist, Dfminus_Ly_hist, Dfnu_hist,
+                              &s->dxHIIdlna_prev, &s->dTmdlna_prev, &s->dxHIIdlna_prev2, &s->dTmdlna_prev2);
+        s->z = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
+    }
+    if (s->iz >= param->nz) s->phase = PHASE_DONE;
+
+   }
+}
+
+/**************************************************************************************************** 
+Fast mode (param->fast_tol > 0): once radiative transfer is switched off, xe and Tm are integrated with 
+adaptive steps in ln(a) (Bogacki-Shampine 3(2) pair, relative error fast_tol per step) instead of DLNA, 
+and the outputs on the fixed grid are filled by cubic Hermite interpolation between steps.
+func_select is the model of the phase; in PHASE_HTm, stops at the first output at which the phase ends.
+****************************************************************************************************/
+
+void rec_fast_derivs(int func_select, REC_COSMOPARAMS *param, HRATEEFF *rate_table, double x, double *y, double *dy) {
+
+    double z, TR, nH, ainv, H, TM, Yion, Yexc, Yheat, C;
+    int model;
+
+    z  = (1.+ZSTART)*exp(-x) - 1.;
+    TR = kBoltz*param->T0 * (ainv=1.+z);
+    nH = 1e-6*param->nH0 * ainv*ainv*ainv;
+    H  = rec_Hubble(param, -1, z);
+    TM = kBoltz*y[1];
+    Yion  = rec_Xion(param, z);
+    Yexc  = rec_Xexc(param, z);
+    Yheat = rec_Xheat(param, z);
+
+    /* radiative transfer is off; Peebles' model where the intermediate stages leave the rate tables */
+    model = func_select == FULL ? EMLA2s2p : func_select;
+    if (model != PEEBLES && (TR/param->fsR/param->fsR/param->meR < TR_MIN || TM/TR < TM_TR_MIN || TM/TR > TM_TR_MAX)) model = PEEBLES;
+
+    C     = 0.5; // not correct; this should be Peebles' C-factor (as in rec_get_xe_next2_HTm)
+    dy[0] = rec_dxHIIdlna(model, y[0], y[0], nH, H, TM, TR, rate_table, NULL, NULL, NULL, NULL, 0., 0, z, param->fsR, param->meR, 0)
+            + Yion + Yexc * (1.-C);
+    dy[1] = rec_dTmdlna(y[0], y[1], TR/kBoltz, H, param->fHe, param->fsR, param->meR) + Yheat/kBoltz*2./3/(1.+y[0]+param->fHe);
+}
+
+void rec_fast_HTm(int func_select, int phase, REC_COSMOPARAMS *param, HRATEEFF *rate_table,
+                  double *xe_output, double *Tm_output, REC_STATE *s, long iz_stop) {
+
+    double x, h, y[2], y1[2], yt[2], k1[2], k2[2], k3[2], k4[2], err, e, t, xg;
+    int i;
+
+    if (s->iz >= iz_stop) return;
+    x    = DLNA*(s->iz-1);
+    y[0] = xe_output[s->iz-1];
+    y[1] = Tm_output[s->iz-1];
+    h    = 10.*DLNA;
+    rec_fast_derivs(func_select, param, rate_table, x, y, k1);
+
+    while (s->iz < iz_stop) {
+       if (phase == PHASE_HTm && (kBoltz*param->T0*(1.+s->z)/param->fsR/param->fsR/param->meR <= TR_MIN 
+                                  || Tm_output[s->iz-1]/param->T0/(1.+s->z) <= TM_TR_MIN)) break;
+
+       /* one step of size h, with error estimate */
+       for (i = 0; i < 2; i++) yt[i] = y[i] + 0.5*h*k1[i];
+       rec_fast_derivs(func_select, param, rate_table, x+0.5*h, yt, k2);
+       for (i = 0; i < 2; i++) yt[i] = y[i] + 0.75*h*k2[i];
+       rec_fast_derivs(func_select, param, rate_table, x+0.75*h, yt, k3);
+       for (i = 0; i < 2; i++) y1[i] = y[i] + h*(2./9.*k1[i] + 1./3.*k2[i] + 4./9.*k3[i]);
+       rec_fast_derivs(func_select, param, rate_table, x+h, y1, k4);
+       err = 0.;
+       for (i = 0; i < 2; i++) {
+          e = fabs(h*(-5./72.*k1[i] + 1./12.*k2[i] + 1./9.*k3[i] - 1./8.*k4[i]))/(param->fast_tol*fabs(y1[i]));
+          if (e > err) err = e;
+       }
+       if (err > 1. && h > DLNA) {
+          h *= fmax(0.2, 0.9*pow(err, -1./3.));
+          if (h < DLNA) h = DLNA;
+          continue;
+       }
+
+       /* accepted: outputs in (x, x+h] */
+       for (xg = DLNA*s->iz; s->iz < iz_stop && xg <= x+h; xg = DLNA*s->iz) {
+          if (phase == PHASE_HTm && (kBoltz*param->T0*(1.+s->z)/param->fsR/param->fsR/param->meR <= TR_MIN 
+                                     || Tm_output[s->iz-1]/param->T0/(1.+s->z) <= TM_TR_MIN)) break;
+          t = (xg-x)/h;
+          xe_output[s->iz] = (2.*t*t*t-3.*t*t+1.)*y[0] + (t*t*t-2.*t*t+t)*h*k1[0] + (-2.*t*t*t+3.*t*t)*y1[0] + (t*t*t-t*t)*h*k4[0];
+          Tm_output[s->iz] = (2.*t*t*t-3.*t*t+1.)*y[1] + (t*t*t-2.*t*t+t)*h*k1[1] + (-2.*t*t*t+3.*t*t)*y1[1] + (t*t*t-t*t)*h*k4[1];
+          s->z = (1.+ZSTART)*exp(-DLNA*s->iz) - 1.;
+          s->iz++;
+       }
+       if (xg <= x+h) break;   /* the phase ended within the step */
+       x += h;
+       for (i = 0; i < 2; i++) {
+          y[i]  = y1[i];
+          k1[i] = k4[i];
+       }
+       h *= fmin(5., 0.9*pow(fmax(err, 1e-10), -1./3.));
+       if (h < DLNA) h = DLNA;
+    }
+
+    /* derivatives at the last outputs, for the fixed-step integrator if it takes over */
+    if (s->iz >= 3) {
+       y[0] = xe_output[s->iz-2];  y[1] = Tm_output[s->iz-2];
+       rec_fast_derivs(func_select, param, rate_table, DLNA*(s->iz-2), y, k1);
+       y[0] = xe_output[s->iz-3];  y[1] = Tm_output[s->iz-3];
+       rec_fast_derivs(func_select, param, rate_table, DLNA*(s->iz-3), y, k2);
+       s->dxHIIdlna_prev  = k1[0];
+       s->dTmdlna_prev    = k1[1];
+       s->dxHIIdlna_prev2 = k2[0];
+       s->dTmdlna_prev2   = k2[1];
     }
-  
-     /* Cleanup */
-     free_2D_array(Dfminus_hist, NVIRT);
 }
 /******************************************************************************************************************************/
@@ -16,8 +16,10 @@
 #define NMNU 1000
 #define MNU_MIN 0.001
 #define MNU_MAX 1000.
-#define MNU_FILE "nurho.txt"
+#define MNU_FILE "nurho.txt"    /* shared with background.py, which (re)generates it */
+#define MNU_VERSION 1            /* must agree with nurho_version in background.py */
 //injection
+/* default injection grid, uniform in log(1+z); init_injection accepts any log-uniform grid */
 #define NZ1 63
 #define Z1MIN 11.918432
 #define Z1MAX 2747.9683
@@ -41,19 +43,63 @@ typedef struct {
    long izH0;                   /* index when H recombination starts to be considered */  
    double zH0;                  /* Redshift at which H recombination starts (zH0 = z[izH0]) */
    long nzrt;                   /* number of redshift steps while radiative transfer is computed */
+   long nring;                  /* length of the ring buffers Dfminus_hist, Dfminus_Ly_hist (nzrt by default,
+                                   at least twog->nring); Dfnu_hist may then be NULL */
+
+   /* injection, tabulated uniformly in log(1+z) by init_injection; none if inj_nz1 = 0 */
+   double *inj_ion, *inj_exc, *inj_heat;
+   double inj_lnz1start, inj_dlnz1;
+   long inj_nz1;
+
+   /* Hubble rate on the integration grid, tabulated by init_hubble; none if nHtab = 0 */
+   double *Htab;
+   long nHtab;
+   int Hext;                    /* 1 if given by the caller rather than computed by rec_HubbleConstant */
+
+   /* integration settings; 0 for the full history with fixed steps */
+   double zmin;                 /* outputs below zmin are not computed but set to NaN */
+   double fast_tol;             /* relative tolerance of adaptive steps once radiative transfer is switched off */
 } REC_COSMOPARAMS;
 
+/* Phases of rec_build_history; injection only enters from PHASE_H on */
+#define PHASE_HeIII   0          /* He III -> II Saha */
+#define PHASE_HeII    1          /* He II -> I post-Saha, H in Saha equilibrium */
+#define PHASE_HHe     2          /* H and He simultaneously */
+#define PHASE_H       3          /* H only, Tm in steady state */
+#define PHASE_HTm     4          /* H and Tm */
+#define PHASE_PEEBLES 5          /* H and Tm with Peebles' model */
+#define PHASE_DONE    6
+
+/* State of the integration of rec_build_history before step iz (see rec_evolve_history) */
+typedef struct {
+   long iz;                     /* index of the next output */
+   double z;                    /* redshift of output iz-1 */
+   int phase;                   /* current phase */
+   long iz_inj;                 /* first output of PHASE_H, or nz if not yet reached */
+   double Delta_xe, xHeII, xH1s;
+   double dxHIIdlna_prev, dxHIIdlna_prev2, dTmdlna_prev, dTmdlna_prev2, dxHeIIdlna_prev, dxHeIIdlna_prev2;
+   int post_saha;
+   double **Dfminus_hist;       /* NVIRT x nring, owned by the state */
+} REC_STATE;
+
 void init_mnu();
 //injection
-void init_injection(double INJion[63], double INJexc[63], double INJheat[63]);
+void init_injection(REC_COSMOPARAMS *param, double *z1, double *INJion, double *INJexc, double *INJheat, long n);
+void free_injection(REC_COSMOPARAMS *param);
+double rec_Xion(REC_COSMOPARAMS *param, double z);
+double rec_Xexc(REC_COSMOPARAMS *param, double z);
+double rec_Xheat(REC_COSMOPARAMS *param, double z);
 //injection
 void rec_set_derived_params(REC_COSMOPARAMS *param);
 
 void rec_get_cosmoparam(FILE *fin, FILE *fout, REC_COSMOPARAMS *param);
 double rec_HubbleConstant(REC_COSMOPARAMS *param, double z);
+void init_hubble(REC_COSMOPARAMS *param, double *H, long n);
+void free_hubble(REC_COSMOPARAMS *param);
+double rec_Hubble(REC_COSMOPARAMS *param, long iz, double z);
 double rec_Tmss(double xe, double Tr, double H, double fHe, double fsR, double meR);
 double rec_dTmdlna(double xe, double Tm, double Tr, double H, double fHe, double fsR, double meR);
-void rec_get_xe_next1_He(REC_COSMOPARAMS *param, double z_in, double *xHeII, 
+void rec_get_xe_next1_He(REC_COSMOPARAMS *param, long iz_in, double z_in, double *xHeII, 
                          double *dxHeIIdlna_prev, double *dxHeIIdlna_prev2, int *post_saha); 
 double rec_xH1s_postSaha(REC_COSMOPARAMS *param, unsigned iz_out, double z_out, double xHeII_out, 
                          HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
@@ -69,4 +115,17 @@ void rec_get_xe_next2_HTm(int func_select, REC_COSMOPARAMS *param, double z_in,
                           double **Dfnu_hist, double *dxedlna_prev, double *dTmdlna_prev, double *dxedlna_prev2, double *dTmdlna_prev2);
 void rec_build_history(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
                        double *xe_output, double *Tm_output, double **Dfnu_hist, double *Dfminus_Ly_hist[3]);
+void rec_init_state(REC_COSMOPARAMS *param, REC_STATE *state, double *Dfminus_Ly_hist[3]);
+void rec_copy_state(REC_COSMOPARAMS *param, REC_STATE *dest, REC_STATE *src);
+void rec_free_state(REC_STATE *state);
+void rec_evolve_history(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
+                        double *xe_output, double *Tm_output, double **Dfnu_hist, double *Dfminus_Ly_hist[3],
+                        REC_STATE *state, long iz_stop, int phase_stop);
+long rec_iz_end(REC_COSMOPARAMS *param);
+void rec_evolve_phases(REC_COSMOPARAMS *param, HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog_params,
+                       double *xe_output, double *Tm_output, double **Dfnu_hist, double *Dfminus_Ly_hist[3],
+                       REC_STATE *state, long iz_stop, int phase_stop);
+void rec_fast_derivs(int func_select, REC_COSMOPARAMS *param, HRATEEFF *rate_table, double x, double *y, double *dy);
+void rec_fast_HTm(int func_select, int phase, REC_COSMOPARAMS *param, HRATEEFF *rate_table,
+                  double *xe_output, double *Tm_output, REC_STATE *s, long iz_stop);
 
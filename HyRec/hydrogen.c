@@ -29,6 +29,10 @@
 #include <stdio.h>
 #include <math.h>
 #include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 #include "hyrectools.h"
 #include "hydrogen.h"
@@ -107,24 +111,26 @@ double rec_TLA_dxHIIdlna(double xe, double xHII, double nH, double H, double TM,
 Store tabulated temperatures and read effective MLA rates from files.
 **********************************************************************************************/
 
+void make_rate_grid(HRATEEFF *rate_table){
+   maketab(log(TR_MIN), log(TR_MAX), NTR, rate_table->logTR_tab);
+   maketab(TM_TR_MIN, TM_TR_MAX, NTM, rate_table->TM_TR_tab);
+   rate_table->DlogTR = rate_table->logTR_tab[1] - rate_table->logTR_tab[0];
+   rate_table->DTM_TR = rate_table->TM_TR_tab[1] - rate_table->TM_TR_tab[0];  
+}
+
 void read_rates(HRATEEFF *rate_table){
 
    FILE *fA, *fR;
    char *buffer = (char *) malloc (1024);
    unsigned i, j, l;
 
-   strcpy(buffer, HYRECPATH);
-   strcat(buffer, ALPHA_FILE);
+   hyrec_file(buffer, ALPHA_FILE);
    fA = fopen(buffer, "r");
-   strcpy(buffer, HYRECPATH);
-   strcat(buffer, RR_FILE);
+   hyrec_file(buffer, RR_FILE);
    fR = fopen(buffer, "r"); 
    free(buffer);
 
-   maketab(log(TR_MIN), log(TR_MAX), NTR, rate_table->logTR_tab);
-   maketab(TM_TR_MIN, TM_TR_MAX, NTM, rate_table->TM_TR_tab);
-   rate_table->DlogTR = rate_table->logTR_tab[1] - rate_table->logTR_tab[0];
-   rate_table->DTM_TR = rate_table->TM_TR_tab[1] - rate_table->TM_TR_tab[0];  
+   make_rate_grid(rate_table);
 
    for (i = 0; i < NTR; i++) {
        for (j = 0; j < NTM; j++) for (l = 0; l <= 1; l++) {
@@ -277,14 +283,17 @@ Read two-photon rates from table and store in structure.
 **********************************************************************************************/
   
 void read_twog_params(TWO_PHOTON_PARAMS *twog){ 
+   read_twog_file(twog);
+   init_twog_params(twog);
+}
+
+void read_twog_file(TWO_PHOTON_PARAMS *twog){ 
    
    FILE *fA;
    char *buffer = (char *) malloc (1024);
    unsigned b;
-   double L2s1s_current, max_DLNA, DlnE;
 
-   strcpy(buffer, HYRECPATH);
-   strcat(buffer, TWOG_FILE);
+   hyrec_file(buffer, TWOG_FILE);
    fA = fopen(buffer, "r");  
    free(buffer);
 
@@ -296,6 +305,13 @@ void read_twog_params(TWO_PHOTON_PARAMS *twog){
       fscanf(fA, "%le", &(twog->A4s4d_tab[b]));
    }  
    fclose(fA); 
+}
+
+/* Normalization, switches and time-step check of the tabulated two-photon rates */
+void init_twog_params(TWO_PHOTON_PARAMS *twog){ 
+
+   unsigned b;
+   double L2s1s_current, max_DLNA, max_DlnE, DlnE;
 
    /* Normalize 2s--1s differential decay rate to L2s1s (can be set by user in hydrogen.h) */
    L2s1s_current = 0.;
@@ -329,36 +345,201 @@ void read_twog_params(TWO_PHOTON_PARAMS *twog){
    /* Added May 2012: check right away that the chosen time-step is small enough given the tabulated spectrum */
 
    max_DLNA = 1.;
+   max_DlnE = 0.;
    for (b = 0; b < NSUBLYA-1; b++) {
      DlnE = log(twog->Eb_tab[b+1]/twog->Eb_tab[b]);
      max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+     max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    }
    DlnE = log(E21/twog->Eb_tab[NSUBLYA-1]); 
    max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+   max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    DlnE = log(twog->Eb_tab[NSUBLYA]/E21); 
    max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+   max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    for (b = NSUBLYA; b < NSUBLYB-1; b++) {
      DlnE = log(twog->Eb_tab[b+1]/twog->Eb_tab[b]);
      max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+     max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    } 
    DlnE = log(E31/twog->Eb_tab[NSUBLYB-1]); 
    max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+   max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    DlnE = log(twog->Eb_tab[NSUBLYB]/E31); 
    max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+   max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    for (b = NSUBLYB; b < NVIRT-1; b++) {
      DlnE = log(twog->Eb_tab[b+1]/twog->Eb_tab[b]);
      max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE;
+     max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
    } 
    DlnE = log(E41/twog->Eb_tab[NVIRT-1]); 
    max_DLNA = max_DLNA < DlnE ? max_DLNA : DlnE; 
+   max_DlnE = max_DlnE > DlnE ? max_DlnE : DlnE;
 
    if (max_DLNA < DLNA) {
        fprintf(stderr, "Error: the time-step used (DLNA = %E) is too large for the used frequency grid (max DLNA = %E). Change DLNA accordingly in history.h.\n", DLNA, max_DLNA);
        exit(1); 
    }
+
+   /* Number of time steps over which fplus_from_fminus looks back, with a margin for the linear interpolation */
+   twog->nring = (long) ceil(max_DlnE/DLNA) + 3;
    
 }
 
+/********************************************************************************************************
+Binary form of the rate and two-photon tables, written to TABLES_FILE the first time the text files are 
+parsed and memory-mapped read-only afterwards, so that the pages are shared between processes. 
+The header records the layout and the size and modification time of the text files it was made from 
+(checked when they are present), and a checksum of the payload 
+logAlpha_tab[2][NTM][NTR], logR2p2s_tab[NTR], Eb_tab, A1s_tab, A2s_tab, A3s3d_tab, A4s4d_tab[NVIRT].
+The two-photon rates are stored as read, before init_twog_params.
+********************************************************************************************************/
+
+unsigned long long tables_checksum(const double *data, size_t n){
+   const unsigned char *p = (const unsigned char *) data;
+   unsigned long long h = 14695981039346656037ULL;    /* 64-bit FNV-1a */
+   size_t i;
+
+   for (i = 0; i < n*sizeof(double); i++) {
+      h ^= p[i];
+      h *= 1099511628211ULL;
+   }
+   return h;
+}
+
+void tables_stamp(TABLES_HEADER *header){
+   const char *files[3] = {ALPHA_FILE, RR_FILE, TWOG_FILE};
+   char buffer[1024];
+   struct stat st;
+   int i;
+
+   for (i = 0; i < 3; i++) {
+      hyrec_file(buffer, files[i]);
+      if (stat(buffer, &st) == 0) {
+         header->size[i]  = (long long) st.st_size;
+         header->mtime[i] = (long long) st.st_mtime;
+      }
+      else header->size[i] = header->mtime[i] = -1;
+   }
+}
+
+/* Returns 0 on success, -1 if the binary file is missing, stale or corrupt */
+int read_tables_bin(HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog){
+   char buffer[1024];
+   int fd, i;
+   unsigned j, l;
+   size_t n, len;
+   struct stat st;
+   void *map;
+   TABLES_HEADER *header, current;
+   double *data;
+
+   hyrec_file(buffer, TABLES_FILE);
+   fd = open(buffer, O_RDONLY);
+   if (fd < 0) return -1;
+   n   = 2*NTM*NTR + NTR + 5*NVIRT;
+   len = sizeof(TABLES_HEADER) + n*sizeof(double);
+   if (fstat(fd, &st) != 0 || (size_t) st.st_size != len) {
+      close(fd);
+      return -1;
+   }
+   map = mmap(NULL, len, PROT_READ, MAP_SHARED, fd, 0);
+   close(fd);
+   if (map == MAP_FAILED) return -1;
+
+   header = (TABLES_HEADER *) map;
+   data   = (double *) ((char *) map + sizeof(TABLES_HEADER));
+   tables_stamp(&current);
+   for (i = 0; i < 3; i++) {
+      if (current.size[i] >= 0 && (current.size[i] != header->size[i] || current.mtime[i] != header->mtime[i])) break;
+   }
+   if (i < 3 || strncmp(header->magic, TABLES_MAGIC, 8) != 0 || header->version != TABLES_VERSION
+       || header->ntr != NTR || header->ntm != NTM || header->nvirt != NVIRT
+       || header->checksum != tables_checksum(data, n)) {
+      munmap(map, len);
+      return -1;
+   }
+
+   /* The rate tables point into the mapping, which is kept for the lifetime of the process */
+   rate_table->logTR_tab = create_1D_array(NTR);
+   rate_table->TM_TR_tab = create_1D_array(NTM);
+   make_rate_grid(rate_table);
+   for (l = 0; l <= 1; l++) {
+      rate_table->logAlpha_tab[l] = (double **) malloc(NTM*sizeof(double *));
+      for (j = 0; j < NTM; j++) rate_table->logAlpha_tab[l][j] = data + (l*NTM + j)*NTR;
+   }
+   rate_table->logR2p2s_tab = data + 2*NTM*NTR;
+
+   data += 2*NTM*NTR + NTR;
+   memcpy(twog->Eb_tab,    data,           NVIRT*sizeof(double));
+   memcpy(twog->A1s_tab,   data + NVIRT,   NVIRT*sizeof(double));
+   memcpy(twog->A2s_tab,   data + 2*NVIRT, NVIRT*sizeof(double));
+   memcpy(twog->A3s3d_tab, data + 3*NVIRT, NVIRT*sizeof(double));
+   memcpy(twog->A4s4d_tab, data + 4*NVIRT, NVIRT*sizeof(double));
+   return 0;
+}
+
+/* Written to a temporary file and renamed, so that concurrent processes never map a partial file.
+   Failure (e.g. a read-only data directory) is not an error: the text files are parsed next time again. */
+void write_tables_bin(HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog){
+   char buffer[1024], tmp[1100];
+   TABLES_HEADER header;
+   double *data, *p;
+   size_t n;
+   unsigned j, l;
+   FILE *f;
+
+   n    = 2*NTM*NTR + NTR + 5*NVIRT;
+   data = create_1D_array(n);
+   p    = data;
+   for (l = 0; l <= 1; l++) for (j = 0; j < NTM; j++) {
+      memcpy(p, rate_table->logAlpha_tab[l][j], NTR*sizeof(double));
+      p += NTR;
+   }
+   memcpy(p, rate_table->logR2p2s_tab, NTR*sizeof(double));   p += NTR;
+   memcpy(p, twog->Eb_tab, NVIRT*sizeof(double));             p += NVIRT;
+   memcpy(p, twog->A1s_tab, NVIRT*sizeof(double));            p += NVIRT;
+   memcpy(p, twog->A2s_tab, NVIRT*sizeof(double));            p += NVIRT;
+   memcpy(p, twog->A3s3d_tab, NVIRT*sizeof(double));          p += NVIRT;
+   memcpy(p, twog->A4s4d_tab, NVIRT*sizeof(double));
+
+   memset(&header, 0, sizeof(TABLES_HEADER));
+   strncpy(header.magic, TABLES_MAGIC, 8);
+   header.version  = TABLES_VERSION;
+   header.ntr      = NTR;
+   header.ntm      = NTM;
+   header.nvirt    = NVIRT;
+   tables_stamp(&header);
+   header.checksum = tables_checksum(data, n);
+
+   hyrec_file(buffer, TABLES_FILE);
+   snprintf(tmp, 1100, "%s.%d.tmp", buffer, (int) getpid());
+   f = fopen(tmp, "wb");
+   if (f != NULL) {
+      if (fwrite(&header, sizeof(TABLES_HEADER), 1, f) == 1 && fwrite(data, sizeof(double), n, f) == n
+          && fclose(f) == 0) rename(tmp, buffer);
+      else remove(tmp);
+   }
+   free(data);
+}
+
+/* Rate and two-photon tables, from the binary file if it is up to date, otherwise from the text files */
+void load_tables(HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog){
+
+   if (read_tables_bin(rate_table, twog) != 0) {
+      rate_table->logTR_tab = create_1D_array(NTR);
+      rate_table->TM_TR_tab = create_1D_array(NTM);
+      rate_table->logAlpha_tab[0] = create_2D_array(NTM, NTR);
+      rate_table->logAlpha_tab[1] = create_2D_array(NTM, NTR);
+      rate_table->logR2p2s_tab = create_1D_array(NTR);
+      read_rates(rate_table);
+      read_twog_file(twog);
+      write_tables_bin(rate_table, twog);
+   }
+   init_twog_params(twog);
+}
+
 /********************************************************************************************************
 Compute the A_{b,b+/-1} "Einstein A-"coefficients between virtual states, due to diffusion
 (In the notation of the paper, A_{b,b\pm1} = R_{b,b\pm1})
@@ -641,9 +822,10 @@ void solve_real_virt(double xr[2], double xv[NVIRT], double Trr[2][2], double *T
 Interpolation of the photon distortion used to get f+ from f- at a higher frequency bin and earlier time. 
 Use a simple linear interpolation so the spectrum is always positive.
 Added May 2012
+ytab is a ring buffer holding step i at i % nring (nring >= iz for the whole history)
 *********************************************************************************************/
 
-double interp_Dfnu(double lna_start, double dlna, double *ytab, unsigned int iz, double lna){  
+double interp_Dfnu(double lna_start, double dlna, double *ytab, unsigned int iz, double lna, long nring){  
    long ind;
    double frac;
 
@@ -662,7 +844,7 @@ double interp_Dfnu(double lna_start, double dlna, double *ytab, unsigned int iz,
     ind  = (long) floor((lna-lna_start)/dlna);
     frac = (lna-lna_start)/dlna - ind;
     
-    return (1.-frac)*ytab[ind] + frac*ytab[ind+1];  
+    return (1.-frac)*ytab[ind % nring] + frac*ytab[(ind+1) % nring];  
 
 }  
 
@@ -675,10 +857,11 @@ Dfminus_Ly_hist is a 3 by nz array of previous Deltaf(nu - epsilon) redward of L
 
 Changed May 2012: Now using the interpolation function interp_Dfnu, which only interpolates 
                     over 2 nearest neighbors, which ensures that the distortion is always positive
+The histories are ring buffers of nring >= twog->nring steps (see interp_Dfnu)
 *************************************************************************************************************/
 
 void fplus_from_fminus(double Dfplus[NVIRT], double Dfplus_Ly[], double **Dfminus_hist, double *Dfminus_Ly_hist[], 
-                       double TR, double zstart, unsigned iz, double z, double Eb_tab[NVIRT]) {
+                       double TR, double zstart, unsigned iz, double z, double Eb_tab[NVIRT], long nring) {
    unsigned b;
    double ainv, lna_start, zp1;
   
@@ -688,45 +871,45 @@ void fplus_from_fminus(double Dfplus[NVIRT], double Dfplus_Ly[], double **Dfminu
    /*** Bins below Lyman alpha ***/
    for (b = 0; b < NSUBLYA-1; b++) {
       ainv = zp1*Eb_tab[b+1]/Eb_tab[b]; 
-      Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b+1], iz, -log(ainv));
+      Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b+1], iz, -log(ainv), nring);
    }
  
    /*** highest bin below Ly-alpha: feedback from optically thick Ly-alpha ***/
    b = NSUBLYA-1; 
    ainv = zp1*E21/Eb_tab[b];
-   Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_Ly_hist[0], iz, -log(ainv));
+   Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_Ly_hist[0], iz, -log(ainv), nring);
       
    /*** incoming photon occupation number at Lyman alpha ***/ 
    b = NSUBLYA;     /* next highest bin */
    ainv = zp1*Eb_tab[b]/E21;
-   Dfplus_Ly[0] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b], iz, -log(ainv)); 
+   Dfplus_Ly[0] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b], iz, -log(ainv), nring); 
    
    /*** Bins between Lyman alpha and beta ***/   
    for (b = NSUBLYA; b < NSUBLYB-1; b++) {
      ainv = zp1*Eb_tab[b+1]/Eb_tab[b]; 
-     Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b+1], iz, -log(ainv));
+     Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b+1], iz, -log(ainv), nring);
    }
    
    /*** highest bin below Ly-beta: feedback from Ly-beta ***/
    b = NSUBLYB-1; 
    ainv = zp1*E31/Eb_tab[b];
-   Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_Ly_hist[1], iz, -log(ainv));
+   Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_Ly_hist[1], iz, -log(ainv), nring);
    
    /*** incoming photon occupation number at Lyman beta ***/ 
    b = NSUBLYB;     /* next highest bin */
    ainv = zp1*Eb_tab[b]/E31;
-   Dfplus_Ly[1] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b], iz, -log(ainv)); 
+   Dfplus_Ly[1] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b], iz, -log(ainv), nring); 
   
    /*** Bins between Lyman beta and gamma ***/   
    for (b = NSUBLYB; b < NVIRT-1; b++) {
      ainv = zp1*Eb_tab[b+1]/Eb_tab[b]; 
-     Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b+1], iz, -log(ainv));
+     Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_hist[b+1], iz, -log(ainv), nring);
    }
 
    /*** highest energy bin: feedback from Ly-gamma ***/
    b = NVIRT-1;
    ainv = zp1*E41/Eb_tab[b];
-   Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_Ly_hist[2], iz, -log(ainv));
+   Dfplus[b] = interp_Dfnu(lna_start, DLNA, Dfminus_Ly_hist[2], iz, -log(ainv), nring);
              
 }
 
@@ -738,12 +921,13 @@ Modified May 2012:
 - now use the photon distortion instead of absolute photon occupation number
 - Accounts for explicit dependence on alpha_fs and m_e
 - Added Dfnu_hist as a variable. Will contain the *average* distortion within each bin
+Dfminus_hist and Dfminus_Ly_hist are ring buffers of nring steps; Dfnu_hist has nzrt steps or is NULL
 ******************************************************************************************************************/
 
 double rec_HMLA_2photon_dxHIIdlna(double xe, double xHII, double nH, double H, double TM, double TR, 
                                   HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog,  
                                   double **Dfminus_hist, double *Dfminus_Ly_hist[], double **Dfnu_hist,
-                                  double zstart, unsigned iz, double z, double fsR, double meR){
+                                  double zstart, unsigned iz, double z, double fsR, double meR, long nring){
    
    double xr[2], xv[NVIRT], Dfplus[NVIRT], Dfplus_Ly[2]; /* Assume incoming radiation blueward of Ly-gamma is Blackbody */
    double dxedlna, one_minus_Pib, one_minus_exptau, Dfeq, s, x1s, Dxe2;
@@ -769,7 +953,7 @@ double rec_HMLA_2photon_dxHIIdlna(double xe, double xHII, double nH, double H, d
    for (i = 0; i < 3; i++) Tvv[i] = create_1D_array(NVIRT); 
 
    /* Redshift photon occupation number from previous times and higher energy bins */
-   fplus_from_fminus(Dfplus, Dfplus_Ly, Dfminus_hist, Dfminus_Ly_hist, TR, zstart, iz, z, twog->Eb_tab);
+   fplus_from_fminus(Dfplus, Dfplus_Ly, Dfminus_hist, Dfminus_Ly_hist, TR, zstart, iz, z, twog->Eb_tab, nring);
   
    /* Compute real-real, real-virtual and virtual-virtual transition rates */
    populateTS_2photon(Trr, Trv, Tvr, Tvv, sr, sv, Dtau, xe, xHII, TM, TR, nH, H, rate_table, 
@@ -799,17 +983,19 @@ double rec_HMLA_2photon_dxHIIdlna(double xe, double xHII, double nH, double H, d
          Dfeq /= x1s*one_minus_Pib*Tvv[0][b];
          one_minus_exptau = Dtau[b] > 1e-6 ? 1.-exp(-Dtau[b]) : Dtau[b] - square(Dtau[b])/2.;               
                                 
-         Dfminus_hist[b][iz] = Dfplus[b] + (Dfeq - Dfplus[b])*one_minus_exptau;
+         Dfminus_hist[b][iz % nring] = Dfplus[b] + (Dfeq - Dfplus[b])*one_minus_exptau;
      }
-     else Dfminus_hist[b][iz] = Dfplus[b];
+     else Dfminus_hist[b][iz % nring] = Dfplus[b];
    }
     
-   Dfminus_Ly_hist[0][iz] = xr[1]/3./x1s;    
-   Dfminus_Ly_hist[1][iz] = xr[0]/x1s*exp(-E32/TR); 
-   Dfminus_Ly_hist[2][iz] = xr[0]/x1s*exp(-E42/TR); 
+   Dfminus_Ly_hist[0][iz % nring] = xr[1]/3./x1s;    
+   Dfminus_Ly_hist[1][iz % nring] = xr[0]/x1s*exp(-E32/TR); 
+   Dfminus_Ly_hist[2][iz % nring] = xr[0]/x1s*exp(-E42/TR); 
    
-   /* Average radiation field in each bin */
-   for (b = 0; b < NVIRT; b++) Dfnu_hist[b][iz] = xv[b]/x1s;   
+   /* Average radiation field in each bin, kept for the whole history if requested */
+   if (Dfnu_hist != NULL) {
+     for (b = 0; b < NVIRT; b++) Dfnu_hist[b][iz] = xv[b]/x1s;   
+   }
 
    for (i = 0; i < 2; i++) free(Trv[i]);
    for (i = 0; i < 2; i++) free(Tvr[i]);
@@ -828,13 +1014,13 @@ use full radiative transfer equations, otherwise just use the simple EMLA.
 
 double rec_dxHIIdlna(int model, double xe, double xHII, double nH, double H, double TM, double TR, 
                      HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog, double **Dfminus_hist, double *Dfminus_Ly_hist[], 
-                     double **Dfnu_hist, double zstart, unsigned iz, double z, double fsR, double meR){
+                     double **Dfnu_hist, double zstart, unsigned iz, double z, double fsR, double meR, long nring){
    
     if      (model == PEEBLES)  return rec_TLA_dxHIIdlna(xe, xHII, nH, H, TM, TR, 1.00, fsR, meR);
     else if (model == RECFAST)  return rec_TLA_dxHIIdlna(xe, xHII, nH, H, TM, TR, 1.14, fsR, meR);
     else if (model == EMLA2s2p) return rec_HMLA_dxHIIdlna(xe, xHII, nH, H, TM, TR, rate_table, fsR, meR);
     else if (model == FULL)     return rec_HMLA_2photon_dxHIIdlna(xe, xHII, nH, H, TM, TR, rate_table, twog, Dfminus_hist,  
-                                                                  Dfminus_Ly_hist, Dfnu_hist, zstart, iz, z, fsR, meR);
+                                                                  Dfminus_Ly_hist, Dfnu_hist, zstart, iz, z, fsR, meR, nring);
     else {
       fprintf(stderr, "Error in rec_dxedlna: model = %i is undefined.\n", model);
       exit(1);
@@ -58,6 +58,9 @@ double xe_PostSaha_TLA(double nH, double H, double T, double F, double *Dxe, dou
 
 #define ALPHA_FILE  "Alpha_inf.dat"     /* Contains the effective recombination coefficients to 2s and 2p */
 #define RR_FILE     "R_inf.dat"         /* Contains the effective transfer rate R_{2p,2s} */
+#define TABLES_FILE "hyrec_tables.bin"  /* Binary form of the rate and two-photon tables, written by load_tables */
+#define TABLES_MAGIC "HYRECTB"
+#define TABLES_VERSION 1
 
 
 /* Boundaries and number of elements of temperature tables */
@@ -77,6 +80,7 @@ typedef struct {
   double DlogTR, DTM_TR;
 } HRATEEFF;
 
+void make_rate_grid(HRATEEFF *rate_table);
 void read_rates(HRATEEFF *rate_table);
 void interpolate_rates(double Alpha[2], double DAlpha[2], double Beta[2], double *R2p2s, double TR, double TM_TR, HRATEEFF *rate_table, double fsR, double meR);
 double rec_HMLA_dxedlna(double xe, double nH, double H, double TM, double TR, HRATEEFF *rate_table, double fsR, double meR);
@@ -98,10 +102,27 @@ typedef struct {
     double A2s_tab[NVIRT];      /* dLambda_2s/dE * DeltaE if E < Elya dK2s/dE * Delta E if E > Elya */
     double A3s3d_tab[NVIRT];    /* (dLambda_3s/dE + 5*dLambda_3d/dE) * Delta E for E < ELyb, Raman scattering rate for E > ELyb */
     double A4s4d_tab[NVIRT];    /* (dLambda_4s/dE + 5*dLambda_4d/dE) * Delta E */
+    long nring;                 /* Minimal length of the radiative transfer ring buffers */
 }  TWO_PHOTON_PARAMS;
 
 
 void read_twog_params(TWO_PHOTON_PARAMS *twog);
+void read_twog_file(TWO_PHOTON_PARAMS *twog);
+void init_twog_params(TWO_PHOTON_PARAMS *twog);
+
+/**** Header of the binary tables (TABLES_FILE) ****/
+typedef struct {
+    char magic[8];
+    int version, ntr, ntm, nvirt;
+    long long size[3], mtime[3];        /* of ALPHA_FILE, RR_FILE, TWOG_FILE, -1 if missing */
+    unsigned long long checksum;        /* FNV-1a of the payload */
+} TABLES_HEADER;
+
+unsigned long long tables_checksum(const double *data, size_t n);
+void tables_stamp(TABLES_HEADER *header);
+int read_tables_bin(HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog);
+void write_tables_bin(HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog);
+void load_tables(HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog);
 void populate_Diffusion(double *Aup, double *Adn, double *A2p_up, double *A2p_dn, 
                         double TM, double Eb_tab[NVIRT], double A1s_tab[NVIRT]);
 void populateTS_2photon(double Trr[2][2], double *Trv[2], double *Tvr[2], double *Tvv[3], 
@@ -112,13 +133,13 @@ void populateTS_2photon(double Trr[2][2], double *Trv[2], double *Tvr[2], double
 void solveTXeqB(double *diag, double *updiag, double *dndiag, double *X, double *B, unsigned N);
 void solve_real_virt(double xr[2], double xv[NVIRT], double Trr[2][2], double *Trv[2], double *Tvr[2], 
                      double *Tvv[3], double sr[2], double sv[NVIRT]);
-double interp_Dfnu(double x0, double dx, double *ytab, unsigned int Nx, double x);
+double interp_Dfnu(double x0, double dx, double *ytab, unsigned int Nx, double x, long nring);
 void fplus_from_fminus(double fplus[NVIRT], double fplus_Ly[], double **Dfminus_hist, double *Dfminus_Ly_hist[], 
-                       double TR, double zstart, unsigned iz, double z, double Eb_tab[NVIRT]);
+                       double TR, double zstart, unsigned iz, double z, double Eb_tab[NVIRT], long nring);
 double rec_HMLA_2photon_dxedlna(double xe, double nH, double H, double TM, double TR,
                                 HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog,
                                 double **Dfminus_hist, double *Dfminus_Ly_hist[], double **Dfnu_hist,
                                 double zstart, unsigned iz, double z, double fsR, double meR);
 double rec_dxHIIdlna(int model, double xe, double xHII, double nH, double H, double TM, double TR, 
                      HRATEEFF *rate_table, TWO_PHOTON_PARAMS *twog, double **Dfminus_hist, double *Dfminus_Ly_hist[], 
-                     double **Dfnu_hist, double zstart, unsigned iz, double z, double fsR, double meR);
+                     double **Dfnu_hist, double zstart, unsigned iz, double z, double fsR, double meR, long nring);
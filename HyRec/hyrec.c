@@ -102,7 +102,7 @@ int main(void) {
         for (b = 0; b < NSUBLYA; b++) { /* Sub-Lyman alpha bins */
            fprintf(fp, "%E", twog_params.Eb_tab[b]/E21);
            for (iz = 0; iz < NSPEC; iz++) {
-	     Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfnu_hist[b], izmax_spec, -log(1.+z_spec[iz]));
+	     Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfnu_hist[b], izmax_spec, -log(1.+z_spec[iz]), param.nzrt);
              prefact = 8.*M_PI*cube(twog_params.Eb_tab[b]/E21)/(param.nH0 * cube((1.+z_spec[iz]) * 1216e-10));
              fprintf(fp," %E", prefact*Dfnu);
            }
@@ -110,7 +110,7 @@ int main(void) {
         }
         fprintf(fp, "%E", 1.);    /* Lyman-alpha */
         for (iz = 0; iz < NSPEC; iz++) {
-    	    Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfminus_Ly_hist[0], izmax_spec, -log(1.+z_spec[iz]));
+    	    Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfminus_Ly_hist[0], izmax_spec, -log(1.+z_spec[iz]), param.nzrt);
             prefact = 8.*M_PI/(param.nH0 * cube((1.+z_spec[iz]) * 1216e-10));
             fprintf(fp," %E", prefact*Dfnu);
         }
@@ -118,7 +118,7 @@ int main(void) {
         for (; b < NSUBLYB; b++) { /* Bins between Ly-alpha and Ly-beta */
            fprintf(fp, "%E", twog_params.Eb_tab[b]/E21);
            for (iz = 0; iz < NSPEC; iz++) {
-              Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfnu_hist[b], izmax_spec, -log(1.+z_spec[iz]));
+              Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfnu_hist[b], izmax_spec, -log(1.+z_spec[iz]), param.nzrt);
               prefact = 8.*M_PI*cube(twog_params.Eb_tab[b]/E21)/(param.nH0 * cube((1.+z_spec[iz]) * 1216e-10));
               fprintf(fp," %E", prefact*Dfnu);                
            }
@@ -126,7 +126,7 @@ int main(void) {
         }
         fprintf(fp, "%E", E31/E21);    /* Lyman-beta */
         for (iz = 0; iz < NSPEC; iz++) {
-             Dfnu =  interp_Dfnu(-log(1.+param.zH0), DLNA, Dfminus_Ly_hist[1], izmax_spec, -log(1.+z_spec[iz])); 
+             Dfnu =  interp_Dfnu(-log(1.+param.zH0), DLNA, Dfminus_Ly_hist[1], izmax_spec, -log(1.+z_spec[iz]), param.nzrt); 
              prefact = 8.*M_PI*cube(E31/E21)/(param.nH0 * cube((1.+z_spec[iz]) * 1216e-10));
              fprintf(fp," %E", prefact*Dfnu);
         }
@@ -134,7 +134,7 @@ int main(void) {
         for (; b < NVIRT; b++) {   /* Bins between Ly-beta and Ly-gamma */
            fprintf(fp, "%E", twog_params.Eb_tab[b]/E21);
            for (iz = 0; iz < NSPEC; iz++) {
-              Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfnu_hist[b], izmax_spec, -log(1.+z_spec[iz]));
+              Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfnu_hist[b], izmax_spec, -log(1.+z_spec[iz]), param.nzrt);
               prefact = 8.*M_PI*cube(twog_params.Eb_tab[b]/E21)/(param.nH0 * cube((1.+z_spec[iz]) * 1216e-10));
               fprintf(fp," %E", prefact*Dfnu);
            }
@@ -142,7 +142,7 @@ int main(void) {
         }
         fprintf(fp, "%E", E41/E21);    /* Lyman-gamma */
         for (iz = 0; iz < NSPEC; iz++) {
-            Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfminus_Ly_hist[2], izmax_spec, -log(1.+z_spec[iz]));
+            Dfnu = interp_Dfnu(-log(1.+param.zH0), DLNA, Dfminus_Ly_hist[2], izmax_spec, -log(1.+z_spec[iz]), param.nzrt);
             prefact = 8.*M_PI*cube(E41/E21)/(param.nH0 * cube((1.+z_spec[iz]) * 1216e-10));    
             fprintf(fp," %E", prefact*Dfnu);
         }
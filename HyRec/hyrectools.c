@@ -6,10 +6,37 @@ Version: May 2012 (was "arrays.c" in earlier versions, contents unchanged)
 
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 #include <math.h>
       
 #include "hyrectools.h"
 
+#ifndef HYRECPATH
+#define HYRECPATH "./"
+#endif
+
+
+/******************************************************************************************************
+Directory of the data files: set at run time with hyrec_set_path or the environment variable HYREC_PATH,
+otherwise HYRECPATH given at compile time. 
+******************************************************************************************************/
+
+char hyrec_path[1024] = "";
+
+void hyrec_set_path(const char *path) {
+   strncpy(hyrec_path, path, 1023);
+   hyrec_path[1023] = '\0';
+}
+
+/* Full name of the data file name; buffer must hold 1024 characters */
+void hyrec_file(char *buffer, const char *name) {
+   const char *dir;
+
+   dir = hyrec_path[0] != '\0' ? hyrec_path : getenv("HYREC_PATH");
+   if (dir == NULL || dir[0] == '\0') dir = HYRECPATH;
+   snprintf(buffer, 1024, "%s%s%s", dir, dir[strlen(dir)-1] == '/' ? "" : "/", name);
+}
+
 
 /******************************************************************************************************
 Square and cube, often used
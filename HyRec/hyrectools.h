@@ -4,6 +4,8 @@ Also, function to make linear arrays and interpolation routines.
 Version: May 2012 (was "arrays.c" in earlier versions, contents unchanged)
 *****************************************************************************/
 
+void hyrec_set_path(const char *path);
+void hyrec_file(char *buffer, const char *name);
 double square(double x);
 double cube(double x);
 double *create_1D_array(unsigned n1);
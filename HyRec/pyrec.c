@@ -9,93 +9,336 @@
 #include "history.h"
 #include "pyrec.h"
 
+/* One recombination history: cosmological parameters and injection */
+struct HYREC_HISTORY {
+  REC_COSMOPARAMS param;
+};
+
+/* Integration of a history stopped at state.iz, with copies of everything needed to resume it */
+struct HYREC_CHECKPOINT {
+  REC_COSMOPARAMS param;        /* cosmology; the injection is not kept */
+  REC_STATE state;
+  double *xe, *tm;              /* outputs before state.iz */
+  double *Dfminus_Ly_hist[3];   /* ring buffers of param.nring steps */
+  long kinj, ninj;              /* injection at the ninj redshifts of outputs kinj, kinj+1, ... it depended on */
+  double *Yion, *Yexc, *Yheat;
+};
+
+/* Rate and two-photon tables are read once and shared read-only by all histories */
 HRATEEFF rate_table;
 TWO_PHOTON_PARAMS twog_params;
-REC_COSMOPARAMS param;
 int firstTime = 0;
-double *xe_output, *tm_output, **Dfnu_hist, *Dfminus_Ly_hist[3];
-double logstart;
+/* Output of the module-level functions below */
+double *xe_output, *tm_output;
+long nz_output = 0;
 
 void hyrec_init() {
 
   /* Build effective rate table */
-  //char *buffer = (char *) malloc (1024);
-  //getcwd (buffer, 1024);
-  //chdir(HYRECPATH);
-  rate_table.logTR_tab = create_1D_array(NTR);
-  rate_table.TM_TR_tab = create_1D_array(NTM);
-  rate_table.logAlpha_tab[0] = create_2D_array(NTM, NTR);
-  rate_table.logAlpha_tab[1] = create_2D_array(NTM, NTR);
-  rate_table.logR2p2s_tab = create_1D_array(NTR);
-  read_rates(&rate_table);
-
-  /* Read two-photon rate tables */
-  read_twog_params(&twog_params);
-  //chdir(buffer);
-  //free(buffer);
+  /* and read two-photon rate tables, memory-mapped from the binary form when it is up to date */
+  load_tables(&rate_table, &twog_params);
 }
 
-void rec_build_history_wrap(double tcmb, double obh2, double odmh2,
-                            double okh2, double odeh2, double w0, double wa,
-                            double yp, double nnu, double mnu[3],
-			    double INJion[63], double INJexc[63], double INJheat[63]){
+void hyrec_init_shared() {
+  if (firstTime == 0) {
+    init_mnu();
+    hyrec_init();
+    firstTime = 1;
+  }
+}
+
+/* Injection arrays of any length n >= 4 on a log-uniform grid z1 = 1+z, as contiguous buffers.
+   Returns NULL if the lengths disagree. Not thread-safe: the shared tables are read on first use. */
+HYREC_HISTORY *hyrec_history_new(double tcmb, double obh2, double odmh2,
+                                 double okh2, double odeh2, double w0, double wa,
+                                 double yp, double nnu, double mnu[3],
+                                 double *z1, long nz1, double *INJion, long nion,
+                                 double *INJexc, long nexc, double *INJheat, long nheat){
+  HYREC_HISTORY *h;
   int j;
-  
-  param.T0 = tcmb;
-  param.obh2 = obh2;
-  param.omh2 = obh2+odmh2;
-  param.okh2 = okh2;
-  param.odeh2 = odeh2;
-  param.w0 = w0;
-  param.wa = wa;
-  param.Y = yp;
-  param.Nnueff = nnu;
+
+  if (nz1 < 4 || nion != nz1 || nexc != nz1 || nheat != nz1) return NULL;
+  hyrec_init_shared();
+
+  h = (HYREC_HISTORY *) calloc(1, sizeof(HYREC_HISTORY));
+  h->param.T0 = tcmb;
+  h->param.obh2 = obh2;
+  h->param.omh2 = obh2+odmh2;
+  h->param.okh2 = okh2;
+  h->param.odeh2 = odeh2;
+  h->param.w0 = w0;
+  h->param.wa = wa;
+  h->param.Y = yp;
+  h->param.Nnueff = nnu;
   for(j=0; j<3; j++) {
-    param.mnu[j] = mnu[j];
+    h->param.mnu[j] = mnu[j];
   };
-  if (firstTime ==0) {
-    //char *buffer = (char *) malloc (1024);
-    //getcwd (buffer, 1024);
-    //chdir(HYRECPATH);
-    init_mnu();
-    init_injection(INJion, INJexc, INJheat);
-    //chdir(buffer);
-    //free(buffer);
+  init_injection(&h->param, z1, INJion, INJexc, INJheat, nz1);
+  h->param.fsR = h->param.meR = 1.;
+  rec_set_derived_params(&h->param);
+  /* the spectrum is not needed, so only the look-back window of the radiation field is kept */
+  if (twog_params.nring < h->param.nring) h->param.nring = twog_params.nring;
+  return h;
+}
+
+long hyrec_history_nz(HYREC_HISTORY *h){
+  return h->param.nz;
+}
+
+/* Outputs below zmin are left as NaN, and once radiative transfer is switched off the steps are adaptive
+   with relative tolerance tol; 0 and 0 (the default) give the full history with fixed steps */
+void hyrec_history_set_integration(HYREC_HISTORY *h, double zmin, double tol){
+  h->param.zmin     = zmin;
+  h->param.fast_tol = tol;
+}
+
+/* Replaces HyRec's Hubble rate (tabulated by each build) by the nH >= nz values of H in sec^-1 on the grid
+   log(a) = logstart + DLNA*i. Returns -1 if H is too short. */
+int hyrec_history_set_hubble(HYREC_HISTORY *h, double *H, long nH){
+  if (nH < h->param.nz) return -1;
+  init_hubble(&h->param, H, h->param.nz);
+  return 0;
+}
+
+/* xe and Tm are written to buffers of nxe, ntm >= nz values on the grid log(a) = logstart + DLNA*i.
+   Touches only h, the outputs and the shared read-only tables, so it may run concurrently on distinct histories.
+   Returns -1 if the outputs are too short. */
+int hyrec_history_build(HYREC_HISTORY *h, double *xe, long nxe, double *tm, long ntm){
+  double *Dfminus_Ly_hist[3];
+
+  if (nxe < h->param.nz || ntm < h->param.nz) return -1;
+  Dfminus_Ly_hist[0] = create_1D_array(h->param.nring);
+  Dfminus_Ly_hist[1] = create_1D_array(h->param.nring);
+  Dfminus_Ly_hist[2] = create_1D_array(h->param.nring);
+  rec_build_history(&h->param, &rate_table, &twog_params, xe, tm, NULL, Dfminus_Ly_hist);
+  free(Dfminus_Ly_hist[0]);
+  free(Dfminus_Ly_hist[1]);
+  free(Dfminus_Ly_hist[2]);
+  return 0;
+}
+
+void hyrec_history_free(HYREC_HISTORY *h){
+  free_injection(&h->param);
+  free_hubble(&h->param);
+  free(h);
+}
+
+/* Integrates h up to the output before redshift zsnap, or up to the point where the injection first
+   enters if zsnap < 0, and keeps a copy of the state */
+HYREC_CHECKPOINT *hyrec_checkpoint_new(HYREC_HISTORY *h, double zsnap){
+  HYREC_CHECKPOINT *c;
+  REC_COSMOPARAMS *param = &h->param;
+  long iz_stop, k;
+  double z;
+  int own_hubble;
+
+  iz_stop = zsnap < 0 ? param->nz : (long) ceil(log((1.+ZSTART)/(1.+zsnap))/DLNA);
+  if (iz_stop > param->nz) iz_stop = param->nz;
+  if (iz_stop < 0) iz_stop = 0;
+
+  c = (HYREC_CHECKPOINT *) calloc(1, sizeof(HYREC_CHECKPOINT));
+  c->xe                 = create_1D_array(param->nz);
+  c->tm                 = create_1D_array(param->nz);
+  c->Dfminus_Ly_hist[0] = create_1D_array(param->nring);
+  c->Dfminus_Ly_hist[1] = create_1D_array(param->nring);
+  c->Dfminus_Ly_hist[2] = create_1D_array(param->nring);
+  own_hubble = param->nHtab == 0;
+  if (own_hubble) init_hubble(param, NULL, 0);
+  rec_init_state(param, &c->state, c->Dfminus_Ly_hist);
+  rec_evolve_history(param, &rate_table, &twog_params, c->xe, c->tm, NULL, c->Dfminus_Ly_hist,
+                     &c->state, iz_stop, zsnap < 0 ? PHASE_H : PHASE_DONE);
+
+  c->param = *param;
+  c->param.inj_nz1 = 0;
+  c->param.inj_ion = c->param.inj_exc = c->param.inj_heat = NULL;
+  /* the Hubble rate is kept, both to compare a given one and to be reused by resumed histories */
+  c->param.nHtab = 0;
+  init_hubble(&c->param, param->Htab, param->nHtab);
+  c->param.Hext = param->Hext;
+  if (own_hubble) free_hubble(param);
+
+  /* the outputs iz_inj ... iz-1 evaluated the injection at the redshifts of outputs iz_inj-1 ... iz-1 */
+  c->kinj = c->state.iz_inj-1;
+  c->ninj = c->state.iz > c->state.iz_inj ? c->state.iz-c->kinj : 0;
+  c->Yion  = create_1D_array(c->ninj+1);
+  c->Yexc  = create_1D_array(c->ninj+1);
+  c->Yheat = create_1D_array(c->ninj+1);
+  for (k = 0; k < c->ninj; k++) {
+    z = (1.+ZSTART)*exp(-DLNA*(c->kinj+k)) - 1.;
+    c->Yion[k]  = rec_Xion(param, z);
+    c->Yexc[k]  = rec_Xexc(param, z);
+    c->Yheat[k] = rec_Xheat(param, z);
   }
-  param.fsR = param.meR = 1.;
-  rec_set_derived_params(&param);
+  return c;
+}
 
-  if (firstTime == 0) {
-    hyrec_init();
-    firstTime=1;
-    logstart = -log(1.+ZSTART);
-    xe_output          = create_1D_array(param.nz);
-    tm_output          = create_1D_array(param.nz);
+void hyrec_checkpoint_free(HYREC_CHECKPOINT *c){
+  free_hubble(&c->param);
+  rec_free_state(&c->state);
+  free(c->xe);
+  free(c->tm);
+  free(c->Dfminus_Ly_hist[0]);
+  free(c->Dfminus_Ly_hist[1]);
+  free(c->Dfminus_Ly_hist[2]);
+  free(c->Yion);
+  free(c->Yexc);
+  free(c->Yheat);
+  free(c);
+}
+
+double hyrec_checkpoint_z(HYREC_CHECKPOINT *c){
+  return (1.+ZSTART)*exp(-DLNA*(c->state.iz-1)) - 1.;
+}
+
+int hyrec_same_cosmology(REC_COSMOPARAMS *p1, REC_COSMOPARAMS *p2){
+  long j;
+  if (p1->T0 != p2->T0 || p1->obh2 != p2->obh2 || p1->omh2 != p2->omh2 || p1->okh2 != p2->okh2
+      || p1->odeh2 != p2->odeh2 || p1->w0 != p2->w0 || p1->wa != p2->wa || p1->Y != p2->Y
+      || p1->Nnueff != p2->Nnueff || p1->fsR != p2->fsR || p1->meR != p2->meR) return 0;
+  if (p1->zmin != p2->zmin || p1->fast_tol != p2->fast_tol) return 0;   /* integration settings alike */
+  for (j = 0; j < 3; j++) {
+    if (p1->mnu[j] != p2->mnu[j]) return 0;
   }
-  Dfnu_hist          = create_2D_array(NVIRT, param.nzrt);
-  Dfminus_Ly_hist[0] = create_1D_array(param.nzrt);
-  Dfminus_Ly_hist[1] = create_1D_array(param.nzrt);
-  Dfminus_Ly_hist[2] = create_1D_array(param.nzrt);
-  rec_build_history(&param, &rate_table, &twog_params, xe_output, tm_output,Dfnu_hist, Dfminus_Ly_hist);
-  free_2D_array(Dfnu_hist, NVIRT);
+  if (p1->Hext != p2->Hext) return 0;
+  if (p1->Hext) {
+    if (p1->nHtab != p2->nHtab) return 0;
+    for (j = 0; j < p1->nHtab; j++) {
+      if (p1->Htab[j] != p2->Htab[j]) return 0;
+    }
+  }
+  return 1;
+}
+
+/* Like hyrec_history_build, but starts from the checkpoint c. The result is identical to a full build.
+   Returns -1 if the outputs are too short, -2 if the cosmology (or zmin, tol) differs from that of c and
+   -3 if the injection differs where the checkpointed part depended on it; nothing is computed then.
+   c is only read, so it may be shared by concurrent builds. */
+int hyrec_history_resume(HYREC_HISTORY *h, HYREC_CHECKPOINT *c, double *xe, long nxe, double *tm, long ntm){
+  REC_COSMOPARAMS *param = &h->param;
+  REC_STATE state;
+  double *Dfminus_Ly_hist[3];
+  double z;
+  long i, k;
+
+  if (nxe < param->nz || ntm < param->nz) return -1;
+  if (!hyrec_same_cosmology(param, &c->param)) return -2;
+  for (k = 0; k < c->ninj; k++) {
+    z = (1.+ZSTART)*exp(-DLNA*(c->kinj+k)) - 1.;
+    if (rec_Xion(param, z) != c->Yion[k] || rec_Xexc(param, z) != c->Yexc[k] || rec_Xheat(param, z) != c->Yheat[k]) return -3;
+  }
+
+  for (k = 0; k < c->state.iz; k++) {
+    xe[k] = c->xe[k];
+    tm[k] = c->tm[k];
+  }
+  Dfminus_Ly_hist[0] = create_1D_array(param->nring);
+  Dfminus_Ly_hist[1] = create_1D_array(param->nring);
+  Dfminus_Ly_hist[2] = create_1D_array(param->nring);
+  for (k = 0; k < param->nring; k++) {
+    for (i = 0; i < 3; i++) Dfminus_Ly_hist[i][k] = c->Dfminus_Ly_hist[i][k];
+  }
+  rec_copy_state(param, &state, &c->state);
+  /* the cosmology is the same, so HyRec's own Hubble rate is borrowed from c rather than tabulated again */
+  if (param->nHtab == 0) {
+    param->Htab  = c->param.Htab;
+    param->nHtab = c->param.nHtab;
+  }
+  rec_evolve_history(param, &rate_table, &twog_params, xe, tm, NULL, Dfminus_Ly_hist,
+                     &state, param->nz, PHASE_DONE);
+  if (!param->Hext) param->nHtab = 0;
+  rec_free_state(&state);
   free(Dfminus_Ly_hist[0]);
   free(Dfminus_Ly_hist[1]);
   free(Dfminus_Ly_hist[2]);
-
+  return 0;
 }
 
-double hyrec_xe(double a){
+/* Interpolation of an output table of ntab values */
+double hyrec_interp(double *table, long ntab, double a){
   double loga = log(a);
-  if (loga < logstart) {
-    return xe_output[0];
+  if (loga < hyrec_logstart()) {
+    return table[0];
   }
-  return rec_interp1d(logstart, DLNA, xe_output, param.nz, loga);
+  return rec_interp1d(hyrec_logstart(), DLNA, table, ntab, loga);
 }
 
-double hyrec_tm(double a){
-  double loga = log(a);
-  if (loga < logstart) {
-    return tm_output[0];
+/* ... at n scale factors in one call; out must hold nout >= n values */
+void hyrec_interp_buf(double *table, long ntab, double *a, long n, double *out, long nout){
+  long i;
+  for (i = 0; i < n && i < nout; i++) out[i] = hyrec_interp(table, ntab, a[i]);
+}
+
+double hyrec_logstart(){
+  return -log(1.+ZSTART);
+}
+
+double hyrec_dlna(){
+  return DLNA;
+}
+
+/* Default injection grid of NZ1 redshifts between Z1MIN and Z1MAX */
+void hyrec_default_z1(double *out, long nout){
+  long i;
+  for (i = 0; i < NZ1 && i < nout; i++) out[i] = Z1MIN*exp(i*log(Z1MAX/Z1MIN)/(NZ1-1));
+}
+
+/* Module-level interface: a single output overwritten by each call */
+int rec_build_history_buf(double tcmb, double obh2, double odmh2,
+                          double okh2, double odeh2, double w0, double wa,
+                          double yp, double nnu, double mnu[3],
+                          double *z1, long nz1, double *INJion, long nion,
+                          double *INJexc, long nexc, double *INJheat, long nheat){
+  HYREC_HISTORY *h;
+
+  h = hyrec_history_new(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu,
+                        z1, nz1, INJion, nion, INJexc, nexc, INJheat, nheat);
+  if (h == NULL) return -1;
+  if (nz_output == 0) {
+    nz_output = hyrec_history_nz(h);
+    xe_output = create_1D_array(nz_output);
+    tm_output = create_1D_array(nz_output);
   }
-  return rec_interp1d(logstart, DLNA, tm_output, param.nz, loga);
+  hyrec_history_build(h, xe_output, nz_output, tm_output, nz_output);
+  hyrec_history_free(h);
+  return 0;
+}
+
+void rec_build_history_wrap(double tcmb, double obh2, double odmh2,
+                            double okh2, double odeh2, double w0, double wa,
+                            double yp, double nnu, double mnu[3],
+			    double INJion[63], double INJexc[63], double INJheat[63]){
+  double z1[NZ1];
+
+  hyrec_default_z1(z1, NZ1);
+  rec_build_history_buf(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu,
+                        z1, NZ1, INJion, NZ1, INJexc, NZ1, INJheat, NZ1);
+}
+
+double hyrec_xe(double a){
+  return hyrec_interp(xe_output, nz_output, a);
+}
+
+double hyrec_tm(double a){
+  return hyrec_interp(tm_output, nz_output, a);
+}
+
+void hyrec_xe_buf(double *a, long n, double *out, long nout){
+  hyrec_interp_buf(xe_output, nz_output, a, n, out, nout);
+}
+
+void hyrec_tm_buf(double *a, long n, double *out, long nout){
+  hyrec_interp_buf(tm_output, nz_output, a, n, out, nout);
+}
+
+/* Raw output of the last history; NULL until one is built */
+double *hyrec_xe_output(){
+  return xe_output;
+}
+
+double *hyrec_tm_output(){
+  return tm_output;
+}
+
+long hyrec_nz(){
+  return nz_output;
 }
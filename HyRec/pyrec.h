@@ -1,5 +1,37 @@
+typedef struct HYREC_HISTORY HYREC_HISTORY;
+typedef struct HYREC_CHECKPOINT HYREC_CHECKPOINT;
+
+HYREC_HISTORY *hyrec_history_new(double tcmb, double obh2, double odmh2, double okh2, double odeh2,
+				 double w0, double wa, double yp, double nnu, double mnu[3],
+				 double *z1, long nz1, double *INJion, long nion,
+				 double *INJexc, long nexc, double *INJheat, long nheat);
+long hyrec_history_nz(HYREC_HISTORY *h);
+void hyrec_history_set_integration(HYREC_HISTORY *h, double zmin, double tol);
+int hyrec_history_set_hubble(HYREC_HISTORY *h, double *H, long nH);
+int hyrec_history_build(HYREC_HISTORY *h, double *xe, long nxe, double *tm, long ntm);
+void hyrec_history_free(HYREC_HISTORY *h);
+HYREC_CHECKPOINT *hyrec_checkpoint_new(HYREC_HISTORY *h, double zsnap);
+void hyrec_checkpoint_free(HYREC_CHECKPOINT *c);
+double hyrec_checkpoint_z(HYREC_CHECKPOINT *c);
+int hyrec_history_resume(HYREC_HISTORY *h, HYREC_CHECKPOINT *c, double *xe, long nxe, double *tm, long ntm);
+double hyrec_interp(double *table, long ntab, double a);
+void hyrec_interp_buf(double *table, long ntab, double *a, long n, double *out, long nout);
+double hyrec_logstart();
+double hyrec_dlna();
+void hyrec_default_z1(double *out, long nout);
+void hyrec_set_path(const char *path);
+
 void rec_build_history_wrap(double tcmb, double obh2, double odmh2, double okh2, double odeh2, 
 			    double w0, double wa, double yp, double nnu, double mnu[3],
 			    double INJion[63], double INJexc[63], double INJheat[63]);
+int rec_build_history_buf(double tcmb, double obh2, double odmh2, double okh2, double odeh2,
+			  double w0, double wa, double yp, double nnu, double mnu[3],
+			  double *z1, long nz1, double *INJion, long nion,
+			  double *INJexc, long nexc, double *INJheat, long nheat);
 double hyrec_xe(double a);
 double hyrec_tm(double a);
+void hyrec_xe_buf(double *a, long n, double *out, long nout);
+void hyrec_tm_buf(double *a, long n, double *out, long nout);
+double *hyrec_xe_output();
+double *hyrec_tm_output();
+long hyrec_nz();
@@ -36,9 +36,200 @@
   }
  }
 
+/* Contiguous float64 buffers (e.g. numpy arrays) are passed to C without copying */
+%typemap(in) (double *IN_ARRAY1, long DIM1) (Py_buffer view, int got = 0) {
+  if (PyObject_GetBuffer($input, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) SWIG_fail;
+  got = 1;
+  if (view.itemsize != sizeof(double) || strcmp(view.format, "d") != 0) {
+    PyErr_SetString(PyExc_TypeError,"expected a contiguous buffer of float64");
+    SWIG_fail;
+  }
+  $1 = (double *) view.buf;
+  $2 = (long) (view.len/sizeof(double));
+ }
+%typemap(freearg) (double *IN_ARRAY1, long DIM1) {
+  if (got$argnum) PyBuffer_Release(&view$argnum);
+ }
+
+%typemap(in) (double *INPLACE_ARRAY1, long DIM1) (Py_buffer view, int got = 0) {
+  if (PyObject_GetBuffer($input, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | PyBUF_WRITABLE) < 0) SWIG_fail;
+  got = 1;
+  if (view.itemsize != sizeof(double) || strcmp(view.format, "d") != 0) {
+    PyErr_SetString(PyExc_TypeError,"expected a writable contiguous buffer of float64");
+    SWIG_fail;
+  }
+  $1 = (double *) view.buf;
+  $2 = (long) (view.len/sizeof(double));
+ }
+%typemap(freearg) (double *INPLACE_ARRAY1, long DIM1) {
+  if (got$argnum) PyBuffer_Release(&view$argnum);
+ }
+
+%apply (double *IN_ARRAY1, long DIM1) {(double *z1, long nz1), (double *INJion, long nion),
+                                       (double *INJexc, long nexc), (double *INJheat, long nheat),
+                                       (double *a, long n), (double *table, long ntab), (double *H, long nH)};
+%apply (double *INPLACE_ARRAY1, long DIM1) {(double *out, long nout), (double *xe, long nxe), (double *tm, long ntm)};
+
+/* histories are independent, so they may be built concurrently from Python threads */
+%exception hyrec_history_build {
+  Py_BEGIN_ALLOW_THREADS
+  $action
+  Py_END_ALLOW_THREADS
+}
+%exception hyrec_history_resume {
+  Py_BEGIN_ALLOW_THREADS
+  $action
+  Py_END_ALLOW_THREADS
+}
 
 extern void rec_build_history_wrap(double tcmb, double obh2, double odmh2, double okh2, double odeh2, 
 				   double w0, double wa, double yp, double nnu, double mnu[3],
 				   double INJion[63],double INJexc[63],double INJheat[63]);
 extern double hyrec_xe(double a);
 extern double hyrec_tm(double a);
+extern int rec_build_history_buf(double tcmb, double obh2, double odmh2, double okh2, double odeh2,
+				 double w0, double wa, double yp, double nnu, double mnu[3],
+				 double *z1, long nz1, double *INJion, long nion,
+				 double *INJexc, long nexc, double *INJheat, long nheat);
+extern void hyrec_xe_buf(double *a, long n, double *out, long nout);
+extern void hyrec_tm_buf(double *a, long n, double *out, long nout);
+
+extern HYREC_HISTORY *hyrec_history_new(double tcmb, double obh2, double odmh2, double okh2, double odeh2,
+					double w0, double wa, double yp, double nnu, double mnu[3],
+					double *z1, long nz1, double *INJion, long nion,
+					double *INJexc, long nexc, double *INJheat, long nheat);
+extern long hyrec_history_nz(HYREC_HISTORY *h);
+extern void hyrec_history_set_integration(HYREC_HISTORY *h, double zmin, double tol);
+extern int hyrec_history_set_hubble(HYREC_HISTORY *h, double *H, long nH);
+extern int hyrec_history_build(HYREC_HISTORY *h, double *xe, long nxe, double *tm, long ntm);
+extern void hyrec_history_free(HYREC_HISTORY *h);
+extern HYREC_CHECKPOINT *hyrec_checkpoint_new(HYREC_HISTORY *h, double zsnap);
+extern void hyrec_checkpoint_free(HYREC_CHECKPOINT *c);
+extern double hyrec_checkpoint_z(HYREC_CHECKPOINT *c);
+extern int hyrec_history_resume(HYREC_HISTORY *h, HYREC_CHECKPOINT *c, double *xe, long nxe, double *tm, long ntm);
+extern void hyrec_interp_buf(double *table, long ntab, double *a, long n, double *out, long nout);
+extern double hyrec_logstart();
+extern double hyrec_dlna();
+extern void hyrec_default_z1(double *out, long nout);
+/* directory of the data files; the tables are loaded once, so it must be set before the first history */
+extern void hyrec_set_path(const char *path);
+
+/* read-only views of the output of the module-level functions, without copying */
+%inline %{
+PyObject *hyrec_output_view(int which) {
+  double *p = which==0 ? hyrec_xe_output() : hyrec_tm_output();
+  if (p == NULL) {
+    PyErr_SetString(PyExc_RuntimeError,"no recombination history has been computed");
+    return NULL;
+  }
+  return PyMemoryView_FromMemory((char *) p, hyrec_nz()*sizeof(double), PyBUF_READ);
+}
+%}
+
+%pythoncode %{
+import numpy as _np
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+
+def _as_buffer(x):
+    return _np.asarray(x,dtype=_np.float64,order="C")
+
+def _check_z1(z1):
+    lnz1 = _np.log(z1)
+    if(len(z1)<4 or _np.any(_np.abs(_np.diff(lnz1,2))>1e-6*_np.abs(lnz1[-1]-lnz1[0])/(len(z1)-1))):
+        raise ValueError("z1 must have at least 4 points uniformly spaced in log(1+z)")
+
+def hyrec_z1():
+    # default grid of z1 = 1+z of the injection arrays
+    z1 = _np.empty(63)
+    hyrec_default_z1(z1)
+    return z1
+
+def rec_build_history_array(tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,mnu,z1,Xion,Xexc,Xheat):
+    # injection arrays tabulated at z1 = 1+z, uniformly spaced in log(1+z) in either order
+    z1 = _as_buffer(z1)
+    _check_z1(z1)
+    if(rec_build_history_buf(tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,tuple(mnu),
+                             z1,_as_buffer(Xion),_as_buffer(Xexc),_as_buffer(Xheat))!=0):
+        raise ValueError("injection arrays must have the same length as z1")
+
+def _interp(f,a,*table):
+    a = _as_buffer(a)
+    out = _np.empty_like(a)
+    f(*table,a.reshape(-1),out.reshape(-1))
+    return out[()]
+
+def hyrec_xe_array(a):
+    return _interp(hyrec_xe_buf,a)
+
+def hyrec_tm_array(a):
+    return _interp(hyrec_tm_buf,a)
+
+def hyrec_tables():
+    # ln(a) grid and read-only views of xe and Tm of the last history; valid until the next history
+    xe = _np.frombuffer(hyrec_output_view(0),dtype=_np.float64)
+    tm = _np.frombuffer(hyrec_output_view(1),dtype=_np.float64)
+    return hyrec_logstart()+hyrec_dlna()*_np.arange(len(xe)),xe,tm
+
+class HyrecHistory:
+    # an independent history; the shared rate tables are read when the first one is created
+    # outputs below zmin are NaN; tol > 0 takes adaptive steps of relative error tol once radiative transfer is off
+    def __init__(self,tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,mnu,z1,Xion,Xexc,Xheat,zmin=0.,tol=0.):
+        z1 = _as_buffer(z1)
+        _check_z1(z1)
+        self._h = hyrec_history_new(tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,tuple(mnu),
+                                    z1,_as_buffer(Xion),_as_buffer(Xexc),_as_buffer(Xheat))
+        if(self._h is None):
+            raise ValueError("injection arrays must have the same length as z1")
+        hyrec_history_set_integration(self._h,zmin,tol)
+        nz = hyrec_history_nz(self._h)
+        self.lna = hyrec_logstart()+hyrec_dlna()*_np.arange(nz)
+        self.xe = _np.zeros(nz)
+        self.tm = _np.zeros(nz)
+        self.built = False
+
+    def set_hubble(self,H):
+        # Hubble rate in 1/s at the scale factors exp(self.lna), used instead of HyRec's own
+        if(hyrec_history_set_hubble(self._h,_as_buffer(H))!=0):
+            raise ValueError("H must have at least %d values"%len(self.lna))
+        return self
+
+    def build(self,checkpoint=None):
+        # releases the GIL; with a checkpoint of the same cosmology, only the part of the history after it
+        # is integrated if the injection agrees wherever the checkpointed part depended on it
+        self.resumed = checkpoint is not None and hyrec_history_resume(self._h,checkpoint._c,self.xe,self.tm)==0
+        if(not self.resumed):
+            hyrec_history_build(self._h,self.xe,self.tm)
+        self.built = True
+        return self
+
+    def checkpoint(self,zsnap=None):
+        # state of this history at redshift zsnap, by default just before the injection first enters
+        return HyrecCheckpoint(self,zsnap)
+
+    def xe_array(self,a):
+        return _interp(hyrec_interp_buf,a,self.xe)
+
+    def tm_array(self,a):
+        return _interp(hyrec_interp_buf,a,self.tm)
+
+    def __del__(self):
+        if(getattr(self,"_h",None) is not None):
+            hyrec_history_free(self._h)
+            self._h = None
+
+class HyrecCheckpoint:
+    # integrator state of a history, from which histories of the same cosmology are resumed
+    def __init__(self,hist,zsnap=None):
+        self._c = hyrec_checkpoint_new(hist._h,-1. if zsnap is None else zsnap)
+        self.z = hyrec_checkpoint_z(self._c)
+
+    def __del__(self):
+        if(getattr(self,"_c",None) is not None):
+            hyrec_checkpoint_free(self._c)
+            self._c = None
+
+def rec_build_history_batch(hists,nthreads=None,checkpoint=None):
+    # build HyrecHistory objects concurrently on nthreads threads (default: number of cores)
+    with _ThreadPoolExecutor(nthreads) as ex:
+        return list(ex.map(lambda h:h.build(checkpoint),hists))
+%}
@@ -1,84 +1,17 @@
-# This file was automatically generated by SWIG (http://www.swig.org).
-# Version 3.0.12
+# This file was automatically generated by SWIG (https://www.swig.org).
+# Version 4.5.1
 #
-# Do not make changes to this file unless you know what you are doing--modify
+# Do not make changes to this file unless you know what you are doing - modify
 # the SWIG interface file instead.
 
-from sys import version_info as _swig_python_version_info
-if _swig_python_version_info >= (2, 7, 0):
-    def swig_import_helper():
-        import importlib
-        pkg = __name__.rpartition('.')[0]
-        mname = '.'.join((pkg, '_pyrec')).lstrip('.')
-        try:
-            return importlib.import_module(mname)
-        except ImportError:
-            return importlib.import_module('_pyrec')
-    _pyrec = swig_import_helper()
-    del swig_import_helper
-elif _swig_python_version_info >= (2, 6, 0):
-    def swig_import_helper():
-        from os.path import dirname
-        import imp
-        fp = None
-        try:
-            fp, pathname, description = imp.find_module('_pyrec', [dirname(__file__)])
-        except ImportError:
-            import _pyrec
-            return _pyrec
-        try:
-            _mod = imp.load_module('_pyrec', fp, pathname, description)
-        finally:
-            if fp is not None:
-                fp.close()
-        return _mod
-    _pyrec = swig_import_helper()
-    del swig_import_helper
+import typing
+# Import the low-level C/C++ module
+if getattr(globals().get("__spec__"), "parent", None) or __package__ or "." in __name__:
+    from . import _pyrec
 else:
     import _pyrec
-del _swig_python_version_info
-
-try:
-    _swig_property = property
-except NameError:
-    pass  # Python < 2.2 doesn't have 'property'.
-
-try:
-    import builtins as __builtin__
-except ImportError:
-    import __builtin__
-
-def _swig_setattr_nondynamic(self, class_type, name, value, static=1):
-    if (name == "thisown"):
-        return self.this.own(value)
-    if (name == "this"):
-        if type(value).__name__ == 'SwigPyObject':
-            self.__dict__[name] = value
-            return
-    method = class_type.__swig_setmethods__.get(name, None)
-    if method:
-        return method(self, value)
-    if (not static):
-        if _newclass:
-            object.__setattr__(self, name, value)
-        else:
-            self.__dict__[name] = value
-    else:
-        raise AttributeError("You cannot add attributes to %s" % self)
-
-
-def _swig_setattr(self, class_type, name, value):
-    return _swig_setattr_nondynamic(self, class_type, name, value, 0)
-
-
-def _swig_getattr(self, class_type, name):
-    if (name == "thisown"):
-        return self.this.own()
-    method = class_type.__swig_getmethods__.get(name, None)
-    if method:
-        return method(self)
-    raise AttributeError("'%s' object has no attribute '%s'" % (class_type.__name__, name))
 
+import builtins as __builtin__
 
 def _swig_repr(self):
     try:
@@ -87,26 +20,205 @@ def _swig_repr(self):
         strthis = ""
     return "<%s.%s; %s >" % (self.__class__.__module__, self.__class__.__name__, strthis,)
 
-try:
-    _object = object
-    _newclass = 1
-except __builtin__.Exception:
-    class _object:
-        pass
-    _newclass = 0
+
+def _swig_setattr_nondynamic_instance_variable(set):
+    def set_instance_attr(self, name, value):
+        if name == "this":
+            set(self, name, value)
+        elif name == "thisown":
+            self.this.own(value)
+        elif hasattr(self, name) and isinstance(getattr(type(self), name), property):
+            set(self, name, value)
+        else:
+            raise AttributeError("You cannot add instance attributes to %s" % self)
+    return set_instance_attr
+
+
+def _swig_setattr_nondynamic_class_variable(set):
+    def set_class_attr(cls, name, value):
+        if hasattr(cls, name) and not isinstance(getattr(cls, name), property):
+            set(cls, name, value)
+        else:
+            raise AttributeError("You cannot add class attributes to %s" % cls)
+    return set_class_attr
+
+
+class _SwigNonDynamicMeta(type):
+    """Meta class to enforce nondynamic attributes (no new attributes) for a class"""
+    __setattr__ = _swig_setattr_nondynamic_class_variable(type.__setattr__)
+
 
 
 def rec_build_history_wrap(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu, INJion, INJexc, INJheat):
     return _pyrec.rec_build_history_wrap(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu, INJion, INJexc, INJheat)
-rec_build_history_wrap = _pyrec.rec_build_history_wrap
 
 def hyrec_xe(a):
     return _pyrec.hyrec_xe(a)
-hyrec_xe = _pyrec.hyrec_xe
 
 def hyrec_tm(a):
     return _pyrec.hyrec_tm(a)
-hyrec_tm = _pyrec.hyrec_tm
-# This file is compatible with both classic and new-style classes.
+
+def rec_build_history_buf(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu, z1, INJion, INJexc, INJheat):
+    return _pyrec.rec_build_history_buf(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu, z1, INJion, INJexc, INJheat)
+
+def hyrec_xe_buf(a, out):
+    return _pyrec.hyrec_xe_buf(a, out)
+
+def hyrec_tm_buf(a, out):
+    return _pyrec.hyrec_tm_buf(a, out)
+
+def hyrec_history_new(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu, z1, INJion, INJexc, INJheat):
+    return _pyrec.hyrec_history_new(tcmb, obh2, odmh2, okh2, odeh2, w0, wa, yp, nnu, mnu, z1, INJion, INJexc, INJheat)
+
+def hyrec_history_nz(h):
+    return _pyrec.hyrec_history_nz(h)
+
+def hyrec_history_set_integration(h, zmin, tol):
+    return _pyrec.hyrec_history_set_integration(h, zmin, tol)
+
+def hyrec_history_set_hubble(h, H):
+    return _pyrec.hyrec_history_set_hubble(h, H)
+
+def hyrec_history_build(h, xe, tm):
+    return _pyrec.hyrec_history_build(h, xe, tm)
+
+def hyrec_history_free(h):
+    return _pyrec.hyrec_history_free(h)
+
+def hyrec_checkpoint_new(h, zsnap):
+    return _pyrec.hyrec_checkpoint_new(h, zsnap)
+
+def hyrec_checkpoint_free(c):
+    return _pyrec.hyrec_checkpoint_free(c)
+
+def hyrec_checkpoint_z(c):
+    return _pyrec.hyrec_checkpoint_z(c)
+
+def hyrec_history_resume(h, c, xe, tm):
+    return _pyrec.hyrec_history_resume(h, c, xe, tm)
+
+def hyrec_interp_buf(table, a, out):
+    return _pyrec.hyrec_interp_buf(table, a, out)
+
+def hyrec_logstart():
+    return _pyrec.hyrec_logstart()
+
+def hyrec_dlna():
+    return _pyrec.hyrec_dlna()
+
+def hyrec_default_z1(out):
+    return _pyrec.hyrec_default_z1(out)
+
+def hyrec_set_path(path):
+    return _pyrec.hyrec_set_path(path)
+
+def hyrec_output_view(which):
+    return _pyrec.hyrec_output_view(which)
+
+import numpy as _np
+from concurrent.futures import ThreadPoolExecutor as _ThreadPoolExecutor
+
+def _as_buffer(x):
+    return _np.asarray(x,dtype=_np.float64,order="C")
+
+def _check_z1(z1):
+    lnz1 = _np.log(z1)
+    if(len(z1)<4 or _np.any(_np.abs(_np.diff(lnz1,2))>1e-6*_np.abs(lnz1[-1]-lnz1[0])/(len(z1)-1))):
+        raise ValueError("z1 must have at least 4 points uniformly spaced in log(1+z)")
+
+def hyrec_z1():
+# default grid of z1 = 1+z of the injection arrays
+    z1 = _np.empty(63)
+    hyrec_default_z1(z1)
+    return z1
+
+def rec_build_history_array(tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,mnu,z1,Xion,Xexc,Xheat):
+# injection arrays tabulated at z1 = 1+z, uniformly spaced in log(1+z) in either order
+    z1 = _as_buffer(z1)
+    _check_z1(z1)
+    if(rec_build_history_buf(tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,tuple(mnu),
+                             z1,_as_buffer(Xion),_as_buffer(Xexc),_as_buffer(Xheat))!=0):
+        raise ValueError("injection arrays must have the same length as z1")
+
+def _interp(f,a,*table):
+    a = _as_buffer(a)
+    out = _np.empty_like(a)
+    f(*table,a.reshape(-1),out.reshape(-1))
+    return out[()]
+
+def hyrec_xe_array(a):
+    return _interp(hyrec_xe_buf,a)
+
+def hyrec_tm_array(a):
+    return _interp(hyrec_tm_buf,a)
+
+def hyrec_tables():
+# ln(a) grid and read-only views of xe and Tm of the last history; valid until the next history
+    xe = _np.frombuffer(hyrec_output_view(0),dtype=_np.float64)
+    tm = _np.frombuffer(hyrec_output_view(1),dtype=_np.float64)
+    return hyrec_logstart()+hyrec_dlna()*_np.arange(len(xe)),xe,tm
+
+class HyrecHistory:
+# an independent history; the shared rate tables are read when the first one is created
+# outputs below zmin are NaN; tol > 0 takes adaptive steps of relative error tol once radiative transfer is off
+    def __init__(self,tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,mnu,z1,Xion,Xexc,Xheat,zmin=0.,tol=0.):
+        z1 = _as_buffer(z1)
+        _check_z1(z1)
+        self._h = hyrec_history_new(tcmb,obh2,odmh2,okh2,odeh2,w0,wa,yp,nnu,tuple(mnu),
+                                    z1,_as_buffer(Xion),_as_buffer(Xexc),_as_buffer(Xheat))
+        if(self._h is None):
+            raise ValueError("injection arrays must have the same length as z1")
+        hyrec_history_set_integration(self._h,zmin,tol)
+        nz = hyrec_history_nz(self._h)
+        self.lna = hyrec_logstart()+hyrec_dlna()*_np.arange(nz)
+        self.xe = _np.zeros(nz)
+        self.tm = _np.zeros(nz)
+        self.built = False
+
+    def set_hubble(self,H):
+# Hubble rate in 1/s at the scale factors exp(self.lna), used instead of HyRec's own
+        if(hyrec_history_set_hubble(self._h,_as_buffer(H))!=0):
+            raise ValueError("H must have at least %d values"%len(self.lna))
+        return self
+
+    def build(self,checkpoint=None):
+# releases the GIL; with a checkpoint of the same cosmology, only the part of the history after it
+# is integrated if the injection agrees wherever the checkpointed part depended on it
+        self.resumed = checkpoint is not None and hyrec_history_resume(self._h,checkpoint._c,self.xe,self.tm)==0
+        if(not self.resumed):
+            hyrec_history_build(self._h,self.xe,self.tm)
+        self.built = True
+        return self
+
+    def checkpoint(self,zsnap=None):
+# state of this history at redshift zsnap, by default just before the injection first enters
+        return HyrecCheckpoint(self,zsnap)
+
+    def xe_array(self,a):
+        return _interp(hyrec_interp_buf,a,self.xe)
+
+    def tm_array(self,a):
+        return _interp(hyrec_interp_buf,a,self.tm)
+
+    def __del__(self):
+        if(getattr(self,"_h",None) is not None):
+            hyrec_history_free(self._h)
+            self._h = None
+
+class HyrecCheckpoint:
+# integrator state of a history, from which histories of the same cosmology are resumed
+    def __init__(self,hist,zsnap=None):
+        self._c = hyrec_checkpoint_new(hist._h,-1. if zsnap is None else zsnap)
+        self.z = hyrec_checkpoint_z(self._c)
+
+    def __del__(self):
+        if(getattr(self,"_c",None) is not None):
+            hyrec_checkpoint_free(self._c)
+            self._c = None
+
+def rec_build_history_batch(hists,nthreads=None,checkpoint=None):
+# build HyrecHistory objects concurrently on nthreads threads (default: number of cores)
+    with _ThreadPoolExecutor(nthreads) as ex:
+        return list(ex.map(lambda h:h.build(checkpoint),hists))
 
 
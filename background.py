@@ -1,7 +1,44 @@
 import numpy as np
 from scipy import integrate,interpolate,optimize,special
+import os
 import const
 
+# table of massive neutrino energy density rho(am/T)/rho(massless), shared with HyRec (MNU_FILE in HyRec/history.h)
+# (the data directory of HyRec can be moved with the environment variable HYREC_PATH)
+nurho_file = os.path.join(os.environ.get("HYREC_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)),"HyRec"),"nurho.txt")
+nurho_version = 1 # must agree with MNU_VERSION in HyRec/history.h
+nurho_lammin = 1e-3 # min of am/T; MNU_MIN in HyRec/history.h
+nurho_lammax = 1e3 # max of am/T; MNU_MAX in HyRec/history.h
+nurho_nlam = 1000 # NMNU in HyRec/history.h
+spl_lnrho = None # spline of ln(rho) in ln(am/T), loaded once per process by NuRhoSpline
+
+def MakeNuRhoTable(filename=nurho_file):
+    lam = np.exp(np.linspace(np.log(nurho_lammin),np.log(nurho_lammax),nurho_nlam))
+    rho = np.array([integrate.quad(lambda x:x**2*np.sqrt(x**2+l**2)/(np.exp(x)+1),0,100)[0] for l in lam])
+    rho = rho*const.nu_energy # ratio of massive to massless
+    header = "nurho version %d: am/T, rho/rho(massless)"%nurho_version
+    tmp = filename+"."+str(os.getpid())+".tmp"
+    np.savetxt(tmp,np.transpose([lam,rho]),fmt="%.17g",header=header)
+    os.replace(tmp,filename)
+
+def NuRhoTableVersion(filename=nurho_file):
+    try:
+        with open(filename) as f:
+            words = f.readline().split()
+        return int(words[3].rstrip(":")) if words[1:3]==["nurho","version"] else None
+    except (OSError,IndexError,ValueError):
+        return None
+
+def NuRhoSpline():
+    global spl_lnrho
+    if(spl_lnrho is None):
+        if(NuRhoTableVersion()!=nurho_version):
+            print("table of massive neutrino energy density is (re)generated in",nurho_file)
+            MakeNuRhoTable()
+        tab = np.loadtxt(nurho_file)
+        spl_lnrho = interpolate.make_interp_spline(np.log(tab[:,0]),np.log(tab[:,1]))
+    return spl_lnrho
+
 class BBN:
     
     def __init__(self):
@@ -19,28 +56,17 @@ class MassiveNu:
         self.nnu = const.nnu_standard
         self.mass = np.zeros(self.nmass)
         
-        self.lammax = 1e3 # max of am/T
-        self.lammin = 1e-3 # min of am/T
-        nlam = 1000
+        self.lammax = nurho_lammax # max of am/T
+        self.lammin = nurho_lammin # min of am/T
+        self.spl_lnrho = NuRhoSpline()
         
-        lnlam = np.linspace(np.log(self.lammin),np.log(self.lammax),nlam)
-        lnrho = np.zeros(nlam)
-        for i in range(nlam):
-            lam = np.exp(lnlam[i])
-            lnrho[i] = integrate.quad(lambda x:x**2*np.sqrt(x**2+lam**2)/(np.exp(x)+1),0,100)[0]
-        lnrho = np.log(lnrho[:]*const.nu_energy) # ratio of massive to massless
-        self.spl_lnrho = interpolate.make_interp_spline(lnlam,lnrho)
-        
-    def Rho(self,a):
-        lam = a*self.mass[:]*const.eV/const.TCnuB
-        r = np.empty(self.nmass)
-        for i in range(self.nmass):
-            if(lam[i]>self.lammax): # non-relativistic
-                r[i] = lam[i]*const.nu_number
-            elif(lam[i]<self.lammin):
-                r[i] = 1
-            else:
-                r[i] = np.exp(self.spl_lnrho(np.log(lam[i])))
+    def Rho(self,a): # a may be a scalar or an array; the result has shape (nmass,)+shape(a)
+        lam = np.multiply.outer(self.mass[:]*const.eV/const.TCnuB,a)
+        r = np.ones(lam.shape) # relativistic
+        nonrel = lam>self.lammax
+        r[nonrel] = lam[nonrel]*const.nu_number
+        mid = (lam>=self.lammin) & ~nonrel
+        r[mid] = np.exp(self.spl_lnrho(np.log(lam[mid])))
         return r
         
     def SetParams(self,hierarchy,nnu,mnu): # mnu [eV]
@@ -81,6 +107,14 @@ class Background:
         self.odeh2 = 0.311
         self.bbn = BBN()
         self.yp = 0.24714 # based on PRIMAT assuming ob = 0.02236, neff = 3.046
+        # log(a) grids of the cumulative conformal time, sound horizon and optical depth tables
+        self.amin = 1e-10 # radiation domination is assumed below amin
+        self.nlna = 4000
+        self.z1max_therm = 8001. # ZSTART+1 in HyRec/hyrec_params.h
+        self.nlna_therm = 2000
+        self.hyrec_hubble = False # if true HyRec uses the Hubble rate from dtauda rather than its own
+        self.hyrec_zmin = 0. # HyRec stops at this redshift; xe and Tm are NaN below
+        self.hyrec_tol = 0. # if positive HyRec takes adaptive steps of this relative error once radiative transfer is off
                 
     def Earlyt(self,a): # in matter-radiation dominated universe well before neutrino becomes massive
         aeq = (self.ogh2+self.onuh2_nomass)/(self.odmh2+self.obh2)
@@ -107,35 +141,105 @@ class Background:
             print(' neutrino masses [eV]:',self.nu.mass[:])
             print(' neutrino NR redshifts:',const.TCnuB/const.eV/self.nu.mass[:])
             print(' yp: %e'%self.yp)
+
+        self.SetTables()
     
-    def dtauda(self,a):
-        x = 1/np.sqrt(self.ogh2+self.onuh2_nomass*np.average(self.nu.Rho(a))+(self.obh2+self.odmh2)*a+self.odeh2*a**4)
+    def SetTables(self):
+        # cumulative conformal time and sound horizon as splines in ln(a); d/dln(a) = a*d/da
+        lna = np.linspace(np.log(self.amin),0,self.nlna)
+        a = np.exp(lna)
+        self.tau_min = self.amin*self.dtauda(self.amin)
+        self.rs_min = self.amin*self.drsda(self.amin)
+        self.spl_tau = interpolate.make_interp_spline(lna,a*self.dtauda(a)).antiderivative()
+        self.spl_rs = interpolate.make_interp_spline(lna,a*self.drsda(a)).antiderivative()
+        self.hyrec_H = None # Hubble rate passed to HyRec, tabulated when first needed
+    
+    def dtauda(self,a): # a may be a scalar or an array
+        x = 1/np.sqrt(self.ogh2+self.onuh2_nomass*np.average(self.nu.Rho(a),axis=0)+(self.obh2+self.odmh2)*a+self.odeh2*a**4)
         return x/const.BigH
     
     def H0(self):
         return 1/self.dtauda(1)/const.BigH
     
+    def Tau(self,a): # conformal time; a may be a scalar or an array
+        a = np.asarray(a,dtype=float)
+        return np.where(a<self.amin,a*self.dtauda(self.amin),self.tau_min+self.spl_tau(np.log(np.maximum(a,self.amin))))
+
     def DeltaTau(self,a1,a2):
-        return integrate.quad(self.dtauda,a1,a2)[0]
+        return self.Tau(a2)-self.Tau(a1)
     
     def drsda(self,a):
         cs = np.sqrt(1/3/(1+0.75*a*self.obh2/self.ogh2))*const.c
         return cs*self.dtauda(a)
     
-    def SoundHorizon(self,a):
-        return integrate.quad(self.drsda,0,a)[0]
+    def SoundHorizon(self,a): # a may be a scalar or an array
+        a = np.asarray(a,dtype=float)
+        return np.where(a<self.amin,a*self.drsda(self.amin),self.rs_min+self.spl_rs(np.log(np.maximum(a,self.amin))))
     
-    def UpdateTherm(self,Xion,Xexc,Xheat):
+    def ThermHistory(self,Xion,Xexc,Xheat,z1=None):
+        # a HyRec history of this cosmology, not yet computed; injection is tabulated at z1 (log-uniform)
         from HyRec import pyrec
         
-        if(self.verbose>0): print("thermal history is computed by HyRec")
-        
         okh2 = 0
         w0 = -1
         wa = 0
-        pyrec.rec_build_history_wrap(const.TCMB/const.kB,self.obh2,self.odmh2,okh2,self.odeh2,w0,wa,self.yp,self.nu.nnu,tuple(self.nu.mass),tuple(Xion),tuple(Xexc),tuple(Xheat))
+        if(z1 is None):
+            z1 = pyrec.hyrec_z1() # default grid of HyRec
+        hist = pyrec.HyrecHistory(const.TCMB/const.kB,self.obh2,self.odmh2,okh2,self.odeh2,w0,wa,self.yp,self.nu.nnu,self.nu.mass,z1,Xion,Xexc,Xheat,
+                                  self.hyrec_zmin,self.hyrec_tol)
+        if(self.hyrec_hubble):
+            # tabulated once per cosmology on the integration grid of HyRec
+            if(self.hyrec_H is None):
+                a = np.exp(hist.lna)
+                self.hyrec_H = 1/(a*a*self.dtauda(a))
+            hist.set_hubble(self.hyrec_H)
+        return hist
+
+    def ThermCheckpoint(self,zsnap=None):
+        # state of HyRec without injection at redshift zsnap, by default just before the injection first enters;
+        # histories of this cosmology resume from it when their injection agrees above zsnap
+        hist = self.ThermHistory(np.zeros(4),np.zeros(4),np.zeros(4),np.geomspace(1,2,4))
+        checkpoint = hist.checkpoint(zsnap)
+        if(self.verbose>0): print(" HyRec checkpoint at z = %g"%checkpoint.z)
+        return checkpoint
+
+    def UpdateTherm(self,Xion,Xexc,Xheat,z1=None,checkpoint=None):
+        if(self.verbose>0): print("thermal history is computed by HyRec")
+        self.SetHistory(self.ThermHistory(Xion,Xexc,Xheat,z1).build(checkpoint))
+        if(self.verbose>0 and checkpoint is not None): print(" resumed from checkpoint:",self.hist.resumed)
+
+    def SetHistory(self,hist):
+        # hist is a built HyrecHistory or any object with xe_array(a) and tm_array(a)
+        self.hist = hist
+        self.SetThermTables()
+
+    def UpdateThermBatch(self,injections,nthreads=None,checkpoint=None):
+        # histories for a list of injections (Xion,Xexc,Xheat[,z1]) computed on a thread pool;
+        # the history of this Background is left unchanged
+        from HyRec import pyrec
         
-        '''
+        if(self.verbose>0): print(len(injections),"thermal histories are computed by HyRec")
+        return pyrec.rec_build_history_batch([self.ThermHistory(*inj) for inj in injections],nthreads,checkpoint)
+
+    def Xe(self,a): # a may be a scalar or an array
+        return self.hist.xe_array(a)
+
+    def Tm(self,a):
+        return self.hist.tm_array(a)
+
+    def SetThermTables(self):
+        # optical depth kappa(z) = int_zmin^z xe*akthom*dtauda dz' and its drag counterpart, tabulated in ln(a)
+        # with dz = -dln(a)/a; the splines are antiderivatives in ln(a), so kappa = spl(lnamax)-spl(ln(a)),
+        # where lnamax = -ln(1+zmin) (zmin = hyrec_zmin, below which HyRec does not compute xe)
+        akthom = self.obh2*const.rhoch2/const.c*(1-self.yp)/const.m_H*const.sigmaT
+        self.lnamax_therm = -np.log1p(self.hyrec_zmin)
+        lna = np.linspace(-np.log(self.z1max_therm),self.lnamax_therm,self.nlna_therm)
+        a = np.exp(lna)
+        xe = self.Xe(a)
+        dkappa = xe*akthom*self.dtauda(a)/a
+        self.spl_kappa = interpolate.make_interp_spline(lna,dkappa).antiderivative()
+        self.spl_kappa_drag = interpolate.make_interp_spline(lna,dkappa/(0.75*self.obh2/self.ogh2*a)).antiderivative()
+
         # initial guess based on Hu & Sugiyama 1996
         ob = self.obh2
         om = self.obh2+self.odmh2
@@ -145,28 +249,36 @@ class Background:
         b1 = 0.313*om**-0.419*(1+0.607*om**0.674)
         b2 = 0.238*om**0.223
         self.zdrag = 1345*om**0.251/(1+0.659*om**0.828)*(1+b1*ob**b2)
-        
-        zstar1 = self.zstar*0.9
-        zstar2 = self.zstar*1.1
-        zdrag1 = self.zdrag*0.9
-        zdrag2 = self.zdrag*1.1
-        
-        akthom = ob*const.rhoch2/const.c*(1-self.yp)/const.m_H*const.sigmaT
-        
-        nthrm = 1250
-        zlower = 0.
-        zupper = 1250.
-        zthrm = np.linspace(zlower,zupper,nthrm)
-        tau_opt = np.zeros(nthrm)
-        tau_drag = np.zeros(nthrm)
-        for i in range(1,nthrm):
-            tau_opt[i] = tau_opt[i-1]+integrate.quad(lambda z:
-                                pyrec.hyrec_xe(1/(z+1))*akthom*self.dtauda(1/(z+1)),zthrm[i-1],zthrm[i])[0]
-            tau_drag[i] = tau_drag[i-1]+integrate.quad(lambda z:
-                                pyrec.hyrec_xe(1/(z+1))*akthom*self.dtauda(1/(z+1))/(0.75*self.obh2/self.ogh2/(1+z)),zthrm[i-1],zthrm[i])[0]
-        spl_opt = interpolate.make_interp_spline(np.log(zthrm[1:]),np.log(tau_opt[1:]))
-        spl_drag = interpolate.make_interp_spline(np.log(zthrm[1:]),np.log(tau_drag[1:]))
-            
-        self.zstar = optimize.brentq(lambda x:spl_opt(np.log(x)),zstar1,zstar2)
-        self.zdrag = optimize.brentq(lambda x:spl_drag(np.log(x)),zdrag1,zdrag2)
-        '''
+
+        self.zstar = self.FindDepth(self.OpticalDepth,self.zstar)
+        self.zdrag = self.FindDepth(self.DragDepth,self.zdrag)
+        self.rsstar = self.SoundHorizon(1/(1+self.zstar))
+        self.rsdrag = self.SoundHorizon(1/(1+self.zdrag))
+        if(self.verbose>0):
+            print(' z_star: %f'%self.zstar)
+            print(' z_drag: %f'%self.zdrag)
+            print(' r_s(z_star) [Mpc]: %f'%(self.rsstar/const.Mpc))
+            print(' r_s(z_drag) [Mpc]: %f'%(self.rsdrag/const.Mpc))
+
+    def OpticalDepth(self,z): # z may be a scalar or an array
+        return self.spl_kappa(self.lnamax_therm)-self.spl_kappa(-np.log1p(z))
+
+    def DragDepth(self,z): # z may be a scalar or an array
+        return self.spl_kappa_drag(self.lnamax_therm)-self.spl_kappa_drag(-np.log1p(z))
+
+    def FindDepth(self,depth,zguess): # redshift at which depth(z) = 1
+        z1 = zguess*0.9
+        z2 = zguess*1.1
+        if((depth(z1)-1)*(depth(z2)-1)>0):
+            z1 = self.hyrec_zmin
+            z2 = self.z1max_therm-1
+        return optimize.brentq(lambda z:depth(z)-1,z1,z2)
+
+if __name__ == '__main__':
+    import sys
+
+    if(len(sys.argv)>1 and sys.argv[1]=="nurho"):
+        MakeNuRhoTable()
+    else:
+        print(">$ python background.py nurho")
+        print("regenerates the table of massive neutrino energy density shared with HyRec")
@@ -1,11 +1,20 @@
 import astropy.io.fits as iofits
 import numpy as np
+import hashlib
+import os
 import background
 import sys
 
+cache_version = "fc-v1" # bump whenever the definition of the cached fc changes
+chunk_bytes = 1<<24 # upper bound on the slice of the transfer tensor held in memory in the low-memory mode
+causal_tol = 1e-10 # largest |tc| allowed outside the causal band, relative to the largest |tc|
+# sha1 of the tables keyed by (path,size,mtime_ns), so that each file is hashed at most once per process
+checksum_cache = {}
+
 class EpsData:
 
     def __init__(self,f,verbose=0):
+        self.f = f
         hdul = iofits.open(f)
         if(verbose>0): 
             print("=== header of ",f)
@@ -20,13 +29,106 @@ class EpsData:
         self.nerg = len(self.erg)
         self.nz1in = len(self.z1in)
         self.nch = len(self.ch)
-        self.tc = hdul[1].data["DEPOSITION_FRACTIONS_NEW"].reshape(self.nch,self.nz1in,self.nerg,self.nz1out)
         self.fion0 = hdul[1].data['F_ION'].reshape(self.nerg,self.nz1out)
         
         hdul.close()
         if(verbose>0): 
             print("===")
 
+    def OpenTc(self):
+        # memory-mapped file and a read-only view of its transfer tensor; pages are touched only when sliced
+        hdul = iofits.open(self.f,memmap=True)
+        return hdul,hdul[1].data["DEPOSITION_FRACTIONS_NEW"].reshape(self.nch,self.nz1in,self.nerg,self.nz1out)
+
+    def ReadTc(self,lowmem=False):
+        # the full transfer tensor is only needed when fc is not found in the cache
+        if(lowmem):
+            self.hdul,self.tc = self.OpenTc()
+        else:
+            with iofits.open(self.f) as hdul:
+                self.tc = np.array(hdul[1].data["DEPOSITION_FRACTIONS_NEW"]).reshape(self.nch,self.nz1in,self.nerg,self.nz1out)
+
+    def ReleaseTc(self):
+        if(hasattr(self,"tc")):
+            del self.tc
+        if(hasattr(self,"hdul")):
+            self.hdul.close()
+            del self.hdul
+
+    def CausalMask(self):
+        # energy injected at z1in can only be deposited at z1out<=z1in
+        return self.z1out[None,:]<=self.z1in[:,None]*(1+1e-8)
+
+    def CausalResidual(self,inside):
+        # largest |tc| outside the causal band relative to the largest |tc|, read from the memory-mapped file
+        # in blocks of z1in of at most chunk_bytes
+        hdul,tc = self.OpenTc()
+        tcmax = np.empty([self.nz1in,self.nz1out])
+        nchunk = max(1,chunk_bytes//(8*self.nch*self.nerg*self.nz1out))
+        for k0 in range(0,self.nz1in,nchunk):
+            k1 = min(k0+nchunk,self.nz1in)
+            tcmax[k0:k1] = np.max(np.abs(tc[:,k0:k1]),axis=(0,2))
+        del tc
+        hdul.close()
+        return np.max(tcmax[~inside],initial=0)/np.max(tcmax)
+
+    def SetBand(self,inside):
+        # entries (row[p],col[p]) = (z1in,z1out) indices of the causal band, ordered by column, so that
+        # column i is p in off[i]:off[i+1]
+        self.col,self.row = np.nonzero(inside.T)
+        self.off = np.searchsorted(self.col,np.arange(self.nz1out+1))
+
+    def BandBlocks(self,nchsel):
+        # ranges i0:i1 of columns whose band entries of nchsel channels take at most chunk_bytes (or one column)
+        n = max(1,chunk_bytes//(8*nchsel*self.nerg))
+        blocks = []
+        i0 = 0
+        while(i0<self.nz1out):
+            i1 = max(i0+1,np.searchsorted(self.off,self.off[i0]+n,side="right")-1)
+            blocks.append((i0,i1))
+            i0 = i1
+        return blocks
+
+    def BandEntries(self,tc,channels,p0,p1):
+        # tc[channels,row[p],:,col[p]] for p in p0:p1 as [p,ch,j]; reads only these entries from a memory-mapped tc
+        return tc[channels[None,:],self.row[p0:p1,None],:,self.col[p0:p1,None]]
+
+    def PackTc(self,channels):
+        # the band of the given channels read block by block from the memory-mapped file into tcp[p,ch,j],
+        # without forming the dense tensor; tcp is kept for later contractions
+        self.tcp = np.empty([self.off[-1],len(channels),self.nerg])
+        hdul,tc = self.OpenTc()
+        for i0,i1 in self.BandBlocks(len(channels)):
+            self.tcp[self.off[i0]:self.off[i1]] = self.BandEntries(tc,channels,self.off[i0],self.off[i1])
+        del tc
+        hdul.close()
+
+    def Checksum(self,cachepath=""):
+        # sha1 of the file, memoised per process in checksum_cache and across processes in a sidecar file in cachepath,
+        # both keyed by the path, size and modification time of the file
+        st = os.stat(self.f)
+        stamp = (os.path.abspath(self.f),st.st_size,st.st_mtime_ns)
+        if(stamp in checksum_cache):
+            return checksum_cache[stamp]
+        side = os.path.join(cachepath,"sha1_"+hashlib.sha1(repr(stamp).encode()).hexdigest()+".txt") if cachepath else ""
+        if(side and os.path.exists(side)):
+            with open(side) as fp:
+                digest = fp.read().strip()
+        else:
+            h = hashlib.sha1()
+            with open(self.f,"rb") as fp:
+                for block in iter(lambda:fp.read(1<<20),b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            if(side):
+                os.makedirs(cachepath,exist_ok=True)
+                tmp = side+"."+str(os.getpid())+".tmp"
+                with open(tmp,"w") as fp:
+                    fp.write(digest+"\n")
+                os.replace(tmp,side)
+        checksum_cache[stamp] = digest
+        return digest
+
 class Deposit:
     
     def __init__(self,verbose=0):
@@ -35,10 +137,13 @@ class Deposit:
         self.nspecies = len(self.species)
         self.epsdata =  []
         
-    def SetParams(self,epspath,intype):
+    def SetParams(self,epspath,intype,cachepath="",lowmem=False,channels=None,causal=False):
         self.epspath = epspath
         if(not epspath.endswith("/")):
             self.epspath = self.epspath+"/"
+        self.cachepath = cachepath
+        self.lowmem = lowmem
+        self.causal = causal
 
         self.intype = intype
         if(self.verbose>0): print("\n# energy deposition")
@@ -56,6 +161,16 @@ class Deposit:
             f = self.epspath+s+"_processed_results.fits"
             self.epsdata.append(EpsData(f,verbose=self.verbose))
         self.CheckEpsData()
+
+        # channels for which fc is computed; fc of the other channels is left zero
+        self.channels = np.arange(self.nch) if channels is None or len(channels)==0 else np.unique(np.asarray(channels,dtype=int))
+        if(self.channels[0]<0 or self.channels[-1]>=self.nch):
+            print("error: channels must be between 0 and",self.nch-1)
+            sys.exit(1)
+        if(self.verbose>0):
+            print(" channels:",self.channels)
+            if(self.lowmem): print(" transfer functions are memory-mapped and contracted in chunks")
+            if(self.causal): print(" only the causal band z1in>=z1out of transfer functions is used")
             
     def CheckEpsData(self):
         self.z1out = self.epsdata[0].z1out
@@ -75,11 +190,105 @@ class Deposit:
         #self.ergmin = self.erg[0]/np.exp(0.5*self.dlnerg)
         #self.ergmax = self.erg[self.nerg-1]*np.exp(0.5*self.dlnerg)
         
+    def CacheFile(self,n,gin,gout):
+        # fc depends on the transfer functions only through the weights gin and gout, which in turn
+        # encode the cosmology (dtauda), pow and the clumpiness table, so hashing them addresses the content
+        h = hashlib.sha1()
+        h.update(cache_version.encode())
+        h.update(self.epsdata[n].Checksum(self.cachepath).encode())
+        h.update(np.array([self.pow],dtype=np.int64).tobytes())
+        h.update(np.asarray(self.channels,dtype=np.int64).tobytes())
+        h.update(np.ascontiguousarray(gin,dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(gout,dtype=np.float64).tobytes())
+        return os.path.join(self.cachepath,"fc_"+self.species[n]+"_"+h.hexdigest()+".npy")
+
+    def Contract(self,eps,gin,gout,dense=False):
+        # fc[ch,j,i] = sum_k tc[ch,k,j,i]*gin[k]/gout[i]; fc itself has no causal structure once summed over z1in,
+        # so it is always dense
+        fc = np.zeros([self.nch,self.nerg,self.nz1out])
+        if(hasattr(eps,"off") and not dense):
+            # causal band only: the entries of each column are contiguous, so that a block of columns is summed by
+            # one np.add.reduceat over the nonempty columns; the band is read from the memory-mapped file when not packed
+            hdul,tc = (None,None) if hasattr(eps,"tcp") else eps.OpenTc()
+            fct = np.zeros([self.nz1out,len(self.channels),self.nerg])
+            for i0,i1 in eps.BandBlocks(len(self.channels)):
+                p0,p1 = eps.off[i0],eps.off[i1]
+                i = np.arange(i0,i1)[eps.off[i0:i1]<eps.off[i0+1:i1+1]]
+                if(len(i)==0):
+                    continue
+                vals = eps.tcp[p0:p1] if tc is None else eps.BandEntries(tc,self.channels,p0,p1)
+                fct[i] = np.add.reduceat(vals*gin[eps.row[p0:p1],None,None],eps.off[i]-p0,axis=0)
+            if(hdul is not None):
+                del tc
+                hdul.close()
+            fc[self.channels] = fct.transpose(1,2,0)
+        else:
+            # accumulate over blocks of z1in so that at most chunk_bytes of tc is converted to native floats at a time
+            # in the low-memory mode, or when tc is not resident and read from the memory-mapped file
+            hdul,tc = (None,eps.tc) if hasattr(eps,"tc") else eps.OpenTc()
+            nchunk = max(1,chunk_bytes//(8*self.nerg*self.nz1out)) if self.lowmem or hdul is not None else eps.nz1in
+            for ch in self.channels:
+                for k0 in range(0,eps.nz1in,nchunk):
+                    k1 = min(k0+nchunk,eps.nz1in)
+                    fc[ch] += np.tensordot(gin[k0:k1],np.asarray(tc[ch,k0:k1],dtype=np.float64),axes=(0,0))
+            if(hdul is not None):
+                del tc
+                hdul.close()
+        return fc/gout[None,None,:]
+
+    def SetCausal(self,eps,gin,gout):
+        # done once per table: the band is validated on the memory-mapped file in bounded blocks in either mode,
+        # and packed in the resident mode
+        eps.causal_checked = True
+        inside = eps.CausalMask()
+        r = eps.CausalResidual(inside)
+        if(r>causal_tol):
+            print("warning: transfer functions in "+eps.f+" are not causal (relative residual %e); dense transfer functions are used"%r)
+            return
+        eps.SetBand(inside)
+        if(not self.lowmem):
+            eps.PackTc(self.channels)
+        if(self.verbose>0):
+            fc_band = self.Contract(eps,gin,gout)
+            fc_dense = self.Contract(eps,gin,gout,dense=True)
+            print(" causal vs dense contraction of "+eps.f+": max relative difference %e"%(np.max(np.abs(fc_band-fc_dense))/np.max(np.abs(fc_dense))))
+
     def Calcfc(self,dtauda,clumz):
         for n in range(self.nspecies):
-            gin = np.array([z1k**(self.pow-5)*dtauda(1/z1k)*np.exp(clumz(np.log(z1k))) for z1k in self.epsdata[n].z1in])
-            gout = np.array([z1i**(self.pow-5)*dtauda(1/z1i) for z1i in self.epsdata[n].z1out])
-            self.epsdata[n].fc = np.sum(self.epsdata[n].tc[:,:,:,:]*gin[None,:,None,None]/gout[None,None,None,:],axis=1)
+            z1in = self.epsdata[n].z1in
+            z1out = self.epsdata[n].z1out
+            gin = z1in**(self.pow-5)*dtauda(1/z1in)*np.exp(clumz(np.log(z1in)))
+            gout = z1out**(self.pow-5)*dtauda(1/z1out)
+
+            if(self.cachepath):
+                f = self.CacheFile(n,gin,gout)
+                if(os.path.exists(f)):
+                    if(self.verbose>0): print(" fc of "+self.species[n]+" is read from cache ",f)
+                    self.epsdata[n].fc = np.load(f,mmap_mode="r")
+                    continue
+
+            eps = self.epsdata[n]
+            if(self.causal and not hasattr(eps,"causal_checked")):
+                self.SetCausal(eps,gin,gout)
+            if(hasattr(eps,"off")):
+                eps.fc = self.Contract(eps,gin,gout)
+            else:
+                # resident tc is read once and kept for later calls (e.g. other cosmologies); the low-memory mode
+                # maps the file again each time
+                if(not hasattr(eps,"tc")):
+                    eps.ReadTc(self.lowmem)
+                eps.fc = self.Contract(eps,gin,gout)
+                if(self.lowmem):
+                    eps.ReleaseTc()
+
+            if(self.cachepath):
+                # write to a unique temporary file and rename, so that concurrent runs never see a partial file
+                os.makedirs(self.cachepath,exist_ok=True)
+                tmp = f+"."+str(os.getpid())+".tmp"
+                with open(tmp,"wb") as fp:
+                    np.save(fp,self.epsdata[n].fc)
+                os.replace(tmp,f)
+                if(self.verbose>0): print(" fc of "+self.species[n]+" is cached in ",f)
 
             # check
             #for i in range(self.epsdata[n].nz1out):
@@ -1,71 +1,31 @@
 import numpy as np
 from scipy import interpolate
 import const
-import background
 import inifile
-import injection
-import deposition
-import therm
+import pipeline
 
+# pipeline of the last Run; a call that only changes, e.g., sigmav or gamma reruns the IGM evolution alone
+pipe = None
 
 def main(paramfile,verbose):
     
     Ini = inifile.IniFile(paramfile)
     if(verbose>0):
         Ini.Dump()
+    return Run(Ini,verbose)
 
-    section = "OUTPUT"
-    root = Ini.ReadString(section,"root")
-    
-    # fiducial cosmology
-    BG = background.Background(verbose=verbose)
-    section = "COSMOLOGY"
-    paramsfid = np.array([Ini.ReadFloat(section,"ob"),Ini.ReadFloat(section,"odm"),Ini.ReadFloat(section,"ode"),
-                          Ini.ReadFloat(section,"nnu"),Ini.ReadFloat(section,"mnu")])
-    BG.SetParams(paramsfid)
-
-    # clumpiness
-    section = "NBODY"
-    path = Ini.ReadString(section,"clumpiness")
-    if(verbose>0):
-        print("\n# cluminess (ignored when intype==2)")
-        # clumz is ln(B) as function of ln(1+z) constructed from a lookup table of "z B(z)".
-    try:
-        tab = np.loadtxt(path)
-        clumz = interpolate.make_interp_spline(np.log(1+tab[:,0]),np.log(1+tab[:,1]))
-        if(verbose>0):
-            print(" cluminess factor is read from ",path)
-    except:
-        if(verbose>0):
-            print(" table file for clumpiness factor is missing; cluminess is ignored:")
-        clumz = lambda x:0
-
-    # energy deposition
-    DE = deposition.Deposit(verbose=verbose)
-    section = "DEPOSITION"
-    DE.SetParams(Ini.ReadString(section,"epspath"),Ini.ReadInt("INJECTION","intype"))
-    DE.Calcfc(BG.dtauda,clumz)
-
-    # injection spectrum phythia
-    INJ = injection.Injection(verbose=verbose)
-    section = "INJECTION"
-    mspec = 5
-    INJ.SetParams(DE.intype,Ini.ReadFloat(section,"mass"),Ini.ReadInt(section,"mult"),Ini.ReadInt(section,"mode"),
-                  Ini.ReadBoolean(section,"use_prec"),DE.nerg*mspec,DE.erg[0]*const.eV/const.GeV,DE.erg[DE.nerg-1]*const.eV/const.GeV)
-    INJ.SetRate(Ini.ReadFloat(section,"sigmav") if INJ.intype==1 else Ini.ReadFloat(section,"gamma"))
-    INJ.GetBinnedNumber()
-
-    # IGM evolution
-    TH = therm.Therm(verbose=verbose)
-    TH.SetParams(root)
-    TH.IntegEnergy(DE,INJ)
-    TH.ThermInput(BG,DE,INJ)
-    TH.EvolveTspin(BG,DE,INJ)
+def Run(Ini,verbose):
+    # the whole calculation for the parameters of Ini, which may have been set in memory (see scan.py);
+    # only the stages of pipeline.Pipeline affected by the parameters changed since the last call are recomputed
+    global pipe
+    if(pipe is None or pipe.verbose!=verbose):
+        pipe = pipeline.Pipeline(verbose=verbose)
+    dT21cm_edges = pipe.Run(Ini)
 
     #for EDGES???
     if(verbose>0):
-        print(INJ.mass,INJ.sigmav/const.cm**3,TH.dT21cm_edges)
-    return TH.dT21cm_edges
+        print(pipe.INJ.mass,pipe.INJ.sigmav/const.cm**3,dT21cm_edges)
+    return dT21cm_edges
 
 if __name__ == '__main__':
     import sys
@@ -7,6 +7,12 @@ class IniFile:
     def __init__(self,fname):
         self.ini = configparser.ConfigParser()
         self.ini.read(fname)
+
+    def Set(self,section,key,value):
+        # override a parameter in memory, e.g. for scans
+        if(not self.ini.has_section(section)):
+            self.ini.add_section(section)
+        self.ini[section][key] = str(value)
         
     def Dump(self):
         print("\n# inifile:")
@@ -16,20 +22,33 @@ class IniFile:
             for key in self.ini[section]:
                 print(" ",key,"=",self.ini[section][key])
           
-    def ReadBoolean(self,section,key):
+    def HasKey(self,section,key):
+        return self.ini.has_option(section,key)
+          
+    def ReadBoolean(self,section,key,default=None):
+        if(default is not None and not self.HasKey(section,key)):
+            return default
         return self.ini[section].getboolean(key)
     
-    def ReadFloat(self,section,key):
+    def ReadFloat(self,section,key,default=None):
+        if(default is not None and not self.HasKey(section,key)):
+            return default
         return float(self.ini[section][key])
     
-    def ReadFloatArray(self,section,key):
+    def ReadFloatArray(self,section,key,default=None):
+        if(default is not None and not self.HasKey(section,key)):
+            return default
         s = self.ini[section][key]
         return np.fromstring(s,dtype=float,sep=",")
 
-    def ReadInt(self,section,key):
+    def ReadInt(self,section,key,default=None):
+        if(default is not None and not self.HasKey(section,key)):
+            return default
         return int(self.ini[section][key])
     
-    def ReadString(self,section,key):
+    def ReadString(self,section,key,default=None):
+        if(default is not None and not self.HasKey(section,key)):
+            return default
         return self.ini[section][key]
     
 #def main():
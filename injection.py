@@ -1,8 +1,21 @@
 import pythia8
 import numpy as np
+import multiprocessing
 import sys
+import speclib
 from scipy import interpolate
 
+# decay products of the resonance for each mode
+decay_channels = {1:"22 22  !  -> gamma gamma",
+                  2:"11 -11 !  -> e+ e-",
+                  3:"15 -15 !  -> tau+ tau-",
+                  4:"5  -5  !  -> b bbar",
+                  5:"24 -24 !  -> W+ W-",
+                  6:"13 -13 !  -> mu+ mu-"}
+event_block = 20000 # final-state particles collected before they are binned
+min_batches = 4 # batches before the error of the adaptive mode is estimated
+pythia_seed = 19780503 # master seed of the worker processes when none is given (the default seed of Pythia)
+
 # A derived class for (e+ e- ->) GenericResonance -> various final states.
 class Sigma1GenRes(pythia8.SigmaProcess):
 
@@ -109,10 +122,77 @@ def main07():
 if __name__ == '__main__':
     main07()
 
+def PythiaEvents(args):
+    # counts of final-state energies in the log bins of Injection (photons, e+-, p/pbar, neutrinos and the rest)
+    # in nEvent events of the resonance of energy eCM decaying in mode; run by Injection.RunPythia, possibly in a
+    # worker process
+    eCM,mode,nEvent,seed,nerg,ergmin,ergmax = args
+    pythia = pythia8.Pythia()
+    sigma1GenRes = Sigma1GenRes()
+    pythia.setSigmaPtr(sigma1GenRes)
+    pythia.readFile("inj.cmnd")
+    s0 = str(eCM)
+    s1 = str(eCM*0.01)
+    pythia.readString("Beams:eCM = "+s0) 
+    pythia.readString("999999:all = GeneralResonance void 1 0 0 "+s0+" "+s1+" 0. 0. 0.")
+    pythia.readString("999999:addChannel = 1 1. 101 "+decay_channels[mode])
+    if(seed is not None):
+        pythia.readString("Random:setSeed = on")
+        pythia.readString("Random:seed = "+str(seed))
+    pythia.init()
+
+    nAbort = pythia.mode("Main:timesAllowErrors")
+    dlnerg = np.log(ergmax/ergmin)/nerg
+
+    # final-state particles are collected over blocks of events and binned at once; each particle is fetched
+    # from the event record only once, and its id and energy only if it is final
+    counts = np.zeros([5,nerg])
+    ids = []
+    ergs = []
+    iAbort = 0
+    for iEvent in range(0,nEvent):
+    
+        if not pythia.next():
+            iAbort += 1
+            if iAbort < nAbort: continue
+            print(" Event generation aborted prematurely, owing to error!")
+            break
+
+        event = pythia.event
+        for i in range(0,event.size()):
+            p = event[i]
+            if p.isFinal():
+                ids.append(p.id())
+                ergs.append(p.e())
+        if(len(ids)>=event_block):
+            counts += BinFinal(ids,ergs,nerg,ergmin,dlnerg)
+            ids.clear()
+            ergs.clear()
+    counts += BinFinal(ids,ergs,nerg,ergmin,dlnerg)
+
+    pythia.stat()
+    return counts
+
+def BinFinal(ids,ergs,nerg,ergmin,dlnerg):
+    # counts of final-state particles of ids and energies ergs in the log bins (the binning of pythia8.Hist with
+    # logarithmic x), for photons, e+-, p/pbar, neutrinos and the rest
+    idAbs = np.abs(np.asarray(ids,dtype=int))
+    species = np.select([idAbs==22,idAbs==11,idAbs==2212,(idAbs==12)|(idAbs==14)|(idAbs==16)],[0,1,2,3],4)
+    for i in np.asarray(ids,dtype=int)[species==4]:
+        print(" Error: stable id = %d" % i)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        j = np.floor(np.log(np.asarray(ergs,dtype=float)/ergmin)/dlnerg)
+    inside = (j>=0)&(j<nerg)
+    return np.bincount(species[inside]*nerg+j[inside].astype(int),minlength=5*nerg).reshape(5,nerg)
+
 class Injection:
 
     def __init__(self,verbose=0):
         self.verbose = verbose
+        self.nproc = 1
+        self.seed = None
+        self.tol = 0.
+        self.speclib = ""
 
     def SetParams(self,intype,mass,mult,mode,use_prec,nerg,ergmin,ergmax):
         self.intype = intype
@@ -140,63 +220,62 @@ class Injection:
         else: # decay rate in 1/s
             self.gamma = rate
             
+    def SetPythia(self,nproc=1,seed=None,tol=0.,batch=200,maxevents=1000000,weights=None):
+        # events are generated in nproc processes; each seeds Pythia with a seed derived from the master seed,
+        # so that the spectra are reproducible for given seed and nproc (seed=None keeps Pythia's default seed
+        # when nproc==1). If tol>0, events are generated in batches of batch events, instead of the number in
+        # inj.cmnd, until the relative error of the energy-weighted spectra (or of the linear functionals of them
+        # given by weights, see BatchError) is below tol, or maxevents are generated
+        self.nproc = nproc
+        self.seed = seed
+        self.tol = tol
+        self.batch = batch
+        self.maxevents = maxevents
+        self.weights = weights
+
+    def SetSpecLib(self,path):
+        # spectra are interpolated from the library of speclib.py in path instead of computed, if path is not blank
+        self.speclib = path
+
+    def Seed(self,key):
+        # seed of Pythia (between 1 and 900000000) derived from the master seed for the worker key
+        ss = np.random.SeedSequence(pythia_seed if self.seed is None else self.seed,spawn_key=key)
+        return int(ss.generate_state(1)[0])%900000000+1
+
+    def Pool(self,nproc):
+        # workers of a pool (e.g. scan.py) cannot start processes; the tasks are then run in turn
+        if(nproc>1 and not multiprocessing.current_process().daemon):
+            return multiprocessing.Pool(nproc)
+        return None
+
     def RunPythia(self):
-        pythia = pythia8.Pythia()
-        sigma1GenRes = Sigma1GenRes()
-        pythia.setSigmaPtr(sigma1GenRes)
-        pythia.readFile("inj.cmnd")
-        s0 = str(self.eCM)
-        s1 = str(self.eCM*0.01)
-        pythia.readString("Beams:eCM = "+s0) 
-        pythia.readString("999999:all = GeneralResonance void 1 0 0 "+s0+" "+s1+" 0. 0. 0.")
-        if(self.mode==1):
-            pythia.readString("999999:addChannel = 1 1. 101 22 22  !  -> gamma gamma")
-        elif(self.mode==2):
-            pythia.readString("999999:addChannel = 1 1. 101 11 -11 !  -> e+ e-")
-        elif(self.mode==3):
-            pythia.readString("999999:addChannel = 1 1. 101 15 -15 !  -> tau+ tau-")
-        elif(self.mode==4):
-            pythia.readString("999999:addChannel = 1 1. 101 5  -5  !  -> b bbar")
-        elif(self.mode==5):
-            pythia.readString("999999:addChannel = 1 1. 101 24 -24 !  -> W+ W-")
-        elif(self.mode==6):
-            pythia.readString("999999:addChannel = 1 1. 101 13 -13 !  -> mu+ mu-")
-        else:
+        if(self.mode not in decay_channels):
             print("error: only gamma, e, tau, b, W and mu are supported")
             sys.exit(1)
-        pythia.init()
-        
-        nEvent = pythia.mode("Main:numberOfEvents")
-        nAbort = pythia.mode("Main:timesAllowErrors")
-        
-        iAbort = 0
-        for iEvent in range(0,nEvent):
-    
-            if not pythia.next():
-                iAbort += 1
-                if iAbort < nAbort: continue
-                print(" Event generation aborted prematurely, owing to error!")
-                break
-      
-            # Loop over all particles and analyze the final-state ones.
-            for i in range(0,pythia.event.size()):
-                if pythia.event[i].isFinal():
-                    idAbs = pythia.event[i].idAbs()
-                    eI = pythia.event[i].e()
-                    if idAbs == 22: 
-                        self.eGamma.fill(eI)
-                    elif idAbs == 11: 
-                        self.eE.fill(eI)
-                    elif idAbs == 2212:
-                        self.eP.fill(eI)
-                    elif (idAbs ==12 or idAbs ==14 or idAbs ==16):
-                        self.eNu.fill(eI)
-                    else:
-                        self.eRest.fill(eI)
-                        print(" Error: stable id = %d" % pythia.event[i].id())
-            
+        if(self.tol>0):
+            counts,nEvent = self.RunBatches()
+        else:
+            pythia = pythia8.Pythia()
+            pythia.readFile("inj.cmnd")
+            nEvent = pythia.mode("Main:numberOfEvents")
+            nproc = max(1,min(self.nproc,nEvent))
+            seeds = [None] if nproc==1 and self.seed is None else [self.Seed((k,)) for k in range(nproc)]
+            tasks = [(self.eCM,self.mode,nEvent//nproc+(k<nEvent%nproc),seeds[k],self.nerg,self.ergmin,self.ergmax) for k in range(nproc)]
+            pool = self.Pool(nproc)
+            if(pool is not None):
+                with pool:
+                    counts = pool.map(PythiaEvents,tasks)
+            else:
+                counts = [PythiaEvents(task) for task in tasks]
+            counts = np.sum(counts,axis=0)
+
+        # the merged counts are filled back at the bin centres, so that the histograms are those of a single run
+        ergc = self.ergmin*np.exp(self.dlnerg*(np.arange(self.nerg)+0.5))
+        for h,c in zip([self.eGamma,self.eE,self.eP,self.eNu,self.eRest],counts):
+            for j in np.nonzero(c)[0]:
+                h.fill(ergc[j],c[j])
+
         # Final statistics and histograms.
-        pythia.stat()
         self.eGamma *=  1/(self.dlnerg*nEvent)
         self.eE     *=  1/(self.dlnerg*nEvent)
         self.eP     *=  1/(self.dlnerg*nEvent)
@@ -220,6 +299,57 @@ class Injection:
             # Use logarithmic y scale.
             hpl.plot(False)
 
+    def RunBatches(self):
+        # rounds of one batch per process until BatchError<=tol; returns the summed counts and the number of events.
+        # No round goes beyond maxevents, whose last batch is cut to the remaining events
+        batches = []
+        nevents = []
+        if(-(-self.maxevents//self.batch)<min_batches):
+            print("warning: maxevents = %d allows fewer than %d batches of %d events, too few to estimate the error"%(self.maxevents,min_batches,self.batch))
+        self.err = np.inf
+        pool = self.Pool(self.nproc)
+        try:
+            while(sum(nevents)<self.maxevents):
+                r = len(batches)//self.nproc
+                left = self.maxevents-sum(nevents)
+                sizes = [min(self.batch,left-k*self.batch) for k in range(self.nproc) if left>k*self.batch]
+                tasks = [(self.eCM,self.mode,n,self.Seed((r,k)),self.nerg,self.ergmin,self.ergmax) for k,n in enumerate(sizes)]
+                batches += pool.map(PythiaEvents,tasks) if pool is not None else [PythiaEvents(task) for task in tasks]
+                nevents += sizes
+                if(len(batches)>=min_batches):
+                    self.err = self.BatchError(batches,nevents)
+                    if(self.verbose>0): print(" %d events: relative error %e"%(sum(nevents),self.err))
+                    if(self.err<=self.tol):
+                        break
+        finally:
+            if(pool is not None):
+                pool.close()
+                pool.join()
+        if(1<len(batches)<min_batches):
+            self.err = self.BatchError(batches,nevents)
+        nEvent = sum(nevents)
+        if(self.err>self.tol):
+            print("warning: relative error of the injection spectra is %e after %d events"%(self.err,nEvent))
+        self.nevent = nEvent
+        return np.sum(batches,axis=0),nEvent
+
+    def BatchError(self,batches,nevents=None):
+        # relative statistical error of the mean over batches, from their scatter: the error of the energy-weighted
+        # spectra of photons and e+- relative to the spectra (in the L2 norm over energy bins, the larger of the two),
+        # or, if weights [2,nerg,m] are given, that of the m functionals sum_j weights[s,j,:]*erg[j]*counts[s,j]
+        # summed over photons (s=0) and e+- (s=1), e.g. fz from Therm.FzWeights; per event if the numbers of events
+        # nevents of the batches are given
+        x = np.array(batches)[:,0:2,:]*self.erg
+        if(nevents is not None):
+            x = x/np.asarray(nevents,dtype=float)[:,None,None]
+        n = len(batches)
+        if(self.weights is not None):
+            x = np.einsum("bsj,sjm->bm",x,self.weights)[:,None,:]
+        mean = np.mean(x,axis=0)
+        se = np.std(x,axis=0,ddof=1)/np.sqrt(n)
+        norm = np.sqrt(np.sum(mean**2,axis=-1))
+        return np.max(np.sqrt(np.sum(se**2,axis=-1))[norm>0]/norm[norm>0],initial=0)
+
     def GetBinnedNumber(self):
         if(self.eCM<10): #this is where Pythia doesn't work
             self.spec_elec = np.zeros(self.nerg) 
@@ -237,6 +367,9 @@ class Injection:
                 print("error: only mode==1 or 2 is supported at mass<5GeV because of the limitation of Pythia")
                 sys.exit(1)
 
+        elif(self.speclib):
+            self.spec_elec,self.spec_phot = speclib.Load(self.speclib).Spectra(self.mode,self.eCM,self.erg,self.ergmin,self.dlnerg)
+
         elif(self.use_prec):
             from addon import function #please set annmode in the form of  'WW', 'bb', 'tautau', 'ee', or '2gam'
             if(self.mode==1):
@@ -0,0 +1,182 @@
+import numpy as np
+from scipy import interpolate
+import os
+import const
+import background
+import injection
+import deposition
+import therm
+import response
+
+def FileStamp(path):
+    try:
+        st = os.stat(path)
+        return (path,st.st_size,st.st_mtime_ns)
+    except OSError:
+        return (path,None,None)
+
+def Key(params):
+    # hashable form of the parameters of a stage
+    return tuple((k,tuple(v) if isinstance(v,np.ndarray) else v) for k,v in sorted(params.items()))
+
+class Pipeline:
+    # the calculation of driver.main split into stages, each of which is recomputed only when its parameters
+    # (read from the ini by Inputs<stage>) or one of its upstream stages changed since the last Run
+
+    def __init__(self,verbose=0):
+        self.verbose = verbose
+        # stages in order of evaluation and the stages each depends on
+        self.stages = [("Background",[]),
+                       ("Clumpiness",[]),
+                       ("Tables",[]),
+                       ("Deposition",["Background","Clumpiness","Tables"]),
+                       ("Injection",["Tables"]),
+                       ("Fz",["Deposition","Injection"]),
+                       ("Therm",["Background","Fz"]),
+                       ("Tspin",["Therm"])]
+        self.keys = {}
+        self.versions = {}
+        self.TH = therm.Therm(verbose=verbose)
+
+    def Invalidate(self,name=None):
+        # force the stage name (all stages if None) and its downstream stages to be recomputed by the next Run
+        if(name is None):
+            self.keys.clear()
+        else:
+            self.keys.pop(name,None)
+
+    def Run(self,Ini):
+        # brings every stage up to date with Ini and returns dT_21cm at EDGES
+        self.TH.SetParams(Ini.ReadString("OUTPUT","root"),Ini.ReadInt("OUTPUT","nz21cm",100))
+        for name,deps in self.stages:
+            params = getattr(self,"Inputs"+name)(Ini)
+            key = (Key(params),)+tuple(self.versions[d] for d in deps)
+            if(self.keys.get(name)==key):
+                continue
+            if(self.verbose>0): print("\n# stage "+name)
+            getattr(self,"Compute"+name)(params)
+            self.keys[name] = key
+            self.versions[name] = self.versions.get(name,0)+1
+        return self.TH.dT21cm_edges
+
+    def Root(self,Ini):
+        # the output files are only written when verbose, in which case a new root needs a rerun
+        return Ini.ReadString("OUTPUT","root") if self.verbose>0 else None
+
+    # fiducial cosmology
+    def InputsBackground(self,Ini):
+        section = "COSMOLOGY"
+        return {"params":np.array([Ini.ReadFloat(section,"ob"),Ini.ReadFloat(section,"odm"),Ini.ReadFloat(section,"ode"),
+                                   Ini.ReadFloat(section,"nnu"),Ini.ReadFloat(section,"mnu")])}
+
+    def ComputeBackground(self,p):
+        self.BG = background.Background(verbose=self.verbose)
+        self.BG.SetParams(p["params"])
+
+    # clumpiness
+    def InputsClumpiness(self,Ini):
+        path = Ini.ReadString("NBODY","clumpiness")
+        return {"path":path,"stamp":FileStamp(path)}
+
+    def ComputeClumpiness(self,p):
+        if(self.verbose>0):
+            print(" cluminess (ignored when intype==2)")
+            # clumz is ln(B) as function of ln(1+z) constructed from a lookup table of "z B(z)".
+        try:
+            tab = np.loadtxt(p["path"])
+            self.clumz = interpolate.make_interp_spline(np.log(1+tab[:,0]),np.log(1+tab[:,1]))
+            if(self.verbose>0):
+                print(" cluminess factor is read from ",p["path"])
+        except:
+            if(self.verbose>0):
+                print(" table file for clumpiness factor is missing; cluminess is ignored:")
+            self.clumz = lambda x:0
+
+    # transfer functions of energy deposition
+    def InputsTables(self,Ini):
+        section = "DEPOSITION"
+        epspath = os.path.join(Ini.ReadString(section,"epspath"),"")
+        return {"epspath":epspath,"intype":Ini.ReadInt("INJECTION","intype"),"cachepath":Ini.ReadString(section,"cachepath",""),
+                "lowmem":Ini.ReadBoolean(section,"lowmem",False),
+                "channels":Ini.ReadFloatArray(section,"channels",np.array([])).astype(int),
+                "causal":Ini.ReadBoolean(section,"causal",False),
+                "stamps":tuple(FileStamp(epspath+s+"_processed_results.fits") for s in ["elec","phot"])}
+
+    def ComputeTables(self,p):
+        self.DE = deposition.Deposit(verbose=self.verbose)
+        self.DE.SetParams(p["epspath"],p["intype"],p["cachepath"],p["lowmem"],p["channels"],p["causal"])
+
+    # deposition fractions integrated over injection redshift
+    def InputsDeposition(self,Ini):
+        return {}
+
+    def ComputeDeposition(self,p):
+        # the transfer functions (dense, or their packed causal band) stay in memory unless lowmem, so that a change
+        # of cosmology only redoes the contraction
+        self.DE.Calcfc(self.BG.dtauda,self.clumz)
+
+    # injection spectrum phythia
+    def InputsInjection(self,Ini):
+        section = "INJECTION"
+        use_prec = Ini.ReadBoolean(section,"use_prec")
+        lib = Ini.ReadString(section,"speclib","")
+        return {"intype":Ini.ReadInt(section,"intype"),"mass":Ini.ReadFloat(section,"mass"),"mult":Ini.ReadInt(section,"mult"),
+                "mode":Ini.ReadInt(section,"mode"),"use_prec":use_prec,"stamp":None if use_prec else FileStamp("inj.cmnd"),
+                "speclib":lib,"speclib_stamp":FileStamp(lib) if lib else None,
+                "pythia_nproc":Ini.ReadInt(section,"pythia_nproc",1),"pythia_seed":Ini.ReadInt(section,"pythia_seed",-1),
+                "pythia_tol":Ini.ReadFloat(section,"pythia_tol",0.),"pythia_batch":Ini.ReadInt(section,"pythia_batch",200),
+                "pythia_maxevents":Ini.ReadInt(section,"pythia_maxevents",1000000),
+                # with the tolerance on fz, the spectrum depends on the deposition fractions too
+                "deposition":self.versions.get("Deposition") if Ini.ReadBoolean(section,"pythia_tolfz",False) else None}
+
+    def ComputeInjection(self,p):
+        DE = self.DE
+        self.INJ = injection.Injection(verbose=self.verbose)
+        mspec = 5
+        self.INJ.SetParams(p["intype"],p["mass"],p["mult"],p["mode"],p["use_prec"],DE.nerg*mspec,
+                           DE.erg[0]*const.eV/const.GeV,DE.erg[DE.nerg-1]*const.eV/const.GeV)
+        self.INJ.SetPythia(p["pythia_nproc"],p["pythia_seed"] if p["pythia_seed"]>=0 else None,
+                           p["pythia_tol"],p["pythia_batch"],p["pythia_maxevents"])
+        self.INJ.SetSpecLib(p["speclib"])
+        if(p["deposition"] is not None):
+            self.INJ.weights = self.TH.FzWeights(DE,self.INJ)
+        self.INJ.GetBinnedNumber()
+
+    # deposition efficiency
+    def InputsFz(self,Ini):
+        return {"root":self.Root(Ini)}
+
+    def ComputeFz(self,p):
+        self.TH.IntegEnergy(self.DE,self.INJ)
+
+    # IGM evolution; the rate only enters here
+    def InputsTherm(self,Ini):
+        section = "INJECTION"
+        rate = Ini.ReadFloat(section,"sigmav") if Ini.ReadInt(section,"intype")==1 else Ini.ReadFloat(section,"gamma")
+        section = "COSMOLOGY"
+        return {"rate":rate,"hyrec_hubble":Ini.ReadBoolean(section,"hyrec_hubble",False),
+                "hyrec_zmin":Ini.ReadFloat(section,"hyrec_zmin",0.),"hyrec_tol":Ini.ReadFloat(section,"hyrec_tol",0.),
+                "response_tol":Ini.ReadFloat(section,"response_tol",0.),"root":self.Root(Ini)}
+
+    def ComputeTherm(self,p):
+        self.BG.hyrec_hubble = p["hyrec_hubble"]
+        self.BG.hyrec_zmin = p["hyrec_zmin"]
+        self.BG.hyrec_tol = p["hyrec_tol"]
+        self.INJ.SetRate(p["rate"])
+        # one Response per Background, whose kernels are computed by the first history and recomputed only when
+        # the settings of HyRec or the injection grid change (see Response.Key)
+        RS = None
+        if(p["response_tol"]>0):
+            if(getattr(self,"response_version",None)!=self.versions["Background"]):
+                self.RS = response.Response(verbose=self.verbose)
+                self.response_version = self.versions["Background"]
+            self.RS.SetParams(p["response_tol"])
+            RS = self.RS
+        self.TH.ThermInput(self.BG,self.DE,self.INJ,response=RS)
+
+    # 21cm signal
+    def InputsTspin(self,Ini):
+        return {"nz21cm":Ini.ReadInt("OUTPUT","nz21cm",100),"root":self.Root(Ini)}
+
+    def ComputeTspin(self,p):
+        self.TH.EvolveTspin(self.BG,self.DE,self.INJ)
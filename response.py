@@ -0,0 +1,141 @@
+import numpy as np
+from scipy import interpolate
+import os
+import sys
+
+# injection channels in the order of the columns of the kernels; nz1 columns each
+channels = ["ion","exc","heat"]
+
+class LinearHistory:
+    # thermal history predicted from the response kernels: the history without injection plus the linear
+    # perturbation tabulated in ln(a); used by Background in place of a HyrecHistory
+    def __init__(self,hist0,lna,dxe,dtm):
+        self.hist0 = hist0
+        self.lnamin = lna[0]
+        self.lnamax = lna[-1]
+        self.spl_dxe = interpolate.make_interp_spline(lna,dxe)
+        self.spl_dtm = interpolate.make_interp_spline(lna,dtm)
+        self.built = True
+        self.resumed = False
+
+    def xe_array(self,a):
+        return self.hist0.xe_array(a)+self.spl_dxe(np.clip(np.log(a),self.lnamin,self.lnamax))
+
+    def tm_array(self,a):
+        return self.hist0.tm_array(a)+self.spl_dtm(np.clip(np.log(a),self.lnamin,self.lnamax))
+
+class Response:
+
+    def __init__(self,verbose=0):
+        self.verbose = verbose
+        self.tol = 0.05 # largest relative perturbation of xe or Tm predicted linearly
+        self.eps = np.array([1e-7,1e-7,1e-7]) # unit injection of each channel for the finite differences
+        self.nthreads = None
+        self.nlna = 2000 # ln(a) grid of the kernels
+        self.key = None
+        self.K21 = None
+
+    def SetParams(self,tol=0.05,eps=None,nthreads=None):
+        self.tol = tol
+        if(eps is not None):
+            self.eps = np.asarray(eps,dtype=float)*np.ones(len(channels))
+        self.nthreads = nthreads
+        if(self.verbose>0):
+            print("\n# linear response of the thermal history")
+            print(" tolerance of the linear prediction: %e"%self.tol)
+            print(" unit injections:",self.eps)
+
+    def Key(self,BG,z1):
+        # the kernels depend on the cosmology, the settings of HyRec and the injection grid
+        return (BG.obh2,BG.odmh2,BG.odeh2,BG.yp,BG.nu.nnu,tuple(BG.nu.mass),BG.hyrec_hubble,BG.hyrec_zmin,BG.hyrec_tol,
+                np.asarray(z1,dtype=float).tobytes())
+
+    def Compute(self,BG,z1,TH=None):
+        # response of xe and Tm (and of dT_21cm of TH.Tspin if TH is given) to a unit injection in each bin of z1
+        # and each channel, by finite differences from a history without injection; skipped if already computed
+        key = self.Key(BG,z1)
+        if(key==self.key and (TH is None or self.K21 is not None)):
+            return
+        self.key = key
+        self.z1 = np.array(z1,dtype=float)
+        nz1 = len(self.z1)
+        self.lna = np.linspace(-np.log(BG.z1max_therm),-np.log1p(BG.hyrec_zmin),self.nlna)
+        a = np.exp(self.lna)
+        if(self.verbose>0): print("\n# response kernels of %d bins x %d channels"%(nz1,len(channels)))
+
+        self.checkpoint = BG.ThermCheckpoint()
+        zero = np.zeros(nz1)
+        self.hist0 = BG.ThermHistory(zero,zero,zero,self.z1).build(self.checkpoint)
+        self.xe0 = self.hist0.xe_array(a)
+        self.tm0 = self.hist0.tm_array(a)
+        self.Kxe = np.empty([self.nlna,len(channels)*nz1])
+        self.Ktm = np.empty([self.nlna,len(channels)*nz1])
+
+        # Tspin only uses Xe and Tm of BG, so its history is swapped in without recomputing the tables
+        hist_bg = getattr(BG,"hist",None)
+        self.K21 = None
+        if(TH is not None):
+            if(not hasattr(TH,"spl_kappaHH")):
+                TH.SetKappa()
+            BG.hist = self.hist0
+            arr = TH.Tspin(BG)
+            self.z1_21cm = arr[:,0]
+            self.T21_0 = arr[:,4]
+            K21 = np.empty([len(arr),len(channels)*nz1])
+
+        injections = []
+        for c in range(len(channels)):
+            for k in range(nz1):
+                X = np.zeros([len(channels),nz1])
+                X[c,k] = self.eps[c]
+                injections.append((X[0],X[1],X[2],self.z1))
+        # in chunks, so that only a few full-resolution histories are held at a time
+        nchunk = 4*(self.nthreads or os.cpu_count() or 1)
+        for j0 in range(0,len(injections),nchunk):
+            hists = BG.UpdateThermBatch(injections[j0:j0+nchunk],self.nthreads,self.checkpoint)
+            for j,hist in enumerate(hists,j0):
+                eps = self.eps[j//nz1]
+                self.Kxe[:,j] = (hist.xe_array(a)-self.xe0)/eps
+                self.Ktm[:,j] = (hist.tm_array(a)-self.tm0)/eps
+                if(TH is not None):
+                    BG.hist = hist
+                    K21[:,j] = (TH.Tspin(BG)[:,4]-self.T21_0)/eps
+        if(TH is not None):
+            self.K21 = K21
+        if(hist_bg is not None):
+            BG.hist = hist_bg
+
+    def Predict(self,Xion,Xexc,Xheat):
+        # linear perturbations of xe and Tm on self.lna, and their largest relative size
+        X = np.concatenate([Xion,Xexc,Xheat])
+        dxe = self.Kxe@X
+        dtm = self.Ktm@X
+        dev = max(np.nanmax(np.abs(dxe/self.xe0)),np.nanmax(np.abs(dtm/self.tm0)))
+        return dxe,dtm,dev
+
+    def Predict21cm(self,Xion,Xexc,Xheat):
+        # 1+z and dT_21cm [K] of TH.Tspin predicted linearly; needs Compute with TH
+        if(self.K21 is None):
+            print("error: kernels of the 21cm brightness temperature are not computed")
+            sys.exit(1)
+        return self.z1_21cm,self.T21_0+self.K21@np.concatenate([Xion,Xexc,Xheat])
+
+    def History(self,Xion,Xexc,Xheat):
+        # LinearHistory, or None if the predicted perturbation exceeds tol
+        dxe,dtm,dev = self.Predict(Xion,Xexc,Xheat)
+        if(self.verbose>0): print(" largest relative perturbation predicted linearly: %e"%dev)
+        if(not dev<=self.tol):
+            return None
+        return LinearHistory(self.hist0,self.lna,dxe,dtm)
+
+    def UpdateTherm(self,BG,Xion,Xexc,Xheat,z1):
+        # like BG.UpdateTherm; the kernels are computed when first needed for the cosmology of BG and z1,
+        # and a full run is done instead when the predicted perturbation exceeds tol
+        self.Compute(BG,z1)
+        hist = self.History(Xion,Xexc,Xheat)
+        self.linear = hist is not None
+        if(self.linear):
+            if(BG.verbose>0): print("thermal history is predicted by linear response")
+            BG.SetHistory(hist)
+        else:
+            BG.UpdateTherm(Xion,Xexc,Xheat,z1,self.checkpoint)
@@ -0,0 +1,149 @@
+import numpy as np
+from scipy import optimize
+from scipy import interpolate
+import multiprocessing
+import sys
+import inifile
+import driver
+
+# state of a worker process, set once by Init; HyRec and the pipeline of driver are global to the process,
+# so points are distributed over processes and each evaluates one point at a time
+worker = {}
+
+def Init(paramfile,verbose):
+    worker["Ini"] = inifile.IniFile(paramfile)
+    worker["verbose"] = verbose
+
+def Evaluate(mass,mode,rate):
+    # dT_21cm at EDGES for the parameters of the worker with mass, mode and the injection rate replaced in memory
+    Ini = worker["Ini"]
+    section = "INJECTION"
+    Ini.Set(section,"mass",repr(float(mass)))
+    Ini.Set(section,"mode",int(mode))
+    Ini.Set(section,"sigmav" if Ini.ReadInt(section,"intype")==1 else "gamma",repr(float(rate)))
+    return driver.Run(Ini,worker["verbose"])
+
+def MonotoneRoots(func,memo,thresholds,xtol=1e-8,maxiter=100):
+    # x at which the monotone function func crosses each threshold, starting from the evaluations memo {x:func(x)}
+    # (updated in place), which must bracket all thresholds; the thresholds share all evaluations, until every
+    # bracket is narrower than xtol. As in Brent's method, new points are placed by inverse quadratic interpolation
+    # of the three evaluations closest to the threshold, by the crossing of a monotone (PCHIP) interpolant of memo
+    # at the first iteration or when that falls outside the bracket, or at the midpoint when a bracket does not halve
+    # in two iterations
+    roots = np.full(len(thresholds),np.nan)
+    widths = [[] for t in thresholds]
+    for it in range(maxiter):
+        x = np.array(sorted(memo))
+        y = np.array([memo[v] for v in x])
+        spl = interpolate.PchipInterpolator(x,y)
+        new = []
+        for i,t in enumerate(thresholds):
+            j = np.nonzero((y[:-1]-t)*(y[1:]-t)<=0)[0]
+            if(len(j)==0):
+                if(it==0): print("warning: threshold %e is not bracketed"%t)
+                continue
+            j = j[0]
+            a,b = x[j],x[j+1]
+            if(y[j]==t or y[j+1]==t or b-a<=xtol):
+                roots[i] = a if y[j]==t else b if y[j+1]==t else a+(t-y[j])*(b-a)/(y[j+1]-y[j])
+                continue
+            widths[i].append(b-a)
+            if(len(widths[i])>2 and widths[i][-1]>0.5*widths[i][-3]):
+                c = 0.5*(a+b)
+            else:
+                k = np.argsort(np.abs(y-t))[:3]
+                c = np.polyval(np.polyfit(y[k]-t,x[k],2),0) if len(widths[i])>1 and len(np.unique(y[k]))==3 else np.nan
+                if(not a<c<b):
+                    c = optimize.brentq(lambda v:spl(v)-t,a,b)
+            # a step of at least xtol/2 from the bracket, so that an accurate estimate closes it
+            if(c-a<xtol and c-a<=b-c):
+                c = a+0.5*xtol
+            elif(b-c<xtol):
+                c = b-0.5*xtol
+            new.append(c)
+        if(len(new)==0):
+            return roots
+        # thresholds whose estimates coincide share one evaluation
+        new = np.sort(new)
+        for c in new[np.concatenate([[True],np.diff(new)>0.5*xtol])]:
+            memo[c] = func(c)
+    print("warning: thresholds are not converged in %d iterations"%maxiter)
+    for i,t in enumerate(thresholds):
+        if(np.isnan(roots[i])):
+            j = np.nonzero((y[:-1]-t)*(y[1:]-t)<=0)[0]
+            if(len(j)>0): roots[i] = optimize.brentq(lambda v:spl(v)-t,x[j[0]],x[j[0]+1])
+    return roots
+
+def Constrain(point):
+    # rates at which dT_21cm reaches each threshold for one mass and mode: the rate is increased by factors of
+    # exp(dln_rate) from rate_low until dT_21cm exceeds the largest threshold, then all thresholds are solved together
+    # in this bracket, reusing every evaluation of dT_21cm in ln(rate)
+    mass,mode,thresholds,rate_low,dln_rate,nstep,xtol = point
+    try:
+        func = lambda lnrate: Evaluate(mass,mode,np.exp(lnrate))
+        lnrate = np.log(rate_low)
+        memo = {lnrate:func(lnrate)}
+        top = np.max(thresholds)
+        for n in range(nstep):
+            lnrate += dln_rate
+            memo[lnrate] = func(lnrate)
+            if(memo[lnrate]>top):
+                break
+        else:
+            print("warning: dT_21cm does not reach %e at mass=%e, mode=%d"%(top,mass,mode))
+            return mass,mode,np.full(len(thresholds),np.nan)
+
+        rates = np.exp(MonotoneRoots(func,memo,thresholds,xtol))
+    except SystemExit:
+        # driver stops with sys.exit on errors, which would otherwise kill the worker and leave the pool waiting
+        raise RuntimeError("driver stopped at mass=%e, mode=%d"%(mass,mode))
+    return mass,mode,rates
+
+class Scan:
+
+    def __init__(self,paramfile,verbose=0):
+        self.paramfile = paramfile
+        self.verbose = verbose
+
+    def SetParams(self,masses,modes,thresholds,rate_low=1e-30,dln_rate=0.7,nstep=100,nproc=None,xtol=1e-8):
+        # rate_low is per GeV of mass, i.e. the search for each mass starts from rate_low*mass;
+        # the rates are solved to a relative accuracy xtol
+        self.masses = np.asarray(masses,dtype=float)
+        self.modes = np.asarray(modes,dtype=int)
+        self.thresholds = np.asarray(thresholds,dtype=float)
+        self.rate_low = rate_low
+        self.dln_rate = dln_rate
+        self.nstep = nstep
+        self.nproc = nproc
+        self.xtol = xtol
+        if(self.verbose>0):
+            print("\n# scan of %d masses x %d modes"%(len(self.masses),len(self.modes)))
+            print(" thresholds of dT_21cm:",self.thresholds)
+
+    def Points(self):
+        # heavier masses first, since they take longer in Pythia and would otherwise finish last
+        return [(mass,mode,self.thresholds,self.rate_low*mass,self.dln_rate,self.nstep,self.xtol)
+                for mass in np.sort(self.masses)[::-1] for mode in self.modes]
+
+    def Run(self):
+        # yields (mass,mode,rates) as the points complete, in no particular order
+        points = self.Points()
+        nproc = min(self.nproc or multiprocessing.cpu_count(),len(points))
+        with multiprocessing.Pool(nproc,initializer=Init,initargs=(self.paramfile,0)) as pool:
+            for result in pool.imap_unordered(Constrain,points,chunksize=1):
+                yield result
+
+if __name__ == '__main__':
+
+    args = sys.argv
+    if(len(args)<5):
+        print("error: the number of input parameters is not correct; input command must be")
+        print(">$ python scan.py params.ini masses modes thresholds [nproc]")
+        print(" where masses, modes and thresholds are comma-separated lists")
+        sys.exit(1)
+
+    S = Scan(args[1],verbose=1)
+    S.SetParams(np.fromstring(args[2],sep=","),np.fromstring(args[3],sep=",").astype(int),np.fromstring(args[4],sep=","),
+                nproc=int(args[5]) if len(args)>5 else None)
+    for mass,mode,rates in S.Run():
+        print(mass,mode," ".join(str(r) for r in rates),flush=True)
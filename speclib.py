@@ -0,0 +1,99 @@
+import numpy as np
+import os
+import sys
+
+lib_version = 1 # bump whenever the content of the library file changes
+# libraries read once per process, keyed by file; see Load
+lib_cache = {}
+
+def Load(path):
+    if(path not in lib_cache):
+        lib = SpecLib()
+        lib.Read(path)
+        lib_cache[path] = lib
+    return lib_cache[path]
+
+class SpecLib:
+    # photon and e+- spectra dN/dln(x) per event of x=E/eCM from Pythia, tabulated for each mode on a log grid of eCM;
+    # the spectra at other eCM are interpolated linearly in ln(eCM) at fixed x
+
+    def __init__(self,verbose=0):
+        self.verbose = verbose
+
+    def Build(self,modes,ecm,nx=1000,xmin=1e-10,nproc=1,seed=None,tol=0.,batch=200):
+        # runs Injection.RunPythia (with the options of Injection.SetPythia) for each mode and eCM, on nx log bins
+        # of x between xmin and 1
+        import injection
+        self.modes = np.asarray(modes,dtype=int)
+        self.ecm = np.asarray(ecm,dtype=float)
+        self.dlnx = -np.log(xmin)/nx
+        self.lnx = np.log(xmin)+self.dlnx*(np.arange(nx)+0.5) # bin centres
+        self.spec = np.empty([len(self.modes),len(self.ecm),2,nx])
+        for m,mode in enumerate(self.modes):
+            for i,e in enumerate(self.ecm):
+                if(self.verbose>0): print("\n# spectra of mode %d at eCM = %e GeV"%(mode,e))
+                INJ = injection.Injection(verbose=self.verbose)
+                INJ.SetParams(2,e,1,mode,False,nx,xmin*e,e)
+                INJ.SetPythia(nproc,seed,tol,batch)
+                INJ.RunPythia()
+                self.spec[m,i,0] = [INJ.eGamma.getBinContent(j+1) for j in range(nx)]
+                self.spec[m,i,1] = [INJ.eE.getBinContent(j+1) for j in range(nx)]
+
+    def Write(self,path):
+        # to a unique temporary file and renamed, so that concurrent readers never see a partial file
+        tmp = path+"."+str(os.getpid())+".tmp.npz"
+        np.savez_compressed(tmp,version=lib_version,modes=self.modes,ecm=self.ecm,lnx=self.lnx,spec=self.spec)
+        os.replace(tmp,path)
+
+    def Read(self,path):
+        with np.load(path) as f:
+            if(f["version"]!=lib_version):
+                print("error: version of spectrum library "+path+" is not supported; rebuild it")
+                sys.exit(1)
+            self.modes = f["modes"]
+            self.ecm = f["ecm"]
+            self.lnx = f["lnx"]
+            self.spec = f["spec"]
+        self.path = path
+
+    def Spectra(self,mode,eCM,erg,ergmin,dlnerg):
+        # spec_elec and spec_phot of Injection.GetBinnedNumber for its energy grid erg (bins of width dlnerg from ergmin)
+        if(mode not in self.modes):
+            print("error: mode %d is not in spectrum library "%mode+self.path)
+            sys.exit(1)
+        if(not self.ecm[0]<=eCM<=self.ecm[-1]):
+            print("error: eCM = %e GeV is out of the range of spectrum library "%eCM+self.path)
+            sys.exit(1)
+        m = np.nonzero(self.modes==mode)[0][0]
+        if(len(self.ecm)==1):
+            # a library of a single eCM is only used at that eCM
+            spec = self.spec[m,0]
+        else:
+            i = min(np.searchsorted(self.ecm,eCM,side="right")-1,len(self.ecm)-2)
+            w = np.log(eCM/self.ecm[i])/np.log(self.ecm[i+1]/self.ecm[i])
+            spec = (1-w)*self.spec[m,i]+w*self.spec[m,i+1]
+        # dN/dln(E) averaged over the bins of erg, from the cumulative number, which is exact for the histograms of
+        # the library and keeps lines (e.g. photons at x=1/2 of mode 1) whatever the bins; weighted as in the Pythia
+        # branch of GetBinnedNumber
+        dlnx = self.lnx[1]-self.lnx[0]
+        lnx_edges = np.concatenate([self.lnx-0.5*dlnx,[self.lnx[-1]+0.5*dlnx]])
+        cum = np.concatenate([np.zeros([2,1]),np.cumsum(spec,axis=1)*dlnx],axis=1)
+        lnx = np.log(ergmin/eCM)+dlnerg*np.arange(len(erg)+1)
+        norm = erg/eCM
+        spec_phot = np.diff(np.interp(lnx,lnx_edges,cum[0]))*norm
+        spec_elec = np.diff(np.interp(lnx,lnx_edges,cum[1]))*norm
+        return spec_elec,spec_phot
+
+if __name__ == '__main__':
+
+    args = sys.argv
+    if(len(args)<6):
+        print("error: the number of input parameters is not correct; input command must be")
+        print(">$ python speclib.py output.npz modes ecmmin ecmmax necm [nproc [tol]]")
+        print(" where modes is a comma-separated list and eCM [GeV] is log-spaced between ecmmin and ecmmax")
+        sys.exit(1)
+
+    lib = SpecLib(verbose=1)
+    lib.Build(np.fromstring(args[2],sep=",").astype(int),np.geomspace(float(args[3]),float(args[4]),int(args[5])),
+              nproc=int(args[6]) if len(args)>6 else 1,tol=float(args[7]) if len(args)>7 else 0.)
+    lib.Write(args[1])
@@ -2,23 +2,58 @@ import numpy as np
 from scipy import interpolate
 from matplotlib import pyplot as plt
 import const
+import sys
+
+# energy-rebinning matrices keyed by the (source, target) grids; see RebinMatrix
+rebin_cache = {}
+# splines of the collisional coupling rates keyed by table file, read once per process; see KappaSpline
+kappa_cache = {}
+
+def RebinMatrix(lnx,lnxnew):
+    # matrix M such that M@y equals the cubic spline of y(lnx) evaluated (and extrapolated) at lnxnew
+    key = (lnx.tobytes(),lnxnew.tobytes())
+    if(key not in rebin_cache):
+        spl = interpolate.interp1d(lnx,np.identity(len(lnx)),kind='cubic',axis=0,bounds_error=False,fill_value="extrapolate")
+        rebin_cache[key] = spl(lnxnew)
+    return rebin_cache[key]
+
+def KappaSpline(filename):
+    # ln(kappa) as function of ln(Tm)
+    if(filename not in kappa_cache):
+        data = np.log(np.loadtxt(filename))
+        kappa_cache[filename] = interpolate.make_interp_spline(data[:,0],data[:,1])
+    return kappa_cache[filename]
 
 class Therm:
 
     def __init__(self,verbose=0):
         self.verbose = verbose
+        self.nz21cm = 100
 
-    def SetParams(self,root):
+    def SetParams(self,root,nz21cm=100):
         self.root = root
+        self.nz21cm = nz21cm # number of redshifts of the 21cm output
         
+    def IntegEnergyBatch(self,DE,erg,spec_elec,spec_phot):
+        # cubic interpolation in ln(E) is linear in the tabulated fc, so fz[n,i] = sum_j M[j,k]*fc[n,k,i]*spec[j]
+        # reduces to contracting fc with the injection spectra pulled back onto the deposition grid; fz [nmodel,nch,nz1out]
+        # of a stack of spectra spec_elec and spec_phot [nmodel,len(erg)] on the energy grid erg [GeV] of Injection
+        # (the same for all masses and modes) in one contraction. DE may also be a list of Deposits on the same grids,
+        # e.g. one per intype (whose fc differ through pow), in which case fz [len(DE),nmodel,nch,nz1out] of every
+        # spectrum with each of them comes from the same contraction
+        DEs = DE if isinstance(DE,(list,tuple)) else [DE]
+        for D in DEs[1:]:
+            if(not ((D.erg==DEs[0].erg).all() and (D.z1out==DEs[0].z1out).all())):
+                print("error: binning of the deposition fractions disagree")
+                sys.exit(1)
+        rebin = RebinMatrix(np.log(DEs[0].erg),np.log(erg*const.GeV/const.eV))
+        w = np.stack([np.atleast_2d(spec_elec)@rebin,np.atleast_2d(spec_phot)@rebin],axis=1)
+        fc = np.array([[D.epsdata[0].fc,D.epsdata[1].fc] for D in DEs])
+        fz = np.moveaxis(np.tensordot(w,fc,axes=([1,2],[1,3])),1,0)
+        return fz if isinstance(DE,(list,tuple)) else fz[0]
+
     def IntegEnergy(self,DE,INJ):
-        self.fz = np.empty([DE.nch,DE.nz1out])
-        lnerg = np.log(INJ.erg*const.GeV/const.eV)
-        for n in range(DE.nch):
-            for i in range(DE.nz1out):
-                spl_elec = interpolate.interp1d(np.log(DE.erg),DE.epsdata[0].fc[n,:,i],kind='cubic',bounds_error=False,fill_value="extrapolate")
-                spl_phot = interpolate.interp1d(np.log(DE.erg),DE.epsdata[1].fc[n,:,i],kind='cubic',bounds_error=False,fill_value="extrapolate")
-                self.fz[n,i] = np.sum(spl_phot(lnerg)*INJ.spec_phot[:]+spl_elec(lnerg)*INJ.spec_elec[:])
+        self.fz = self.IntegEnergyBatch(DE,INJ.erg,INJ.spec_elec,INJ.spec_phot)[0]
         if(self.verbose>0):
             np.savetxt(self.root+"_fz.txt",np.transpose(np.concatenate([DE.z1out[None,:],self.fz[:,:]],axis=0)))
             plt.figure()
@@ -37,90 +72,107 @@ class Therm:
             plt.legend()
             plt.savefig(self.root+"_fz.pdf")
 
-    def ThermInput(self,BG,DE,INJ):
-        self.Xion = np.empty(DE.nz1out)
-        self.Xexc = np.empty(DE.nz1out)
-        self.Xheat = np.empty(DE.nz1out)
-        for i in range(DE.nz1out):
-            a = 1/DE.z1out[i]
-            if(INJ.intype==1):
-                sigmav = INJ.sigmav
-                Gamma = sigmav*BG.odmh2*const.rhoch2/(a*a*a)/(INJ.mass*const.GeV)/INJ.mult # is this correct?
-            elif(INJ.intype==2):
-                Gamma = INJ.gamma
-            Hinv = a*a*BG.dtauda(a)
-            x = Gamma*Hinv*BG.odmh2/BG.obh2/(1-BG.yp)*const.m_H*const.c**2
-            self.Xion[i] = self.fz[0,i]*x/const.VH
-            self.Xexc[i] = self.fz[2,i]*x/(const.VH*0.75)
-            self.Xheat[i] = self.fz[3,i]*x/const.eV
-        BG.UpdateTherm(self.Xion,self.Xexc,self.Xheat)
+    def FzWeights(self,DE,INJ):
+        # weights of Injection.BatchError such that its functionals of the energy-weighted spectra are proportional
+        # to fz of IntegEnergy (flattened over channels and redshifts)
+        rebin = RebinMatrix(np.log(DE.erg),np.log(INJ.erg*const.GeV/const.eV))
+        fc = [np.moveaxis(eps.fc,1,0).reshape(DE.nerg,-1) for eps in DE.epsdata]
+        return np.array([rebin@fc[1],rebin@fc[0]]) # photons and electrons, in the order of the spectra of Injection
+
+    def ThermInput(self,BG,DE,INJ,response=None):
+        # with a response.Response, the history is predicted from its kernels when the injection is small
+        a = 1/DE.z1out
+        if(INJ.intype==1):
+            sigmav = INJ.sigmav
+            Gamma = sigmav*BG.odmh2*const.rhoch2/(a*a*a)/(INJ.mass*const.GeV)/INJ.mult # is this correct?
+        elif(INJ.intype==2):
+            Gamma = INJ.gamma
+        Hinv = a*a*BG.dtauda(a)
+        x = Gamma*Hinv*BG.odmh2/BG.obh2/(1-BG.yp)*const.m_H*const.c**2
+        self.Xion = self.fz[0,:]*x/const.VH
+        self.Xexc = self.fz[2,:]*x/(const.VH*0.75)
+        self.Xheat = self.fz[3,:]*x/const.eV
+        if(response is None):
+            BG.UpdateTherm(self.Xion,self.Xexc,self.Xheat,DE.z1out)
+        else:
+            response.UpdateTherm(BG,self.Xion,self.Xexc,self.Xheat,DE.z1out)
         if(self.verbose>0):
             nz1 = 100
             z1start = 2000
             z1end = 1
             dlnz1 = np.log(z1end/z1start)/(nz1-1)
             arr = np.empty([nz1,3])
-            for i in range(nz1):
-                from HyRec import pyrec
-                arr[i,0] = z1start*np.exp(dlnz1*i)
-                arr[i,1] = pyrec.hyrec_xe(1/arr[i,0])
-                arr[i,2] = pyrec.hyrec_tm(1/arr[i,0])
+            arr[:,0] = z1start*np.exp(dlnz1*np.arange(nz1))
+            arr[:,1] = BG.Xe(1/arr[:,0])
+            arr[:,2] = BG.Tm(1/arr[:,0])
             np.savetxt(self.root+"_therm.txt",arr)
 
+    def SetKappa(self):
+        # interpolation of collisional coupling rates
+        self.spl_kappaHH = KappaSpline("./data/kappaHH.dat") # based on Table 3 in https://arxiv.org/abs/astro-ph/0608032
+        self.spl_kappaHe = KappaSpline("./data/kappaHe.dat") # based on Table 4 in https://arxiv.org/abs/astro-ph/0608032
+
     def EvolveTspin(self,BG,DE,INJ):
-        # initialize interpolation of collisional coupling rates
-        filename = "./data/kappaHH.dat" # based on Table 3 in https://arxiv.org/abs/astro-ph/0608032
-        data = np.log(np.loadtxt(filename))
-        self.spl_kappaHH = interpolate.make_interp_spline(data[:,0],data[:,1])
-        filename = "./data/kappaHe.dat" # based on Table 4 in https://arxiv.org/abs/astro-ph/0608032
-        data = np.log(np.loadtxt(filename))
-        self.spl_kappaHe = interpolate.make_interp_spline(data[:,0],data[:,1])
+        if(not hasattr(self,"spl_kappaHH")):
+            self.SetKappa()
+        arr = self.Tspin(BG)
+        if(self.verbose>0):
+            np.savetxt(self.root+"_21cm.txt",arr)
+        self.dT21cm_edges = self.Edges(arr)
 
-        nz1=100
-        z1start = 1000
-        z1end = 1
-        dlnz1 = np.log(z1end/z1start)/(nz1-1)
-        arr = np.empty([nz1,5])
+    def Edges(self,arr):
+        # For EDGES
+        z_edges=17
+        spl_21cm=interpolate.interp1d(arr[:,0],arr[:,4])
+        return spl_21cm([z_edges])[0]
+
+    def Tspin(self,BG,z1=None):
+        # 1+z, xe, Tspin, tau_21cm and dT_21cm [K] for the thermal history of BG, evaluated at once for an array z1 of 1+z
+        # (by default nz21cm points uniform in ln(1+z) from 1000 to 1)
+        if(z1 is None):
+            z1start = 1000
+            z1end = 1
+            dlnz1 = np.log(z1end/z1start)/(self.nz21cm-1)
+            z1 = z1start*np.exp(dlnz1*np.arange(self.nz21cm))
+        z1 = np.asarray(z1,dtype=float)
+        arr = np.empty([len(z1),5])
         
         nH0 = BG.obh2/(const.m_H*const.c*const.c)*(1-BG.yp)*const.rhoch2
-        
-        for i in range(nz1):
-            from HyRec import pyrec
-            z1 = z1start*np.exp(dlnz1*i)
-            a = 1/z1
-            Tr = const.TCMB/const.kB*z1
-            xe = pyrec.hyrec_xe(a)
-            Tm = pyrec.hyrec_tm(a)
-            Tc = Tm # this should be valid when Ly-alpha is optically thick
+
+        a = 1/z1
+        Tr = const.TCMB/const.kB*z1
+        xe = BG.Xe(a)
+        Tm = BG.Tm(a)
+        Tc = Tm # this should be valid when Ly-alpha is optically thick
             
-            nH = nH0*z1*z1*z1
-            ne = nH*xe
-            nH = nH*(1-xe)
+        nH = nH0*z1*z1*z1
+        ne = nH*xe
+        nH = nH*(1-xe)
             
-            lnTm = np.log(Tm)
-            x_c = nH*np.exp(self.spl_kappaHH(lnTm))+ne*np.exp(self.spl_kappaHe(lnTm))
-            x_c = x_c*const.E21cm/(const.TCMB*z1)/const.A10
+        lnTm = np.log(Tm)
+        x_c = nH*np.exp(self.spl_kappaHH(lnTm))+ne*np.exp(self.spl_kappaHe(lnTm))
+        x_c = x_c*const.E21cm/(const.TCMB*z1)/const.A10
             
-            x_alpha = 0
-            #x_alpha = (16*np.pi*np.pi*np.pi*const.alphaEM/const.m_e/const.c)*0.4162*4/27/const.A10*const.E21cm/const.TCMB/z1
-            #x_alpha = x_alpha* a*a*BG.dtauda(a)/16*(const.c*const.hbar*2*np.pi)/(const.VH*const.VH*9/16)*#(dE/dV/dt)_injection*f_exc
+        x_alpha = 0
+        #x_alpha = (16*np.pi*np.pi*np.pi*const.alphaEM/const.m_e/const.c)*0.4162*4/27/const.A10*const.E21cm/const.TCMB/z1
+        #x_alpha = x_alpha* a*a*BG.dtauda(a)/16*(const.c*const.hbar*2*np.pi)/(const.VH*const.VH*9/16)*#(dE/dV/dt)_injection*f_exc
                 
-            #Tspin = (1+x_c+x_alpha)/(1/Tr+x_c/Tm+x_alpha/Tc)
-            Tspin = Tm
+        #Tspin = (1+x_c+x_alpha)/(1/Tr+x_c/Tm+x_alpha/Tc)
+        Tspin = Tm
 
-            tau_21cm = 3*const.c**3*const.hbar*const.A10*nH/(16*const.kB*const.f21cm**2*Tspin)*BG.dtauda(a)*a**2
+        tau_21cm = 3*const.c**3*const.hbar*const.A10*nH/(16*const.kB*const.f21cm**2*Tspin)*BG.dtauda(a)*a**2
                 
-            arr[i,0] = z1
-            arr[i,1] = xe
-            arr[i,2] = Tspin
-            arr[i,3] = tau_21cm
-            #arr[i,3] = 8.6e-3*(1-xe)*(Tr/Tspin)*np.sqrt((BG.obh2+BG.odmh2)/0.15*z1/10)*BG.obh2/0.02
-            arr[i,4] = (Tspin-Tr)/z1*tau_21cm
-            #arr[i,4] = 23e-3*(1-xe)*(1-Tr/Tspin)*np.sqrt((BG.obh2+BG.odmh2)/0.15*z1/10)*BG.obh2/0.02
-        if(self.verbose>0):
-            np.savetxt(self.root+"_21cm.txt",arr)
-        
-        # For EDGES
-        z_edges=17
-        spl_21cm=interpolate.interp1d(arr[:,0],arr[:,4])
-        self.dT21cm_edges = spl_21cm([z_edges])[0]
+        arr[:,0] = z1
+        arr[:,1] = xe
+        arr[:,2] = Tspin
+        arr[:,3] = tau_21cm
+        #arr[:,3] = 8.6e-3*(1-xe)*(Tr/Tspin)*np.sqrt((BG.obh2+BG.odmh2)/0.15*z1/10)*BG.obh2/0.02
+        arr[:,4] = (Tspin-Tr)/z1*tau_21cm
+        #arr[:,4] = 23e-3*(1-xe)*(1-Tr/Tspin)*np.sqrt((BG.obh2+BG.odmh2)/0.15*z1/10)*BG.obh2/0.02
+        return arr
+
+    def Signal21cm(self,BG,z):
+        # global 21cm signal dT_21cm [K] at any number of target redshifts z
+        if(not hasattr(self,"spl_kappaHH")):
+            self.SetKappa()
+        return self.Tspin(BG,1+np.atleast_1d(np.asarray(z,dtype=float)))[:,4]